@@ -1,13 +1,38 @@
+import hashlib
+from functools import wraps
+from urllib.parse import urlencode
+from uuid import UUID
+
+import numpy as np
 from ninja import NinjaAPI, Router, Schema
+from ninja.security import django_auth
+from django.conf import settings
+from django.core.cache import cache
 from django.shortcuts import get_object_or_404
-
-from .main.models import Question, OpenAIBatch
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from .main import analytics
+from .main.models import (
+    OPENAI_MODEL,
+    Answer,
+    Job,
+    Question,
+    OpenAIBatch,
+    coded_answers,
+    context_hash,
+)
 
 api = NinjaAPI()
 
 chart_router = Router()
 question_router = Router()
 batch_router = Router()
+poll_router = Router()
+job_router = Router()
+
+PAIRS_PAGE_SIZE = 500
+PAIRS_MAX_PAGE_SIZE = 5000
 
 
 class QuestionCreateSchema(Schema):
@@ -25,165 +50,263 @@ def create_question(request, payload: QuestionCreateSchema):
     )
     return api.create_response(request, {"uuid": str(question.uuid)}, status=201)
 
-@chart_router.get("questions/{uuid}/preference-counts")
-def preference_counts(request, uuid: str):
+
+@question_router.get("{uuid}/usage")
+def question_usage(request, uuid: str):
+    """Return request counts, token usage and cost for each run."""
     question = get_object_or_404(Question, uuid=uuid)
-    answers = question.latest_answers()
+    runs = question.usage_by_run()
+    for run in runs:
+        run["created_at"] = run["created_at"].isoformat()
+    return {"model": OPENAI_MODEL, "runs": runs}
+
+
+def cached_chart(view):
+    """Cache a chart endpoint per question run, endpoint and query string.
+
+    The cache key contains the latest run id, the time its batches last
+    changed and a digest of the question's choices and context, so
+    importing results into the run, starting a new run or editing the
+    question invalidates every cached chart of the question. Responses
+    carry an ``ETag`` and ``Last-Modified`` header and revalidation
+    requests are answered with ``304 Not Modified``.
+    """
+
+    @wraps(view)
+    def wrapper(request, uuid: str, **kwargs):
+        question = get_object_or_404(Question, uuid=uuid)
+        state = question.latest_run_state()
+        if state is None or state[1] is None:
+            return view(request, uuid, **kwargs)
+
+        run_id, modified = state
+        params = urlencode(sorted(request.GET.items()))
+        definition = context_hash(question.snapshot())
+        raw_key = (
+            f"{uuid}|{run_id}|{modified.isoformat()}|{definition}|{view.__name__}|{params}"
+        )
+        digest = hashlib.sha1(raw_key.encode("utf-8")).hexdigest()
+        etag = f'"{digest}"'
+        last_modified = int(modified.timestamp())
+
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            cache_key = f"chart:{digest}"
+            payload = cache.get(cache_key)
+            if payload is None:
+                payload = view(request, uuid, **kwargs)
+                timeout = getattr(settings, "POLL_CHART_CACHE_TIMEOUT", 24 * 60 * 60)
+                cache.set(cache_key, payload, timeout)
+            response = api.create_response(request, payload, status=200)
+
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(last_modified)
+        patch_cache_control(response, no_cache=True)
+        return response
+
+    return wrapper
+
+
+def context_params(request, question) -> dict[str, str]:
+    """Return the context filters given in the query string."""
+    return {
+        key: request.GET[key] for key in question.context.keys() if request.GET.get(key)
+    }
 
-    for key in question.context.keys():
-        value = request.GET.get(key)
-        if value:
-            answers = answers.filter(**{f"context__{key}": value})
 
-    counts: dict[str, int] = {}
-    for ans in answers:
-        chosen = ans.choices.get(ans.choice)
-        if chosen:
-            counts[chosen] = counts.get(chosen, 0) + 1
+def latest_frame(request, question) -> analytics.PairFrame:
+    """Return the filtered pairwise frame of the question's latest run."""
+    batch = question.latest_batch()
+    if not batch:
+        return analytics.PairFrame.from_rows(analytics.question_choices(question), [])
+    frame = analytics.run_frame(question, batch.run_id)
+    return frame.filter(context_params(request, question))
+
+
+def latest_confidences(request, question) -> np.ndarray:
+    """Return the confidences of the filtered answers of the latest run."""
+    batch = question.latest_batch()
+    if not batch:
+        return np.empty(0)
+    codebook = question.codebook(batch.run_id)
+    answers = codebook.filter(
+        coded_answers(Answer.objects.filter(question=question, run_id=batch.run_id)),
+        context_params(request, question),
+    )
+    return analytics.answer_confidences(answers)
 
-    return {"counts": counts}
+
+@chart_router.get("questions/{uuid}/preference-counts")
+@cached_chart
+def preference_counts(request, uuid: str):
+    question = get_object_or_404(Question, uuid=uuid)
+    frame = latest_frame(request, question)
+    return {"counts": analytics.win_counts(frame)}
 
 
 @chart_router.get("questions/{uuid}/preference-heatmap")
+@cached_chart
 def preference_heatmap(request, uuid: str):
     """Return head-to-head win counts for all choice pairs."""
     question = get_object_or_404(Question, uuid=uuid)
-    answers = question.latest_answers()
-
-    for key in question.context.keys():
-        value = request.GET.get(key)
-        if value:
-            answers = answers.filter(**{f"context__{key}": value})
-
-    choices = list(dict.fromkeys(question.choices or []))
-    index = {c: i for i, c in enumerate(choices)}
-    size = len(choices)
-    matrix: list[list[int | None]] = [
-        [None if i == j else 0 for j in range(size)] for i in range(size)
-    ]
-
-    for ans in answers:
-        a = ans.choices.get("A")
-        b = ans.choices.get("B")
-        if a not in index or b not in index:
-            continue
-        if ans.choice == "A":
-            matrix[index[a]][index[b]] += 1  # type: ignore[operator]
-        elif ans.choice == "B":
-            matrix[index[b]][index[a]] += 1  # type: ignore[operator]
-
-    return {"choices": choices, "matrix": matrix}
+    frame = latest_frame(request, question)
+    return {"choices": frame.choices, "matrix": analytics.heatmap(frame)}
 
 
 @chart_router.get("questions/{uuid}/elo-ratings")
-def elo_ratings(request, uuid: str):
-    """Return Elo-style rankings for all choices."""
-    question = get_object_or_404(Question, uuid=uuid)
-    answers = question.latest_answers().order_by("pk")
-
-    for key in question.context.keys():
-        value = request.GET.get(key)
-        if value:
-            answers = answers.filter(**{f"context__{key}": value})
-
-    choices = list(dict.fromkeys(question.choices or []))
-    ratings: dict[str, float] = {c: 1000.0 for c in choices}
-    K = 32
-
-    for ans in answers:
-        a = ans.choices.get("A")
-        b = ans.choices.get("B")
-        if a not in ratings or b not in ratings:
-            continue
-        ra = ratings[a]
-        rb = ratings[b]
-        expected_a = 1 / (1 + 10 ** ((rb - ra) / 400))
-        expected_b = 1 - expected_a
-        if ans.choice == "A":
-            sa, sb = 1, 0
-        elif ans.choice == "B":
-            sa, sb = 0, 1
-        else:
-            continue
-        ratings[a] = ra + K * (sa - expected_a)
-        ratings[b] = rb + K * (sb - expected_b)
-
-    ranking = sorted(
-        ({"choice": c, "rating": round(r, 2)} for c, r in ratings.items()),
-        key=lambda x: x["rating"],
-        reverse=True,
-    )
+@cached_chart
+def elo_ratings(request, uuid: str, ci: bool = False):
+    """Return Bradley–Terry rankings for all choices on an Elo scale.
 
-    return {"rankings": ranking}
+    Pass ``ci=true`` to include 95% confidence intervals.
+    """
+    question = get_object_or_404(Question, uuid=uuid)
+    frame = latest_frame(request, question)
+    return {"rankings": analytics.ratings(frame, with_ci=ci)}
 
 
 @chart_router.get("questions/{uuid}/confidence-distribution")
+@cached_chart
 def confidence_distribution(request, uuid: str):
     """Return histogram counts for answer confidences (0-1)."""
     question = get_object_or_404(Question, uuid=uuid)
-    answers = question.latest_answers()
-
-    for key in question.context.keys():
-        value = request.GET.get(key)
-        if value:
-            answers = answers.filter(**{f"context__{key}": value})
-
-    bins = [0] * 10
-    for ans in answers:
-        if ans.confidence is None:
-            continue
-        idx = int(min(max(ans.confidence, 0), 0.999) * 10)
-        bins[idx] += 1
-
-    labels = [f"{i/10:.1f}-{(i+1)/10:.1f}" for i in range(10)]
-    return {"labels": labels, "counts": bins}
+    bins = analytics.confidence_histogram(latest_confidences(request, question))
+    return {"labels": analytics.confidence_labels(), "counts": bins}
 
 
 @chart_router.get("questions/{uuid}/preference-flows")
+@cached_chart
 def preference_flows(request, uuid: str):
     """Return directed win counts for Sankey diagrams."""
     question = get_object_or_404(Question, uuid=uuid)
-    answers = question.latest_answers()
-
-    for key in question.context.keys():
-        value = request.GET.get(key)
-        if value:
-            answers = answers.filter(**{f"context__{key}": value})
-
-    flows: dict[tuple[str, str], int] = {}
-    order: list[str] = []
-    for ans in answers:
-        a = ans.choices.get("A")
-        b = ans.choices.get("B")
-        if not a or not b:
-            continue
-        if ans.choice == "A":
-            pair = (a, b)
-        elif ans.choice == "B":
-            pair = (b, a)
-        else:
-            continue
-        flows[pair] = flows.get(pair, 0) + 1
-        order.extend([a, b])
-
-    labels = list(dict.fromkeys(order))
-    links = [
-        {"from": src, "to": dst, "flow": cnt} for (src, dst), cnt in flows.items()
-    ]
+    labels, links = analytics.flows(latest_frame(request, question))
     return {"labels": labels, "links": links}
 
 
+@chart_router.get("questions/{uuid}/dashboard")
+@cached_chart
+def dashboard(request, uuid: str, ci: bool = False):
+    """Return the payloads of all result charts in one response.
+
+    The pairwise charts are computed from one edge frame of the latest run;
+    only the confidence histogram reads the answers.
+    """
+    question = get_object_or_404(Question, uuid=uuid)
+    return analytics.dashboard(
+        latest_frame(request, question),
+        with_ci=ci,
+        confidence=latest_confidences(request, question),
+    )
+
+
+# Raw answers, like the CSV export, are only for signed in users.
+@poll_router.get("{uuid}/pairs", auth=django_auth)
+def poll_pairs(
+    request,
+    uuid: str,
+    run_id: UUID | None = None,
+    cursor: int | None = None,
+    limit: int = PAIRS_PAGE_SIZE,
+    columnar: bool = False,
+):
+    """Return raw pairwise answers of a run, one page at a time.
+
+    Pages are keyed on the answer id: pass the returned ``next_cursor`` as
+    ``cursor`` to get the following page, so deep pages cost the same as
+    the first. ``run_id`` defaults to the latest run and context filters
+    are given as ``key=value`` query parameters.
+
+    With ``columnar=true`` the page is returned as parallel arrays of
+    integer codes plus the ``choices`` and ``contexts`` they index into.
+    """
+    question = get_object_or_404(Question, uuid=uuid)
+    if run_id is None:
+        batch = question.latest_batch()
+        run_id = batch.run_id if batch else None
+    limit = min(max(limit, 1), PAIRS_MAX_PAGE_SIZE)
+
+    codebook = question.codebook(run_id)
+    answers = codebook.filter(
+        Answer.objects.filter(question=question, run_id=run_id),
+        context_params(request, question),
+    )
+    if cursor is not None:
+        answers = answers.filter(pk__gt=cursor)
+    answers = answers.order_by("pk")
+
+    if columnar:
+        rows = list(
+            answers.values_list(
+                "pk", "context_idx", "choice_a_idx", "choice_b_idx", "winner_idx", "confidence"
+            )[: limit + 1]
+        )
+    else:
+        rows = list(
+            answers.values_list("pk", "context", "choices", "choice", "confidence")[: limit + 1]
+        )
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    page = {
+        "run_id": str(run_id) if run_id else None,
+        "next_cursor": rows[-1][0] if has_more else None,
+    }
+
+    if not columnar:
+        page["results"] = [
+            {
+                "id": pk,
+                "context": context,
+                "choice_a": choices.get("A"),
+                "choice_b": choices.get("B"),
+                "choice": choice,
+                "winner": choices.get(choice),
+                "confidence": confidence,
+            }
+            for pk, context, choices, choice, confidence in rows
+        ]
+        return page
+
+    names = ["id", "context", "choice_a", "choice_b", "winner", "confidence"]
+    columns = [list(column) for column in zip(*rows)] or [[] for _ in names]
+    contexts = {}
+    for idx in set(columns[1]):
+        if idx is not None:
+            try:
+                contexts[str(idx)] = codebook.combination(idx)
+            except IndexError:
+                continue
+    page["choices"] = codebook.choices
+    page["contexts"] = contexts
+    page["columns"] = dict(zip(names, columns))
+    return page
+
+
 @batch_router.post("{batch_id}/update-status")
 def update_batch_status(request, batch_id: str):
-    """Refresh and return status info for an OpenAI batch."""
+    """Refresh and return status info for an OpenAI batch.
+
+    Results of a completed batch are imported by a background job.
+    """
     batch = get_object_or_404(OpenAIBatch, data__id=batch_id)
-    batch.update_status()
+    batch.update_status(defer_import=True)
     return {
         "batch_id": batch.batch_id,
         "status": batch.status,
+        "imported": batch.imported_at is not None,
         "updated_at": batch.updated_at.isoformat(),
     }
 
+
+@job_router.get("{job_id}")
+def job_status(request, job_id: int):
+    """Return the status, attempts and last error of a background job."""
+    return get_object_or_404(Job, pk=job_id).as_dict()
+
 api.add_router("/charts/", chart_router)
 api.add_router("/questions/", question_router)
 api.add_router("/batches/", batch_router)
+api.add_router("/polls/", poll_router)
+api.add_router("/jobs/", job_router)
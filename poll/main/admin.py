@@ -1,10 +1,10 @@
 from django.contrib import admin
 from django.contrib import messages
-from django.http import HttpResponse
-import csv
-import json
+from django.db import transaction
+from django.utils import timezone
 
-from .models import Question, Answer, OpenAIBatch
+from . import exports
+from .models import Question, Answer, OpenAIBatch, GraphEdge, Job
 
 
 @admin.register(Question)
@@ -13,14 +13,30 @@ class QuestionAdmin(admin.ModelAdmin):
     list_filter = ["status"]
     actions = [
         'submit_openai_batch',
+        'submit_incremental_openai_batch',
     ]
 
-    def submit_openai_batch(self, request, queryset):
+    def queue_submissions(self, request, queryset, **payload):
+        queued = []
         for question in queryset:
-            question.submit_batches()
-        messages.success(request, f"Batches submitted successfully")
+            try:
+                Job.enqueue("submit_batches", question=question, max_attempts=1, **payload)
+            except ValueError as exc:
+                messages.error(request, f"{question}: {exc}")
+            else:
+                queued.append(question.pk)
+        return Question.objects.filter(pk__in=queued).update(status="queued")
+
+    def submit_openai_batch(self, request, queryset):
+        if self.queue_submissions(request, queryset):
+            messages.success(request, f"Batch submission queued")
     submit_openai_batch.short_description = "Submit OpenAI batches"
 
+    def submit_incremental_openai_batch(self, request, queryset):
+        if self.queue_submissions(request, queryset, incremental=True):
+            messages.success(request, f"Incremental batch submission queued")
+    submit_incremental_openai_batch.short_description = "Submit OpenAI batches for new choices and context values"
+
 
 @admin.register(Answer)
 class AnswerAdmin(admin.ModelAdmin):
@@ -29,6 +45,8 @@ class AnswerAdmin(admin.ModelAdmin):
 
     actions = [
         "download_csv",
+        "download_ndjson",
+        "download_parquet",
     ]
 
     class ConfidenceFilter(admin.SimpleListFilter):
@@ -52,23 +70,29 @@ class AnswerAdmin(admin.ModelAdmin):
 
     list_filter = [ConfidenceFilter]
 
+    def delete_queryset(self, request, queryset):
+        # Bulk deletes skip Answer.delete, so rebuild the affected runs' edges.
+        runs = set(queryset.values_list("question_id", "run_id").distinct())
+        with transaction.atomic():
+            super().delete_queryset(request, queryset)
+            for question_id, run_id in runs:
+                GraphEdge.rebuild(question_id, run_id)
+
     def download_csv(self, request, queryset):
-        response = HttpResponse(content_type="text/csv")
-        response["Content-Disposition"] = "attachment; filename=answers.csv"
-        writer = csv.writer(response)
-        writer.writerow(["question", "context", "choices", "choice", "confidence", "run_id"])
-        for answer in queryset:
-            writer.writerow([
-                answer.question.text,
-                json.dumps(answer.context, ensure_ascii=False),
-                json.dumps(answer.choices, ensure_ascii=False),
-                answer.choice,
-                answer.confidence,
-                answer.run_id,
-            ])
-        return response
+        return exports.export_response(queryset.order_by("pk"), "csv")
     download_csv.short_description = "Download selected answers as CSV"
 
+    def download_ndjson(self, request, queryset):
+        return exports.export_response(queryset.order_by("pk"), "ndjson")
+    download_ndjson.short_description = "Download selected answers as NDJSON"
+
+    def download_parquet(self, request, queryset):
+        try:
+            return exports.export_response(queryset.order_by("pk"), "parquet")
+        except ValueError:
+            messages.error(request, "Parquet export requires the pyarrow package")
+    download_parquet.short_description = "Download selected answers as Parquet"
+
 
 @admin.register(OpenAIBatch)
 class OpenAIBatchAdmin(admin.ModelAdmin):
@@ -80,12 +104,29 @@ class OpenAIBatchAdmin(admin.ModelAdmin):
 
     def update_status(self, request, queryset):
         for batch in queryset:
-            batch.update_status()
-        messages.success(request, f"Batch statuses updated successfully")
+            Job.enqueue("update_batch", question=batch.question, batch=batch)
+        messages.success(request, f"Batch status updates queued")
     update_status.short_description = "Update batch statuses"
 
     def retrieve_results(self, request, queryset):
         for batch in queryset:
-            batch.retrieve_results()
-        messages.success(request, f"Batch results retrieved successfully")
+            try:
+                Job.enqueue("import_batch", question=batch.question, batch=batch, force=True)
+            except ValueError as exc:
+                messages.error(request, f"{batch.batch_id}: {exc}")
+        messages.success(request, f"Batch result imports queued")
     retrieve_results.short_description = "Retrieve batch results"
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ["kind", "status", "question", "batch", "attempts", "run_after", "finished_at"]
+    list_filter = ["status", "kind"]
+    actions = ["retry"]
+
+    def retry(self, request, queryset):
+        queryset.exclude(status="running").update(
+            status="queued", attempts=0, run_after=timezone.now(), finished_at=None
+        )
+        messages.success(request, f"Jobs queued again")
+    retry.short_description = "Run selected jobs again"
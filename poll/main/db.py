@@ -0,0 +1,38 @@
+"""Per-connection database setup."""
+
+import re
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+
+PRAGMA_NAME = re.compile(r"^[a-z_]+$")
+PRAGMA_VALUE = re.compile(r"^(-?\d+|[A-Za-z]+)$")
+
+
+def sqlite_pragmas() -> dict:
+    return getattr(settings, "POLL_SQLITE_PRAGMAS", {})
+
+
+def apply_pragmas(connection, pragmas: dict) -> None:
+    """Run ``PRAGMA name = value`` on ``connection`` for each of ``pragmas``.
+
+    ``busy_timeout`` is applied first so that switching the journal mode
+    waits for other connections instead of failing.
+    """
+    names = sorted(pragmas, key=lambda name: name != "busy_timeout")
+    with connection.cursor() as cursor:
+        for name in names:
+            value = str(pragmas[name])
+            if not PRAGMA_NAME.match(name) or not PRAGMA_VALUE.match(value):
+                raise ImproperlyConfigured(f"Invalid SQLite pragma {name}={value}")
+            cursor.execute(f"PRAGMA {name} = {value}")
+
+
+def configure_sqlite(sender, connection, **kwargs) -> None:
+    """Apply ``POLL_SQLITE_PRAGMAS`` to every new SQLite connection.
+
+    Connected to ``connection_created`` in :class:`poll.main.apps.MainConfig`.
+    """
+    if connection.vendor == "sqlite":
+        apply_pragmas(connection, sqlite_pragmas())
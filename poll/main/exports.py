@@ -0,0 +1,211 @@
+"""Streaming exports of :class:`Answer` querysets.
+
+Answers are read with ``iterator(chunk_size=...)`` and encoded one chunk
+at a time, so an export holds a single chunk in memory whatever the size
+of the run. Question texts are looked up once per question rather than
+once per answer.
+
+CSV and NDJSON are always available. The columnar ``parquet`` and
+``arrow`` (Arrow IPC stream) formats need the optional ``pyarrow``
+package.
+"""
+
+import csv
+import io
+import json
+from typing import Iterable, Iterator
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover - optional dependency
+    pyarrow = None
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+
+from .models import Question
+
+
+DEFAULT_CHUNK_SIZE = 5_000
+
+COLUMNS = ["question", "context", "choices", "choice", "confidence", "run_id"]
+
+# json.dumps builds a new encoder on every call when given keyword
+# arguments; one shared encoder is noticeably cheaper per row.
+encode_json = json.JSONEncoder(ensure_ascii=False, separators=(", ", ": ")).encode
+
+
+def iter_rows(answers, chunk_size: int) -> Iterator[tuple]:
+    """Yield ``(question, context, choices, choice, confidence, run_id)``."""
+    texts: dict[int, str] = {}
+    values = answers.values_list(
+        "question_id", "context", "choices", "choice", "confidence", "run_id"
+    )
+    for question_id, context, choices, choice, confidence, run_id in values.iterator(
+        chunk_size=chunk_size
+    ):
+        text = texts.get(question_id)
+        if text is None:
+            text = texts[question_id] = (
+                Question.objects.filter(pk=question_id).values_list("text", flat=True).first()
+                or ""
+            )
+        yield text, context, choices, choice, confidence, run_id
+
+
+def iter_chunks(rows: Iterable[tuple], size: int) -> Iterator[list[tuple]]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def csv_stream(chunks: Iterable[list[tuple]]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for chunk in chunks:
+        writer.writerows(
+            (text, encode_json(context), encode_json(choices), choice, confidence, run_id)
+            for text, context, choices, choice, confidence, run_id in chunk
+        )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def ndjson_stream(chunks: Iterable[list[tuple]]) -> Iterator[str]:
+    for chunk in chunks:
+        yield "".join(
+            encode_json(
+                {
+                    "question": text,
+                    "context": context,
+                    "choices": choices,
+                    "choice": choice,
+                    "confidence": confidence,
+                    "run_id": str(run_id) if run_id else None,
+                }
+            )
+            + "\n"
+            for text, context, choices, choice, confidence, run_id in chunk
+        )
+
+
+def arrow_schema():
+    return pyarrow.schema(
+        [
+            ("question", pyarrow.string()),
+            ("context", pyarrow.string()),
+            ("choices", pyarrow.string()),
+            ("choice", pyarrow.string()),
+            ("confidence", pyarrow.float64()),
+            ("run_id", pyarrow.string()),
+        ]
+    )
+
+
+def arrow_batch(chunk: list[tuple], schema):
+    text, context, choices, choice, confidence, run_id = zip(*chunk)
+    return pyarrow.record_batch(
+        [
+            list(text),
+            [encode_json(c) for c in context],
+            [encode_json(c) for c in choices],
+            list(choice),
+            list(confidence),
+            [str(r) if r else None for r in run_id],
+        ],
+        schema=schema,
+    )
+
+
+class ChunkSink(io.RawIOBase):
+    """Writable file that hands out what was written since the last drain."""
+
+    def __init__(self):
+        self.parts: list[bytes] = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.parts.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts.clear()
+        return data
+
+
+def parquet_stream(chunks: Iterable[list[tuple]]) -> Iterator[bytes]:
+    """Write one Parquet row group per chunk."""
+    schema = arrow_schema()
+    sink = ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    for chunk in chunks:
+        writer.write_batch(arrow_batch(chunk, schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def arrow_stream(chunks: Iterable[list[tuple]]) -> Iterator[bytes]:
+    """Write an Arrow IPC stream with one record batch per chunk."""
+    schema = arrow_schema()
+    sink = ChunkSink()
+    writer = pyarrow.ipc.new_stream(sink, schema)
+    for chunk in chunks:
+        writer.write_batch(arrow_batch(chunk, schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+FORMATS = {
+    "csv": ("text/csv", csv_stream),
+    "ndjson": ("application/x-ndjson", ndjson_stream),
+    "parquet": ("application/vnd.apache.parquet", parquet_stream),
+    "arrow": ("application/vnd.apache.arrow.stream", arrow_stream),
+}
+COLUMNAR_FORMATS = {"parquet", "arrow"}
+
+
+def available_formats() -> list[str]:
+    if pyarrow is None:
+        return [fmt for fmt in FORMATS if fmt not in COLUMNAR_FORMATS]
+    return list(FORMATS)
+
+
+def export_response(
+    answers, fmt: str = "csv", filename: str = "answers", chunk_size: int | None = None
+) -> StreamingHttpResponse:
+    """Return a streaming download of ``answers`` in ``fmt``.
+
+    Raises :class:`ValueError` for unknown formats and for columnar
+    formats when ``pyarrow`` is not installed.
+    """
+    if fmt not in available_formats():
+        raise ValueError(f"Unsupported export format: {fmt}")
+
+    chunk_size = chunk_size or getattr(settings, "POLL_EXPORT_CHUNK_SIZE", DEFAULT_CHUNK_SIZE)
+    content_type, stream = FORMATS[fmt]
+    chunks = iter_chunks(iter_rows(answers, chunk_size), chunk_size)
+
+    response = StreamingHttpResponse(stream(chunks), content_type=content_type)
+    response["Content-Disposition"] = f"attachment; filename={filename}.{fmt}"
+    return response
@@ -0,0 +1,373 @@
+"""A local stand-in for the OpenAI Files and Batches API.
+
+:class:`FakeOpenAI` keeps uploaded files and batches in memory and
+simulates batch progress over time: a batch validates for ``latency``
+seconds, completes ``rate`` requests per second and then finalizes for
+another ``latency`` seconds. Its output file is generated when it
+completes, with a random ``ABResponse`` and a token ``usage`` block for
+every request of the input file.
+
+:func:`make_server` serves the subset of ``/v1/files`` and ``/v1/batches``
+used by this project, so an ``openai.OpenAI`` client with
+``base_url="http://<host>:<port>/v1"`` can submit, poll and download
+against it. Run it with ``manage.py fake_openai`` and point
+``OPENAI_BASE_URL`` there to benchmark the whole pipeline locally.
+"""
+
+import json
+import random
+import re
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from uuid import uuid4
+
+
+CACHE_BLOCK = 128
+CACHE_MINIMUM = 1024
+
+
+class FakeOpenAI:
+    """In-memory files and batches with simulated progress.
+
+    Parameters
+    ----------
+    latency : float
+        Seconds a batch spends validating and, again, finalizing.
+    rate : float
+        Requests completed per second while a batch is in progress.
+    failure_rate : float
+        Share of requests written to the error file instead of the output.
+    seed : int, optional
+        Seed of the random answers, for reproducible runs.
+    """
+
+    def __init__(
+        self,
+        latency: float = 1.0,
+        rate: float = 10_000.0,
+        failure_rate: float = 0.0,
+        seed: int | None = None,
+    ):
+        self.latency = latency
+        self.rate = rate
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.files: dict[str, dict] = {}
+        self.contents: dict[str, bytes] = {}
+        self.batches: dict[str, dict] = {}
+        self.started: dict[str, float] = {}
+        self.cache_keys: set[str] = set()
+        self.lock = threading.Lock()
+
+    def create_file(self, filename: str, purpose: str, content: bytes) -> dict:
+        file_id = f"file-{uuid4().hex}"
+        with self.lock:
+            self.contents[file_id] = content
+            self.files[file_id] = {
+                "id": file_id,
+                "object": "file",
+                "bytes": len(content),
+                "created_at": int(time.time()),
+                "filename": filename,
+                "purpose": purpose,
+                "status": "processed",
+            }
+            return self.files[file_id]
+
+    def file(self, file_id: str) -> dict | None:
+        return self.files.get(file_id)
+
+    def file_content(self, file_id: str) -> bytes | None:
+        return self.contents.get(file_id)
+
+    def create_batch(
+        self,
+        input_file_id: str,
+        endpoint: str,
+        completion_window: str,
+        metadata: dict | None = None,
+    ) -> dict | None:
+        content = self.contents.get(input_file_id)
+        if content is None:
+            return None
+        batch_id = f"batch_{uuid4().hex}"
+        total = sum(1 for line in content.splitlines() if line.strip())
+        with self.lock:
+            self.started[batch_id] = time.monotonic()
+            self.batches[batch_id] = {
+                "id": batch_id,
+                "object": "batch",
+                "endpoint": endpoint,
+                "input_file_id": input_file_id,
+                "completion_window": completion_window,
+                "status": "validating",
+                "created_at": int(time.time()),
+                "metadata": metadata,
+                "request_counts": {"total": total, "completed": 0, "failed": 0},
+            }
+            return self.batches[batch_id]
+
+    def batch(self, batch_id: str) -> dict | None:
+        """Return the batch, advanced to its state at the current time."""
+        with self.lock:
+            batch = self.batches.get(batch_id)
+            if batch is not None:
+                self.advance(batch)
+            return batch
+
+    def cancel_batch(self, batch_id: str) -> dict | None:
+        with self.lock:
+            batch = self.batches.get(batch_id)
+            if batch is not None and batch["status"] not in ("completed", "failed"):
+                batch["status"] = "cancelled"
+                batch["cancelled_at"] = int(time.time())
+            return batch
+
+    def advance(self, batch: dict) -> None:
+        if batch["status"] in ("completed", "failed", "cancelled", "expired"):
+            return
+        elapsed = time.monotonic() - self.started[batch["id"]]
+        counts = batch["request_counts"]
+        total = counts["total"]
+        running = elapsed - self.latency
+        if running < 0:
+            return
+
+        now = int(time.time())
+        batch.setdefault("in_progress_at", now)
+        done = min(total, int(running * self.rate))
+        if done < total:
+            batch["status"] = "in_progress"
+            counts["completed"] = done
+            return
+
+        batch.setdefault("finalizing_at", now)
+        if running < total / self.rate + self.latency:
+            batch["status"] = "finalizing"
+            counts["completed"] = total
+            return
+
+        output, errors, failed = self.build_output(self.contents[batch["input_file_id"]])
+        batch["output_file_id"] = self.store(f"{batch['id']}_output.jsonl", output)
+        if errors:
+            batch["error_file_id"] = self.store(f"{batch['id']}_errors.jsonl", errors)
+        counts["completed"] = total - failed
+        counts["failed"] = failed
+        batch["status"] = "completed"
+        batch["completed_at"] = now
+
+    def store(self, filename: str, content: bytes) -> str:
+        file_id = f"file-{uuid4().hex}"
+        self.contents[file_id] = content
+        self.files[file_id] = {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": "batch_output",
+            "status": "processed",
+        }
+        return file_id
+
+    def build_output(self, content: bytes) -> tuple[bytes, bytes, int]:
+        """Answer every request line of ``content``.
+
+        Returns the output and error file contents and the failure count.
+        """
+        output, errors = [], []
+        for line in content.splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            custom_id = request.get("custom_id")
+            if self.rng.random() < self.failure_rate:
+                errors.append({
+                    "id": f"batch_req_{uuid4().hex}",
+                    "custom_id": custom_id,
+                    "response": None,
+                    "error": {"code": "server_error", "message": "Simulated failure"},
+                })
+                continue
+            output.append({
+                "id": f"batch_req_{uuid4().hex}",
+                "custom_id": custom_id,
+                "response": {
+                    "status_code": 200,
+                    "request_id": uuid4().hex,
+                    "body": self.completion(request.get("body") or {}),
+                },
+                "error": None,
+            })
+        encode = lambda entries: "".join(json.dumps(e) + "\n" for e in entries).encode()
+        return encode(output), encode(errors), len(errors)
+
+    def completion(self, body: dict) -> dict:
+        answer = {
+            "answer": self.rng.choice("AB"),
+            "confidence": round(self.rng.random(), 2),
+        }
+        content = json.dumps(answer)
+        return {
+            "id": f"chatcmpl-{uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", ""),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": self.usage(body, content),
+        }
+
+    def usage(self, body: dict, content: str) -> dict:
+        """Estimate token usage at four characters per token.
+
+        Every prompt after the first with the same ``prompt_cache_key`` is
+        counted as cached in whole blocks, so the simulated cache hit rate
+        is an upper bound of what the provider would report.
+        """
+        prompt = len(json.dumps(body.get("messages", []))) // 4
+        cached = 0
+        key = body.get("prompt_cache_key")
+        if key is not None:
+            if key in self.cache_keys and prompt >= CACHE_MINIMUM:
+                cached = prompt - prompt % CACHE_BLOCK
+            self.cache_keys.add(key)
+        completion = len(content) // 4
+        return {
+            "prompt_tokens": prompt,
+            "completion_tokens": completion,
+            "total_tokens": prompt + completion,
+            "prompt_tokens_details": {"cached_tokens": cached},
+        }
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    routes = [
+        ("POST", re.compile(r"/v1/files$"), "upload_file"),
+        ("GET", re.compile(r"/v1/files/(?P<file_id>[\w-]+)$"), "get_file"),
+        ("GET", re.compile(r"/v1/files/(?P<file_id>[\w-]+)/content$"), "get_content"),
+        ("POST", re.compile(r"/v1/batches$"), "create_batch"),
+        ("GET", re.compile(r"/v1/batches/(?P<batch_id>\w+)$"), "get_batch"),
+        ("POST", re.compile(r"/v1/batches/(?P<batch_id>\w+)/cancel$"), "cancel_batch"),
+    ]
+
+    @property
+    def fake(self) -> FakeOpenAI:
+        return self.server.fake
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def dispatch(self, method: str) -> None:
+        path = self.path.split("?", 1)[0]
+        for route_method, pattern, name in self.routes:
+            match = pattern.match(path)
+            if route_method == method and match:
+                return getattr(self, name)(**match.groupdict())
+        self.read_body()
+        self.send_error_json(404, f"Unknown route {method} {path}")
+
+    def read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def send_json(self, data: dict, status: int = 200) -> None:
+        self.send_bytes(json.dumps(data).encode(), "application/json", status)
+
+    def send_error_json(self, status: int, message: str) -> None:
+        error = {"message": message, "type": "invalid_request_error", "code": None}
+        self.send_json({"error": error}, status)
+
+    def send_bytes(self, body: bytes, content_type: str, status: int = 200) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def upload_file(self):
+        body = self.read_body()
+        header = f"Content-Type: {self.headers.get('Content-Type', '')}\r\n\r\n"
+        message = BytesParser(policy=HTTP).parsebytes(header.encode() + body)
+        fields, filename, content = {}, "upload.jsonl", None
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if name == "file":
+                filename = part.get_filename() or filename
+                content = part.get_payload(decode=True)
+            else:
+                fields[name] = part.get_content().strip()
+        if content is None:
+            return self.send_error_json(400, "Missing file")
+        self.send_json(self.fake.create_file(filename, fields.get("purpose", "batch"), content))
+
+    def get_file(self, file_id):
+        file = self.fake.file(file_id)
+        if file is None:
+            return self.send_error_json(404, f"No such file {file_id}")
+        self.send_json(file)
+
+    def get_content(self, file_id):
+        content = self.fake.file_content(file_id)
+        if content is None:
+            return self.send_error_json(404, f"No such file {file_id}")
+        self.send_bytes(content, "application/octet-stream")
+
+    def create_batch(self):
+        payload = json.loads(self.read_body() or b"{}")
+        batch = self.fake.create_batch(
+            payload.get("input_file_id", ""),
+            payload.get("endpoint", "/v1/chat/completions"),
+            payload.get("completion_window", "24h"),
+            payload.get("metadata"),
+        )
+        if batch is None:
+            return self.send_error_json(400, "Unknown input_file_id")
+        self.send_json(batch)
+
+    def get_batch(self, batch_id):
+        batch = self.fake.batch(batch_id)
+        if batch is None:
+            return self.send_error_json(404, f"No such batch {batch_id}")
+        self.send_json(batch)
+
+    def cancel_batch(self, batch_id):
+        self.read_body()
+        batch = self.fake.cancel_batch(batch_id)
+        if batch is None:
+            return self.send_error_json(404, f"No such batch {batch_id}")
+        self.send_json(batch)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def make_server(
+    fake: FakeOpenAI | None = None,
+    host: str = "127.0.0.1",
+    port: int = 0,
+    verbose: bool = False,
+) -> ThreadingHTTPServer:
+    """Return a threaded HTTP server for ``fake``; port 0 picks a free one."""
+    server = ThreadingHTTPServer((host, port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.fake = fake or FakeOpenAI()
+    server.verbose = verbose
+    return server
+
+
+def base_url(server: ThreadingHTTPServer) -> str:
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}/v1"
@@ -14,9 +14,13 @@ class QuestionForm(forms.ModelForm):
 
     class Meta:
         model = Question
-        fields = ['text', 'context', 'choices']
+        fields = ['text', 'context', 'choices', 'sample_size', 'sample_fraction']
         widgets = {
             'text': forms.Textarea(attrs={'rows': 3, 'class': 'form-control'}),
+            'sample_size': forms.NumberInput(attrs={'class': 'form-control', 'min': 1}),
+            'sample_fraction': forms.NumberInput(
+                attrs={'class': 'form-control', 'min': 0, 'max': 1, 'step': 0.01}
+            ),
         }
 
     def __init__(self, *args, **kwargs):
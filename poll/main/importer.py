@@ -0,0 +1,634 @@
+"""Streaming import of OpenAI batch output files into :class:`Answer` rows."""
+
+import json
+import multiprocessing
+import os
+import time
+from dataclasses import dataclass
+from typing import Iterable, Iterator
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - not available on Windows
+    resource = None
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import (
+    Answer,
+    Codebook,
+    GraphEdge,
+    OpenAIBatch,
+    Question,
+    decode_custom_id,
+    openai_client,
+)
+
+
+DEFAULT_CHUNK_SIZE = 2_000
+
+
+def peak_memory_kb() -> int | None:
+    """Return the peak resident set size of this process in KiB."""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+@dataclass
+class ImportStats:
+    """Counters collected while importing one output file."""
+
+    lines: int = 0
+    answers: int = 0
+    skipped: int = 0
+    duplicates: int = 0
+    seconds: float = 0.0
+    peak_memory_kb: int | None = None
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    completion_tokens: int = 0
+
+    @property
+    def rows_per_second(self) -> float:
+        if not self.seconds:
+            return 0.0
+        return self.answers / self.seconds
+
+    @property
+    def cache_hit_rate(self) -> float:
+        """Share of prompt tokens served from the provider's prompt cache."""
+        if not self.prompt_tokens:
+            return 0.0
+        return self.cached_tokens / self.prompt_tokens
+
+    def add_usage(self, entry: dict) -> None:
+        """Add the token ``usage`` reported in a batch output entry."""
+        body = (entry.get("response") or {}).get("body") or {}
+        usage = body.get("usage") or {}
+        details = usage.get("prompt_tokens_details") or {}
+        self.prompt_tokens += usage.get("prompt_tokens") or 0
+        self.cached_tokens += details.get("cached_tokens") or 0
+        self.completion_tokens += usage.get("completion_tokens") or 0
+
+    def merge(self, other: "ImportStats") -> None:
+        """Add the counters of ``other``, e.g. another file of the run."""
+        for name in (
+            "lines", "answers", "skipped", "duplicates",
+            "prompt_tokens", "cached_tokens", "completion_tokens",
+        ):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def as_dict(self) -> dict:
+        return {
+            "lines": self.lines,
+            "answers": self.answers,
+            "skipped": self.skipped,
+            "duplicates": self.duplicates,
+            "seconds": round(self.seconds, 3),
+            "rows_per_second": round(self.rows_per_second, 1),
+            "peak_memory_kb": self.peak_memory_kb,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cache_hit_rate": round(self.cache_hit_rate, 3),
+        }
+
+    def __str__(self) -> str:
+        return (
+            f"{self.answers} answers from {self.lines} lines "
+            f"({self.skipped} skipped) in {self.seconds:.2f}s, "
+            f"{self.rows_per_second:.0f} rows/s, "
+            f"peak memory {self.peak_memory_kb} KiB, "
+            f"{self.cached_tokens} of {self.prompt_tokens} prompt tokens cached"
+        )
+
+
+COPY_COLUMNS = [
+    "question_id",
+    "run_id",
+    "context",
+    "choices",
+    "choice",
+    "confidence",
+    "context_idx",
+    "choice_a_idx",
+    "choice_b_idx",
+    "winner_idx",
+]
+
+
+def use_copy() -> bool:
+    """Return whether answers can be written with ``COPY FROM STDIN``."""
+    if connection.vendor != "postgresql" or not getattr(settings, "POLL_IMPORT_COPY", True):
+        return False
+    from django.db.backends.postgresql.psycopg_any import is_psycopg3
+
+    return is_psycopg3
+
+
+def copy_answers(answers: list[Answer]) -> None:
+    """Write ``answers`` with one ``COPY`` statement (PostgreSQL only).
+
+    Unlike ``bulk_create`` the answers do not get their primary keys.
+    """
+    quote = connection.ops.quote_name
+    columns = ", ".join(quote(column) for column in COPY_COLUMNS)
+    sql = f"COPY {quote(Answer._meta.db_table)} ({columns}) FROM STDIN"
+    with connection.cursor() as cursor, cursor.copy(sql) as copy:
+        for answer in answers:
+            copy.write_row((
+                answer.question_id,
+                answer.run_id,
+                json.dumps(answer.context),
+                json.dumps(answer.choices),
+                answer.choice,
+                answer.confidence,
+                answer.context_idx,
+                answer.choice_a_idx,
+                answer.choice_b_idx,
+                answer.winner_idx,
+            ))
+
+
+def write_answers(answers: list[Answer], batch_size: int) -> None:
+    if use_copy():
+        copy_answers(answers)
+    else:
+        Answer.objects.bulk_create(answers, batch_size=batch_size)
+
+
+def answer_key(answer: Answer) -> tuple[int, int, int] | None:
+    """Return the request an answer belongs to within its run."""
+    key = (answer.context_idx, answer.choice_a_idx, answer.choice_b_idx)
+    return None if None in key else key
+
+
+def iter_output_lines(client, file_id: str) -> Iterator[str]:
+    """Yield the non-empty lines of an OpenAI file without loading it whole."""
+    with client.files.with_streaming_response.content(file_id) as response:
+        for line in response.iter_lines():
+            line = line.strip()
+            if line:
+                yield line
+
+
+def parse_response(entry: dict) -> dict:
+    """Return the parsed ``ABResponse`` payload of a batch output entry."""
+    body = (entry.get("response") or {}).get("body") or {}
+    choices_resp = body.get("choices") or []
+    message = (choices_resp[0].get("message") or {}) if choices_resp else {}
+    content = message.get("content") or ""
+    try:
+        return json.loads(content) if content else {}
+    except json.JSONDecodeError:
+        return {}
+
+
+class ResultImporter:
+    """Turn the lines of a batch output file into :class:`Answer` rows.
+
+    Lines are parsed as they arrive and written every ``chunk_size``
+    answers, with ``COPY`` on PostgreSQL and ``bulk_create`` elsewhere,
+    each chunk in its own transaction together with the batch's
+    ``imported_lines`` checkpoint. Each chunk is also folded into the
+    run's :class:`GraphEdge` counts. In ``bulk`` mode
+    ``POLL_IMPORT_BULK_CHUNKS`` chunks share a transaction, which saves
+    commits at the cost of coarser checkpoints.
+
+    Compact ``custom_id`` values are decoded with the :class:`Codebook` of
+    the batch snapshot, built once per import, and their indices are stored
+    as the answer's integer codes. Questions referenced by ``custom_id`` are
+    looked up once.
+    """
+
+    def __init__(self, batch, chunk_size: int | None = None, bulk: bool | None = None):
+        self.batch = batch
+        self.chunk_size = chunk_size or getattr(
+            settings, "POLL_IMPORT_CHUNK_SIZE", DEFAULT_CHUNK_SIZE
+        )
+        if bulk is None:
+            bulk = getattr(settings, "POLL_IMPORT_BULK", False)
+        self.commit_size = self.chunk_size
+        if bulk:
+            self.commit_size *= getattr(settings, "POLL_IMPORT_BULK_CHUNKS", 10)
+        self.stats = ImportStats()
+        self.line: int | None = None
+        self._questions: dict[int, Question | None] = {}
+        self._codebooks: dict[int, Codebook] = {}
+        self._run_codebook: Codebook | None | bool = False
+
+    def get_question(self, question_id: int) -> Question | None:
+        if question_id not in self._questions:
+            if question_id == self.batch.question_id:
+                question = self.batch.question
+            else:
+                question = Question.objects.filter(pk=question_id).first()
+            self._questions[question_id] = question
+        return self._questions[question_id]
+
+    def get_codebook(self, question: Question) -> Codebook:
+        """Return the codebook custom ids of ``question`` index into."""
+        if question.pk not in self._codebooks:
+            snapshot = question.snapshot()
+            if question.pk == self.batch.question_id and self.batch.snapshot:
+                snapshot = self.batch.snapshot
+            self._codebooks[question.pk] = Codebook(snapshot)
+        return self._codebooks[question.pk]
+
+    def get_run_codebook(self, question: Question) -> Codebook | None:
+        """Return the run's codebook if answers must be re-encoded to it.
+
+        Batches of an incremental run keep the snapshot they were submitted
+        with, while the run's answers are coded with its latest snapshot.
+        """
+        if question.pk != self.batch.question_id or not self.batch.snapshot:
+            return None
+        if self._run_codebook is False:
+            batch_codebook = self.get_codebook(question)
+            run_codebook = question.codebook(self.batch.run_id)
+            same = (run_codebook.keys, run_codebook.values, run_codebook.choices) == (
+                batch_codebook.keys,
+                batch_codebook.values,
+                batch_codebook.choices,
+            )
+            self._run_codebook = None if same else run_codebook
+        return self._run_codebook
+
+    def build_answer(self, entry: dict) -> Answer | None:
+        """Return an unsaved :class:`Answer` for ``entry`` or ``None``."""
+        custom_id = entry.get("custom_id", "")
+        if ":" not in custom_id:
+            return self.build_legacy_answer(entry)
+
+        key = decode_custom_id(custom_id)
+        if key is None:
+            return None
+        question_id, ctx_idx, a, b = key
+
+        question = self.get_question(question_id)
+        if question is None:
+            return None
+
+        parsed = parse_response(entry)
+        return self.build_coded_answer(
+            question, ctx_idx, a, b, parsed.get("answer"), parsed.get("confidence")
+        )
+
+    def build_coded_answer(
+        self, question, ctx_idx: int, a: int, b: int, choice, confidence
+    ) -> Answer | None:
+        """Return an unsaved :class:`Answer` for already decoded indices."""
+        if choice not in ("A", "B"):
+            return None
+        codebook = self.get_codebook(question)
+        try:
+            context = codebook.combination(ctx_idx)
+            choice_a = codebook.choices[a]
+            choice_b = codebook.choices[b]
+        except IndexError:
+            return None
+
+        answer = self.new_answer(question, context, choice_a, choice_b, choice, confidence)
+        answer.context_idx = ctx_idx
+        answer.choice_a_idx = a
+        answer.choice_b_idx = b
+        answer.winner_idx = a if choice == "A" else b
+        run_codebook = self.get_run_codebook(question)
+        if run_codebook is not None:
+            run_codebook.encode(answer)
+        return answer
+
+    def build_legacy_answer(self, entry: dict) -> Answer | None:
+        """Decode a ``q<id>-<ctx values...>-<A>-<B>`` id from older batches."""
+        parts = entry.get("custom_id", "").split("-")
+
+        if not parts or not parts[0].startswith("q"):
+            return None
+
+        try:
+            question_id = int(parts[0][1:])
+        except ValueError:
+            return None
+
+        question = self.get_question(question_id)
+        if question is None:
+            return None
+
+        ctx_keys = sorted(question.context.keys())
+        context = dict(zip(ctx_keys, parts[1 : 1 + len(ctx_keys)]))
+
+        try:
+            choice_a = parts[1 + len(ctx_keys)]
+            choice_b = parts[2 + len(ctx_keys)]
+        except IndexError:
+            return None
+
+        answer = self.make_answer(question, context, choice_a, choice_b, entry)
+        if answer is not None:
+            codebook = self.get_run_codebook(question) or self.get_codebook(question)
+            codebook.encode(answer)
+        return answer
+
+    def make_answer(self, question, context, choice_a, choice_b, entry) -> Answer | None:
+        parsed = parse_response(entry)
+        if parsed.get("answer") not in ("A", "B"):
+            return None
+        return self.new_answer(
+            question, context, choice_a, choice_b, parsed["answer"], parsed.get("confidence")
+        )
+
+    def new_answer(self, question, context, choice_a, choice_b, choice, confidence) -> Answer:
+        return Answer(
+            question=question,
+            run_id=self.batch.run_id,
+            context=context,
+            choices={"A": choice_a, "B": choice_b},
+            choice=choice,
+            confidence=confidence,
+        )
+
+    def add(self, answer: Answer | None, pending: list[Answer]) -> None:
+        """Queue ``answer`` for writing, flushing every ``commit_size`` answers."""
+        if answer is None:
+            self.stats.skipped += 1
+            return
+        pending.append(answer)
+        if len(pending) >= self.commit_size:
+            self.flush(pending)
+
+    def run(self, lines: Iterable[str]) -> ImportStats:
+        """Import the JSON lines in ``lines`` and return the statistics.
+
+        Lines up to the batch's ``imported_lines`` checkpoint were imported
+        before and are skipped.
+        """
+        started = time.perf_counter()
+        pending: list[Answer] = []
+        offset = self.batch.imported_lines
+        if not offset:
+            self.batch.prompt_tokens = 0
+            self.batch.cached_tokens = 0
+            self.batch.completion_tokens = 0
+        self.usage = (
+            self.batch.prompt_tokens,
+            self.batch.cached_tokens,
+            self.batch.completion_tokens,
+        )
+
+        for number, line in enumerate(lines, 1):
+            if number <= offset:
+                continue
+            self.line = number
+            self.stats.lines += 1
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                self.stats.skipped += 1
+                continue
+
+            self.stats.add_usage(entry)
+            self.add(self.build_answer(entry), pending)
+
+        self.flush(pending)
+
+        self.stats.seconds = time.perf_counter() - started
+        self.stats.peak_memory_kb = peak_memory_kb()
+        return self.stats
+
+    def flush(self, pending: list[Answer]) -> None:
+        """Write ``pending`` and, during :meth:`run`, the line checkpoint.
+
+        Both are committed together, so an interrupted import resumes after
+        the last written chunk. Answers for requests the run already has
+        an answer for are dropped as duplicates.
+        """
+        with transaction.atomic():
+            # Lock the batch first, as GraphEdge.rebuild does for the run.
+            OpenAIBatch.objects.select_for_update().filter(pk=self.batch.pk).exists()
+            new = self.drop_duplicates(pending)
+            if new:
+                write_answers(new, self.chunk_size)
+                GraphEdge.add_answers(new)
+                self.stats.answers += len(new)
+            if self.line is not None:
+                self.checkpoint()
+        pending.clear()
+
+    def drop_duplicates(self, answers: list[Answer]) -> list[Answer]:
+        keys = {
+            key
+            for answer in answers
+            if answer.question_id == self.batch.question_id
+            and (key := answer_key(answer)) is not None
+        }
+        seen = set()
+        if keys:
+            contexts = [key[0] for key in keys]
+            seen.update(
+                Answer.objects.filter(
+                    question_id=self.batch.question_id,
+                    run_id=self.batch.run_id,
+                    context_idx__gte=min(contexts),
+                    context_idx__lte=max(contexts),
+                ).values_list("context_idx", "choice_a_idx", "choice_b_idx")
+            )
+        new = []
+        for answer in answers:
+            key = answer_key(answer) if answer.question_id == self.batch.question_id else None
+            if key is not None:
+                if key in seen:
+                    self.stats.duplicates += 1
+                    continue
+                seen.add(key)
+            new.append(answer)
+        return new
+
+    def checkpoint(self) -> None:
+        batch = self.batch
+        batch.imported_lines = self.line
+        prompt, cached, completion = self.usage
+        batch.prompt_tokens = prompt + self.stats.prompt_tokens
+        batch.cached_tokens = cached + self.stats.cached_tokens
+        batch.completion_tokens = completion + self.stats.completion_tokens
+        batch.save(
+            update_fields=[
+                "imported_lines",
+                "prompt_tokens",
+                "cached_tokens",
+                "completion_tokens",
+                "updated_at",
+            ]
+        )
+
+
+_worker_client = None
+
+
+def _init_worker() -> None:
+    global _worker_client
+    if not apps.ready:  # pragma: no cover - spawned worker processes
+        django.setup()
+    _worker_client = openai_client()
+
+
+def parse_output_file(task: tuple[int, str, int, int], client=None) -> tuple:
+    """Download and decode one output file; runs in a worker process.
+
+    ``task`` is ``(batch_pk, output_file_id, question_id, offset)``; the
+    first ``offset`` lines were imported before and are skipped. Returns the
+    batch pk, ``(context_idx, a, b, choice, confidence)`` tuples for the
+    compact ids of the question, the raw entries of any other ids, and the
+    line and token statistics. The database is not touched.
+    """
+    batch_pk, file_id, question_id, offset = task
+    client = client or _worker_client
+    stats = ImportStats()
+    rows, entries = [], []
+    for number, line in enumerate(iter_output_lines(client, file_id), 1):
+        if number <= offset:
+            continue
+        stats.lines += 1
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError:
+            stats.skipped += 1
+            continue
+        stats.add_usage(entry)
+
+        key = decode_custom_id(entry.get("custom_id", ""))
+        if key is None or key[0] != question_id:
+            entries.append(entry)
+            continue
+        parsed = parse_response(entry)
+        if parsed.get("answer") not in ("A", "B"):
+            stats.skipped += 1
+            continue
+        rows.append((key[1], key[2], key[3], parsed["answer"], parsed.get("confidence")))
+    return batch_pk, rows, entries, stats
+
+
+class RunImporter:
+    """Import every completed, not yet imported batch of a run in parallel.
+
+    Output files are downloaded and decoded by a pool of ``processes``
+    worker processes; this process is the single writer and turns their
+    rows into :class:`Answer` objects written in chunks like
+    :class:`ResultImporter` does. Each
+    batch is written in its own transaction together with its
+    ``imported_at`` marker, lines before a batch's ``imported_lines``
+    checkpoint are skipped, and answers whose request the run already has
+    an answer for are dropped, so running the import again never
+    duplicates answers.
+
+    With ``processes=1`` or an explicit ``client`` the files are parsed in
+    this process.
+    """
+
+    def __init__(
+        self,
+        question: Question,
+        run_id,
+        processes: int | None = None,
+        chunk_size: int | None = None,
+        client=None,
+        log=None,
+    ):
+        self.question = question
+        self.run_id = run_id
+        self.processes = processes or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.client = client
+        self.log = log or (lambda message: None)
+        self.stats = ImportStats()
+
+    def batches(self):
+        completed = OpenAIBatch.objects.filter(
+            question=self.question,
+            run_id=self.run_id,
+            data__status="completed",
+            imported_at__isnull=True,
+        )
+        # Batches whose requests all failed have no output file to import.
+        completed.filter(
+            Q(data__output_file_id__isnull=True) | Q(data__output_file_id=None)
+        ).update(imported_at=timezone.now(), updated_at=timezone.now())
+        return completed.select_related("question").order_by("pk")
+
+    def parsed_files(self, tasks: list[tuple]) -> Iterator[tuple]:
+        if self.client is not None or self.processes == 1 or len(tasks) == 1:
+            client = self.client or openai_client()
+            for task in tasks:
+                yield parse_output_file(task, client=client)
+            return
+
+        # Workers never use the database connections they inherit.
+        with multiprocessing.Pool(min(self.processes, len(tasks)), _init_worker) as pool:
+            yield from pool.imap_unordered(parse_output_file, tasks)
+
+    def run(self) -> ImportStats:
+        started = time.perf_counter()
+        batches = {batch.pk: batch for batch in self.batches()}
+        if not batches:
+            return self.stats
+
+        self.question.status = "importing"
+        self.question.save(update_fields=["status"])
+        tasks = [
+            (pk, b.output_file_id, self.question.pk, b.imported_lines)
+            for pk, b in batches.items()
+        ]
+        for batch_pk, rows, entries, file_stats in self.parsed_files(tasks):
+            batch = batches[batch_pk]
+            if self.write(batch, rows, entries, file_stats):
+                self.log(f"Imported batch {batch.batch_id}: {file_stats}")
+                self.stats.merge(file_stats)
+
+        self.question.status = "completed"
+        self.question.save(update_fields=["status"])
+        self.stats.seconds = time.perf_counter() - started
+        self.stats.peak_memory_kb = peak_memory_kb()
+        return self.stats
+
+    def write(self, batch, rows, entries, stats: ImportStats) -> bool:
+        """Write the answers of one batch; return ``False`` if already imported."""
+        importer = ResultImporter(batch, chunk_size=self.chunk_size)
+        importer.stats = stats
+        pending: list[Answer] = []
+        with transaction.atomic():
+            # Re-check under a row lock in case another import got there first.
+            locked = OpenAIBatch.objects.select_for_update().get(pk=batch.pk)
+            if locked.imported_at is not None:
+                return False
+            for ctx_idx, a, b, choice, confidence in rows:
+                importer.add(
+                    importer.build_coded_answer(batch.question, ctx_idx, a, b, choice, confidence),
+                    pending,
+                )
+            for entry in entries:
+                importer.add(importer.build_answer(entry), pending)
+            importer.flush(pending)
+
+            if not batch.imported_lines:
+                batch.prompt_tokens = batch.cached_tokens = batch.completion_tokens = 0
+            batch.imported_at = timezone.now()
+            batch.imported_lines += stats.lines
+            batch.prompt_tokens += stats.prompt_tokens
+            batch.cached_tokens += stats.cached_tokens
+            batch.completion_tokens += stats.completion_tokens
+            batch.save(
+                update_fields=[
+                    "imported_at",
+                    "imported_lines",
+                    "prompt_tokens",
+                    "cached_tokens",
+                    "completion_tokens",
+                    "updated_at",
+                ]
+            )
+        return True
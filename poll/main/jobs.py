@@ -0,0 +1,153 @@
+"""Database-backed background jobs and the worker that runs them.
+
+Views, admin actions and the API queue slow work with :meth:`Job.enqueue`
+instead of doing it inside the request. ``manage.py run_jobs`` starts a
+:class:`Worker`; several workers, on one machine or many, can run at once
+because each job is claimed with a conditional ``UPDATE`` that only one
+of them can win.
+"""
+
+import os
+import socket
+import threading
+import traceback
+from datetime import timedelta
+from typing import Callable
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+
+HANDLERS: dict[str, Callable[[Job], None]] = {}
+
+
+def handler(kind: str):
+    """Register the function that runs jobs of ``kind``."""
+
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+
+    return register
+
+
+@handler("submit_batches")
+def submit_batches(job: Job) -> None:
+    job.question.submit_batches(incremental=job.payload.get("incremental", False))
+
+
+@handler("update_batch")
+def update_batch(job: Job) -> None:
+    job.batch.update_status()
+
+
+@handler("import_batch")
+def import_batch(job: Job) -> None:
+    if job.payload.get("force"):
+        job.batch.retrieve_results(force=True)
+    else:
+        job.batch.apply_status()
+
+
+def claimable(now):
+    """Return the filter of jobs a worker may start at ``now``."""
+    timeout = getattr(settings, "POLL_JOB_TIMEOUT", 6 * 60 * 60)
+    return Q(status="queued", run_after__lte=now) | Q(
+        status="running", locked_at__lt=now - timedelta(seconds=timeout)
+    )
+
+
+def claim(worker_id: str, candidates: int = 10) -> Job | None:
+    """Lock the next due job for ``worker_id`` and return it, if any."""
+    now = timezone.now()
+    due = (
+        Job.objects.filter(claimable(now))
+        .order_by("run_after", "pk")
+        .values_list("pk", flat=True)[:candidates]
+    )
+    for pk in list(due):
+        claimed = Job.objects.filter(claimable(now), pk=pk).update(
+            status="running",
+            locked_by=worker_id,
+            locked_at=now,
+            attempts=F("attempts") + 1,
+            updated_at=now,
+        )
+        if claimed:
+            return Job.objects.select_related("question", "batch").get(pk=pk)
+    return None
+
+
+def run_job(job: Job) -> None:
+    """Run a claimed job and record its outcome, scheduling retries."""
+    try:
+        if job.attempts > job.max_attempts:
+            raise RuntimeError("Worker stopped before the job finished")
+        HANDLERS[job.kind](job)
+    except Exception:
+        job.last_error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            job.status = "queued"
+            job.run_after = timezone.now() + timedelta(seconds=job.retry_delay())
+        else:
+            job.status = "failed"
+            job.finished_at = timezone.now()
+            if job.question is not None:
+                job.question.status = "failed"
+                job.question.save(update_fields=["status"])
+    else:
+        job.status = "succeeded"
+        job.last_error = ""
+        job.finished_at = timezone.now()
+    job.locked_by = ""
+    job.locked_at = None
+    job.save()
+
+
+class Worker:
+    """Claim and run jobs until stopped.
+
+    With ``burst`` the worker returns as soon as no job is due, otherwise
+    it waits ``sleep`` seconds and looks again.
+    """
+
+    def __init__(
+        self,
+        worker_id: str | None = None,
+        sleep: float = 1.0,
+        log: Callable[[str], None] | None = None,
+    ):
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.sleep = sleep
+        self.log = log or (lambda message: None)
+
+    def run_once(self) -> bool:
+        """Run one due job and return whether there was one."""
+        job = claim(self.worker_id)
+        if job is None:
+            return False
+        self.log(f"Running {job}...")
+        run_job(job)
+        self.log(f"{job}")
+        return True
+
+    def run(self, stop: threading.Event | None = None, burst: bool = False) -> int:
+        """Run jobs until ``stop`` is set; return how many were run."""
+        stop = stop or threading.Event()
+        count = 0
+        while not stop.is_set():
+            try:
+                ran = self.run_once()
+            finally:
+                close_old_connections()
+            if ran:
+                count += 1
+            elif burst:
+                break
+            else:
+                stop.wait(self.sleep)
+        return count
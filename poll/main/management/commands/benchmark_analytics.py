@@ -0,0 +1,123 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from poll.main import analytics
+
+
+def legacy_counts(rows):
+    counts: dict[str, int] = {}
+    for choices, choice, _ in rows:
+        chosen = choices.get(choice)
+        if chosen:
+            counts[chosen] = counts.get(chosen, 0) + 1
+    return counts
+
+
+def legacy_heatmap(rows, choices):
+    index = {c: i for i, c in enumerate(choices)}
+    size = len(choices)
+    matrix = [[None if i == j else 0 for j in range(size)] for i in range(size)]
+    for pair, choice, _ in rows:
+        a = pair.get("A")
+        b = pair.get("B")
+        if a not in index or b not in index:
+            continue
+        if choice == "A":
+            matrix[index[a]][index[b]] += 1
+        elif choice == "B":
+            matrix[index[b]][index[a]] += 1
+    return matrix
+
+
+def legacy_flows(rows):
+    flows: dict[tuple[str, str], int] = {}
+    order: list[str] = []
+    for pair, choice, _ in rows:
+        a = pair.get("A")
+        b = pair.get("B")
+        if choice == "A":
+            key = (a, b)
+        elif choice == "B":
+            key = (b, a)
+        else:
+            continue
+        flows[key] = flows.get(key, 0) + 1
+        order.extend([a, b])
+    return list(dict.fromkeys(order)), flows
+
+
+def legacy_confidence(rows):
+    bins = [0] * 10
+    for _, _, confidence in rows:
+        if confidence is None:
+            continue
+        bins[int(min(max(confidence, 0), 0.999) * 10)] += 1
+    return bins
+
+
+class Command(BaseCommand):
+    """Compare the NumPy chart engine with the per-answer Python loops."""
+
+    help = "Benchmark chart computations on synthetic answers"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            default="10000,1000000,10000000",
+            help="Comma separated numbers of answers to benchmark",
+        )
+        parser.add_argument("--choices", type=int, default=20)
+        parser.add_argument("--contexts", type=int, default=8)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        n_choices = options["choices"]
+        choices = [f"choice_{i}" for i in range(n_choices)]
+        pairs = {
+            (i, j): {"A": choices[i], "B": choices[j]}
+            for i in range(n_choices)
+            for j in range(i + 1, n_choices)
+        }
+        rng = np.random.default_rng(options["seed"])
+
+        for size in (int(s) for s in options["sizes"].split(",")):
+            a = rng.integers(0, n_choices - 1, size)
+            b = a + 1 + (rng.random(size) * (n_choices - 1 - a)).astype(np.intp)
+            picks_b = rng.random(size) < 0.5
+            confidence = rng.random(size)
+            context = rng.integers(0, options["contexts"], size)
+
+            started = time.perf_counter()
+            frame = analytics.PairFrame(
+                choices=choices,
+                winner=np.where(picks_b, b, a),
+                loser=np.where(picks_b, a, b),
+                weight=np.ones(size, dtype=np.int64),
+                context=context,
+                contexts=[{"segment": i} for i in range(options["contexts"])],
+            )
+            analytics.win_counts(frame)
+            analytics.heatmap(frame)
+            analytics.flows(frame)
+            analytics.confidence_histogram(confidence)
+            engine = time.perf_counter() - started
+
+            rows = list(zip(
+                (pairs[key] for key in zip(a.tolist(), b.tolist())),
+                np.where(picks_b, "B", "A").tolist(),
+                confidence.tolist(),
+            ))
+            started = time.perf_counter()
+            legacy_counts(rows)
+            legacy_heatmap(rows, choices)
+            legacy_flows(rows)
+            legacy_confidence(rows)
+            legacy = time.perf_counter() - started
+            del rows
+
+            self.stdout.write(
+                f"{size:>10} answers: loops {legacy:8.3f}s  "
+                f"numpy {engine:8.3f}s  speed-up {legacy / engine:6.1f}x"
+            )
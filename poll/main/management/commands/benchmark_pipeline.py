@@ -0,0 +1,264 @@
+import json
+import math
+import platform
+import subprocess
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.utils import timezone
+
+from poll.main.fakeopenai import FakeOpenAI
+from poll.main.importer import ResultImporter, peak_memory_kb
+from poll.main.models import OpenAIBatch, Question
+
+CHARTS = [
+    "preference-counts",
+    "preference-heatmap",
+    "elo-ratings",
+    "confidence-distribution",
+    "preference-flows",
+    "dashboard",
+]
+
+# Memory figures of a stage below this are too noisy to compare.
+MEMORY_FLOOR_KB = 1024
+
+
+def synthetic_question(size: int, n_choices: int, dimensions: int) -> Question:
+    """Create a question with at least ``size`` requests."""
+    pairs = n_choices * (n_choices - 1) // 2
+    combinations = max(-(-size // pairs), 1)
+    values = max(math.ceil(combinations ** (1 / dimensions)), 1) if dimensions else 1
+    context = {
+        f"dimension_{d}": [f"value_{d}_{v}" for v in range(values)]
+        for d in range(dimensions)
+    }
+    return Question.objects.create(
+        text=f"Benchmark question with {size} answers",
+        context=context,
+        choices=[f"choice_{c}" for c in range(n_choices)],
+        tags=["benchmark"],
+    )
+
+
+def request_host() -> str:
+    """Return a host name the chart requests are allowed to use."""
+    for host in settings.ALLOWED_HOSTS:
+        if host != "*" and not host.startswith("."):
+            return host
+    return "localhost"
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).resolve().parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    """Time batch file generation, result import and chart endpoints.
+
+    Each size gets a synthetic question whose context is grown until it
+    has at least that many requests. Its batch files are written with
+    ``openai_batch_files``, answered by :class:`FakeOpenAI` and imported
+    with :class:`ResultImporter`, and every chart endpoint is requested
+    once with an empty cache and once cached. Questions are deleted
+    afterwards unless ``--keep`` is given.
+
+    Each stage records its time and ``memory_kb``: the peak Python
+    allocation traced by :mod:`tracemalloc` during the stage or, with
+    ``--no-trace-memory``, how far the stage raised the process's peak
+    RSS. Both are compared with ``--baseline``.
+    """
+
+    help = "Benchmark the submit, import and chart pipeline on synthetic questions"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            default="1000,10000,100000",
+            help="Comma separated numbers of answers, up to 10000000",
+        )
+        parser.add_argument("--choices", type=int, default=20)
+        parser.add_argument("--dimensions", type=int, default=2, help="Context dimensions")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="Write the results as JSON to this file")
+        parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.2,
+            help="Growth in time or memory over the baseline reported as a regression",
+        )
+        parser.add_argument(
+            "--fail-on-regression",
+            action="store_true",
+            help="Exit with an error if any stage regressed",
+        )
+        parser.add_argument(
+            "--no-trace-memory",
+            action="store_false",
+            dest="trace_memory",
+            help="Record the growth of the peak RSS instead of tracing allocations (faster)",
+        )
+        parser.add_argument("--keep", action="store_true", help="Keep the synthetic questions")
+
+    def handle(self, *args, **options):
+        self.trace_memory = options["trace_memory"]
+        self.results = []
+        client = Client(HTTP_HOST=request_host())
+
+        for size in (int(s) for s in options["sizes"].split(",")):
+            question = synthetic_question(size, options["choices"], options["dimensions"])
+            try:
+                self.run_size(question, size, client, options["seed"])
+            finally:
+                if not options["keep"]:
+                    question.delete()
+
+        report = {
+            "revision": git_revision(),
+            "created_at": timezone.now().isoformat(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "options": {
+                key: options[key] for key in ("sizes", "choices", "dimensions", "seed")
+            },
+            "results": self.results,
+        }
+        if options["output"]:
+            Path(options["output"]).write_text(json.dumps(report, indent=2))
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if options["baseline"]:
+            baseline = json.loads(Path(options["baseline"]).read_text())
+            regressions = self.compare(baseline["results"], options["tolerance"])
+            if regressions and options["fail_on_regression"]:
+                raise CommandError(f"{regressions} stage(s) regressed")
+
+    def run_size(self, question, size, client, seed):
+        plan = question.plan()
+        run_id = uuid.uuid4()
+        snapshot = question.snapshot()
+        fake = FakeOpenAI(seed=seed)
+
+        files = []
+        with self.stage(size, "batch_files", plan.lines):
+            for fh in question.openai_batch_files():
+                files.append(fh)
+
+        with self.stage(size, "import", plan.lines) as result:
+            for i, fh in enumerate(files):
+                with fh:
+                    # Answering is not part of the import being timed.
+                    with self.paused(result):
+                        output, _, _ = fake.build_output(fh.read())
+                    batch = OpenAIBatch.objects.create(
+                        question=question,
+                        run_id=run_id,
+                        snapshot=snapshot,
+                        data={"id": f"benchmark_{i}", "status": "completed"},
+                    )
+                    ResultImporter(batch).run(output.decode().splitlines())
+                    del output
+
+        for chart in CHARTS:
+            url = f"/api/charts/questions/{question.uuid}/{chart}"
+            cache.clear()
+            with self.stage(size, f"chart:{chart}", plan.lines):
+                response = client.get(url)
+            if response.status_code != 200:
+                raise CommandError(f"{url} returned {response.status_code}")
+            with self.stage(size, f"chart:{chart}:cached", plan.lines):
+                client.get(url)
+
+    @contextmanager
+    def stage(self, size: int, name: str, answers: int):
+        result = {"size": size, "stage": name, "answers": answers, "paused": 0.0}
+        if self.trace_memory:
+            tracemalloc.start()
+        rss_before = peak_memory_kb()
+        started = time.perf_counter()
+        try:
+            yield result
+        finally:
+            seconds = time.perf_counter() - started - result.pop("paused")
+            result["seconds"] = round(seconds, 4)
+            result["rows_per_second"] = round(answers / seconds, 1) if seconds else None
+            # The peak RSS is a high-water mark of the whole process.
+            result["peak_rss_kb"] = peak_memory_kb()
+            if self.trace_memory:
+                result["memory_kb"] = tracemalloc.get_traced_memory()[1] // 1024
+                result["memory_source"] = "tracemalloc"
+                tracemalloc.stop()
+            else:
+                grown = None if rss_before is None else result["peak_rss_kb"] - rss_before
+                result["memory_kb"] = grown
+                result["memory_source"] = "rss"
+            self.results.append(result)
+            self.stdout.write(
+                f"{size:>10} {name:<40} {result['seconds']:10.4f}s "
+                f"memory {result['memory_kb']} KiB"
+            )
+
+    @contextmanager
+    def paused(self, result: dict):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            result["paused"] += time.perf_counter() - started
+
+    def compare(self, baseline: list[dict], tolerance: float) -> int:
+        """Print the time and memory ratios to ``baseline`` per stage.
+
+        Memory is only compared between runs that measured it the same way
+        and when either figure reaches ``MEMORY_FLOOR_KB``. Returns the
+        number of stages that regressed in either.
+        """
+        previous = {(r["size"], r["stage"]): r for r in baseline}
+        regressions = 0
+        for result in self.results:
+            before = previous.get((result["size"], result["stage"]))
+            if not before:
+                continue
+            ratios = {}
+            if before.get("seconds"):
+                ratios["time"] = result["seconds"] / before["seconds"]
+            memory, memory_before = result.get("memory_kb"), before.get("memory_kb")
+            if (
+                memory is not None
+                and memory_before
+                and before.get("memory_source") == result["memory_source"]
+                and max(memory, memory_before) >= MEMORY_FLOOR_KB
+            ):
+                ratios["memory"] = memory / memory_before
+            if not ratios:
+                continue
+            line = f"{result['size']:>10} {result['stage']:<40} " + "  ".join(
+                f"{kind} {ratio:6.2f}x" for kind, ratio in ratios.items()
+            )
+            regressed = [kind for kind, ratio in ratios.items() if ratio > 1 + tolerance]
+            if regressed:
+                regressions += 1
+                self.stdout.write(self.style.ERROR(f"{line}  REGRESSION ({', '.join(regressed)})"))
+            else:
+                self.stdout.write(line)
+        return regressions
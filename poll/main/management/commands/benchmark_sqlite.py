@@ -0,0 +1,219 @@
+import json
+import multiprocessing
+import time
+import uuid
+from pathlib import Path
+
+import django
+import numpy as np
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+from django.test import Client, override_settings
+from django.utils import timezone
+
+from poll.main.fakeopenai import FakeOpenAI
+from poll.main.importer import ResultImporter
+from poll.main.models import OpenAIBatch
+from poll.main.management.commands.benchmark_pipeline import (
+    git_revision,
+    request_host,
+    synthetic_question,
+)
+
+
+# Django's own SQLite behaviour: rollback journal, full fsync, no memory
+# mapping, SQLite's default 2 MiB cache and the driver's 5 second timeout.
+DEFAULT_PRAGMAS = {
+    "journal_mode": "delete",
+    "synchronous": "full",
+    "mmap_size": 0,
+    "cache_size": -2000,
+    "busy_timeout": 5000,
+}
+
+TUNED_PRAGMAS = {
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,
+    "busy_timeout": 5000,
+}
+
+MODES = {"default": DEFAULT_PRAGMAS, "tuned": TUNED_PRAGMAS}
+
+
+def read_chart(url: str, pragmas: dict, stop, results) -> None:
+    """Request ``url`` until ``stop`` is set; runs in a reader process.
+
+    Puts the latencies of the successful requests in seconds and the
+    number of failed ones on ``results``.
+    """
+    if not apps.ready:  # pragma: no cover - spawned reader processes
+        django.setup()
+    latencies, errors = [], 0
+    client = Client(HTTP_HOST=request_host())
+    with override_settings(POLL_SQLITE_PRAGMAS=pragmas):
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                response = client.get(url)
+            except OperationalError:
+                errors += 1
+                continue
+            if response.status_code != 200:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+    connection.close()
+    results.put((latencies, errors))
+
+
+class Command(BaseCommand):
+    """Measure chart read latency while an import writes to SQLite.
+
+    For each mode the connections are set up with its pragmas, a synthetic
+    question is created and answered by :class:`FakeOpenAI`, and the first
+    ``--seed-share`` of its answers are imported. ``--readers`` processes
+    then request the question's dashboard chart in a loop while the rest
+    is imported with :class:`ResultImporter`, and the latency percentiles
+    of the reads and the import throughput are reported. ``default`` uses
+    Django's SQLite defaults, ``tuned`` the WAL setup recommended in
+    ``POLL_SQLITE_PRAGMAS``.
+    """
+
+    help = "Benchmark chart read latency on SQLite during a concurrent import"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--answers", type=int, default=100_000)
+        parser.add_argument("--choices", type=int, default=20)
+        parser.add_argument("--dimensions", type=int, default=2, help="Context dimensions")
+        parser.add_argument("--readers", type=int, default=2, help="Concurrent reader processes")
+        parser.add_argument(
+            "--modes",
+            default="default,tuned",
+            help=f"Comma separated pragma sets to compare: {', '.join(MODES)}",
+        )
+        parser.add_argument(
+            "--seed-share",
+            type=float,
+            default=0.1,
+            help="Share of the answers imported before the readers start",
+        )
+        parser.add_argument("--bulk", action="store_true", help="Import in bulk-load mode")
+        parser.add_argument("--chunk-size", type=int)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="Write the results as JSON to this file")
+        parser.add_argument("--keep", action="store_true", help="Keep the synthetic questions")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite" or connection.is_in_memory_db():
+            raise CommandError("This benchmark needs a file based SQLite database")
+        modes = options["modes"].split(",")
+        unknown = set(modes) - set(MODES)
+        if unknown:
+            raise CommandError(f"Unknown mode(s): {', '.join(sorted(unknown))}")
+
+        results = []
+        for mode in modes:
+            # Journal mode changes need the database to themselves.
+            connections.close_all()
+            with override_settings(POLL_SQLITE_PRAGMAS=MODES[mode]):
+                question = synthetic_question(
+                    options["answers"], options["choices"], options["dimensions"]
+                )
+                try:
+                    result = self.run_mode(question, MODES[mode], options)
+                finally:
+                    if not options["keep"]:
+                        question.delete()
+                connections.close_all()
+            result = {"mode": mode, "pragmas": MODES[mode], **result}
+            results.append(result)
+            self.stdout.write(
+                f"{mode:<8} {result['reads']:>7} reads  "
+                f"p50 {result['p50_ms']:8.2f}ms  p95 {result['p95_ms']:8.2f}ms  "
+                f"p99 {result['p99_ms']:8.2f}ms  max {result['max_ms']:8.2f}ms  "
+                f"{result['errors']} errors  "
+                f"import {result['import_seconds']:.2f}s "
+                f"({result['rows_per_second']:.0f} rows/s)"
+            )
+
+        if options["output"]:
+            report = {
+                "revision": git_revision(),
+                "created_at": timezone.now().isoformat(),
+                "sqlite": connection.Database.sqlite_version,
+                "options": {
+                    key: options[key]
+                    for key in (
+                        "answers", "choices", "dimensions", "readers",
+                        "seed_share", "bulk", "chunk_size", "seed",
+                    )
+                },
+                "results": results,
+            }
+            Path(options["output"]).write_text(json.dumps(report, indent=2))
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def run_mode(self, question, pragmas: dict, options) -> dict:
+        fake = FakeOpenAI(seed=options["seed"])
+        lines = []
+        for fh in question.openai_batch_files():
+            with fh:
+                output, _, _ = fake.build_output(fh.read())
+            lines.extend(output.decode().splitlines())
+            del output
+
+        run_id = uuid.uuid4()
+        snapshot = question.snapshot()
+        split = int(len(lines) * options["seed_share"])
+        importers = [
+            ResultImporter(
+                OpenAIBatch.objects.create(
+                    question=question,
+                    run_id=run_id,
+                    snapshot=snapshot,
+                    data={"id": f"benchmark_{part}", "status": "completed"},
+                ),
+                chunk_size=options["chunk_size"],
+                bulk=options["bulk"],
+            )
+            for part in ("seed", "load")
+        ]
+        importers[0].run(lines[:split])
+
+        # Readers are processes, like web workers next to an import worker,
+        # so they compete for the database rather than for the GIL.
+        connections.close_all()
+        stop = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        url = f"/api/charts/questions/{question.uuid}/dashboard"
+        readers = [
+            multiprocessing.Process(target=read_chart, args=(url, pragmas, stop, results))
+            for _ in range(options["readers"])
+        ]
+        for reader in readers:
+            reader.start()
+        try:
+            stats = importers[1].run(lines[split:])
+        finally:
+            stop.set()
+            outcomes = [results.get() for _ in readers]
+            for reader in readers:
+                reader.join()
+
+        latencies = np.array([l for latencies, _ in outcomes for l in latencies]) * 1000
+        percentiles = (
+            np.percentile(latencies, [50, 95, 99]) if len(latencies) else [0.0] * 3
+        )
+        return {
+            "reads": len(latencies),
+            "errors": sum(errors for _, errors in outcomes),
+            "p50_ms": round(float(percentiles[0]), 3),
+            "p95_ms": round(float(percentiles[1]), 3),
+            "p99_ms": round(float(percentiles[2]), 3),
+            "max_ms": round(float(latencies.max()), 3) if len(latencies) else 0.0,
+            "import_seconds": round(stats.seconds, 3),
+            "rows_per_second": round(stats.rows_per_second, 1),
+        }
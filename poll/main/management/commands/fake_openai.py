@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+
+from poll.main.fakeopenai import FakeOpenAI, base_url, make_server
+
+
+class Command(BaseCommand):
+    """Serve a local simulation of the OpenAI Files and Batches API."""
+
+    help = "Run a fake OpenAI batch server for load and benchmark testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=1.0,
+            help="Seconds each batch spends validating and finalizing",
+        )
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=10_000.0,
+            help="Requests completed per second by each batch",
+        )
+        parser.add_argument(
+            "--failure-rate",
+            type=float,
+            default=0.0,
+            help="Share of requests that fail",
+        )
+        parser.add_argument("--seed", type=int, help="Seed of the random answers")
+        parser.add_argument("--verbose", action="store_true", help="Log every request")
+
+    def handle(self, *args, **options):
+        fake = FakeOpenAI(
+            latency=options["latency"],
+            rate=options["rate"],
+            failure_rate=options["failure_rate"],
+            seed=options["seed"],
+        )
+        server = make_server(fake, options["host"], options["port"], options["verbose"])
+        self.stdout.write(
+            f"Serving fake OpenAI batches; set OPENAI_BASE_URL={base_url(server)}"
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
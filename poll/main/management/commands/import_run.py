@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from poll.main.importer import RunImporter
+from poll.main.models import Question
+
+
+class Command(BaseCommand):
+    """Import the completed batches of a run with a pool of processes."""
+
+    help = "Import all completed, not yet imported batch outputs of a run in parallel"
+
+    def add_arguments(self, parser):
+        parser.add_argument("question", help="UUID of the question")
+        parser.add_argument("--run-id", help="Run to import; defaults to the latest run")
+        parser.add_argument(
+            "--processes",
+            type=int,
+            help="Worker processes downloading and parsing output files",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            help="Answers written per bulk insert",
+        )
+
+    def handle(self, *args, **options):
+        question = Question.objects.filter(uuid=options["question"]).first()
+        if question is None:
+            raise CommandError(f"No question {options['question']}")
+
+        run_id = options["run_id"]
+        if run_id is None:
+            batch = question.latest_batch()
+            if batch is None:
+                raise CommandError("The question has no batches")
+            run_id = batch.run_id
+
+        importer = RunImporter(
+            question,
+            run_id,
+            processes=options["processes"],
+            chunk_size=options["chunk_size"],
+            log=self.stdout.write,
+        )
+        stats = importer.run()
+        self.stdout.write(self.style.SUCCESS(f"Run {run_id}: {stats}"))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from poll.main.jobs import Worker
+
+
+class Command(BaseCommand):
+    """Run queued background jobs.
+
+    Start one process per core to spread imports over several workers.
+    """
+
+    help = "Run queued submission, status update and import jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--burst",
+            action="store_true",
+            help="Exit once no job is due instead of waiting for more",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=1.0,
+            help="Seconds to wait between looks at an empty queue",
+        )
+        parser.add_argument("--worker-id", help="Name recorded on claimed jobs")
+
+    def handle(self, *args, **options):
+        worker = Worker(
+            worker_id=options["worker_id"],
+            sleep=options["sleep"],
+            log=self.stdout.write,
+        )
+        try:
+            count = worker.run(burst=options["burst"])
+        except KeyboardInterrupt:
+            return
+        self.stdout.write(self.style.SUCCESS(f"Ran {count} job(s)"))
@@ -1,5 +1,5 @@
 from django.core.management.base import BaseCommand
-from poll.main.models import OpenAIBatch
+from poll.main.poller import BatchPoller
 
 
 class Command(BaseCommand):
@@ -7,8 +7,51 @@ class Command(BaseCommand):
 
     help = "Update OpenAI batch statuses and fetch results if completed"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--watch",
+            action="store_true",
+            help="Keep polling unfinished batches until interrupted",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            help="Number of concurrent status requests",
+        )
+        parser.add_argument(
+            "--min-interval",
+            type=float,
+            default=30,
+            help="Shortest delay in seconds between polls of one batch",
+        )
+        parser.add_argument(
+            "--max-interval",
+            type=float,
+            default=30 * 60,
+            help="Longest delay in seconds between polls of one batch",
+        )
+        parser.add_argument(
+            "--defer-imports",
+            action="store_true",
+            help="Queue completed batches as jobs for run_jobs workers",
+        )
+
     def handle(self, *args, **options):
-        for batch in OpenAIBatch.objects.all():
-            self.stdout.write(f"Updating batch {batch.batch_id}...")
-            batch.update_status()
+        poller = BatchPoller(
+            max_workers=options["workers"],
+            min_interval=options["min_interval"],
+            max_interval=options["max_interval"],
+            log=self.stdout.write,
+            defer_imports=options["defer_imports"],
+        )
+
+        if options["watch"]:
+            try:
+                poller.run()
+            except KeyboardInterrupt:
+                pass
+            return
+
+        poller.poll_once()
+        poller.import_pending()
         self.stdout.write(self.style.SUCCESS("Batch update complete"))
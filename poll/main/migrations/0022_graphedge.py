@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0021_question_created_by"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="GraphEdge",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("run_id", models.UUIDField()),
+                ("context_hash", models.CharField(max_length=40)),
+                ("context", models.JSONField(default=dict)),
+                ("winner", models.CharField(max_length=500)),
+                ("loser", models.CharField(max_length=500)),
+                ("count", models.PositiveIntegerField(default=0)),
+                ("confidence_sum", models.FloatField(default=0)),
+                (
+                    "question",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="graph_edges",
+                        to="main.question",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["question", "run_id"],
+                        name="main_graphe_questio_50c3b7_idx",
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=(
+                            "question",
+                            "run_id",
+                            "context_hash",
+                            "winner",
+                            "loser",
+                        ),
+                        name="unique_graph_edge",
+                    )
+                ],
+            },
+        ),
+    ]
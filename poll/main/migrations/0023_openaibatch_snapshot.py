@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0022_graphedge"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="openaibatch",
+            name="snapshot",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,113 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:02
+
+from django.db import migrations, models
+
+
+# The encoding is copied here rather than imported from ``Codebook`` so
+# that later changes to the model code do not change this migration.
+
+
+def make_encoder(snapshot):
+    """Return a function setting the integer codes of an answer."""
+    context = snapshot.get("context") or {}
+    keys = list(context.keys())
+    values = [v if isinstance(v, (list, tuple)) else [v] for v in context.values()]
+    choice_index = {c: i for i, c in enumerate(dict.fromkeys(snapshot.get("choices") or []))}
+    value_index = [{str(v): i for i, v in reversed(list(enumerate(vals)))} for vals in values]
+    strides = []
+    stride = 1
+    for vals in reversed(values):
+        strides.insert(0, stride)
+        stride *= len(vals)
+
+    def context_index(ctx):
+        index = 0
+        for key, lookup, stride in zip(keys, value_index, strides):
+            code = lookup.get(str(ctx.get(key)))
+            if code is None:
+                return None
+            index += code * stride
+        return index
+
+    def encode(answer):
+        answer.context_idx = context_index(answer.context or {})
+        answer.choice_a_idx = choice_index.get((answer.choices or {}).get("A"))
+        answer.choice_b_idx = choice_index.get((answer.choices or {}).get("B"))
+        answer.winner_idx = {"A": answer.choice_a_idx, "B": answer.choice_b_idx}.get(
+            answer.choice
+        )
+
+    return encode
+
+
+def backfill_codes(apps, schema_editor):
+    """Derive the integer codes of existing answers from their JSON fields."""
+    Answer = apps.get_model("main", "Answer")
+    Question = apps.get_model("main", "Question")
+    OpenAIBatch = apps.get_model("main", "OpenAIBatch")
+
+    runs = Answer.objects.values_list("question_id", "run_id").distinct()
+    for question_id, run_id in runs.iterator():
+        snapshot = (
+            OpenAIBatch.objects.filter(question_id=question_id, run_id=run_id)
+            .exclude(snapshot={})
+            .values_list("snapshot", flat=True)
+            .first()
+        )
+        if not snapshot:
+            question = Question.objects.get(pk=question_id)
+            snapshot = {"context": question.context, "choices": question.choices}
+        encode = make_encoder(snapshot)
+
+        answers = Answer.objects.filter(question_id=question_id, run_id=run_id)
+        pending = []
+        for answer in answers.iterator(chunk_size=2000):
+            encode(answer)
+            pending.append(answer)
+            if len(pending) >= 2000:
+                Answer.objects.bulk_update(
+                    pending,
+                    ["context_idx", "choice_a_idx", "choice_b_idx", "winner_idx"],
+                )
+                pending = []
+        Answer.objects.bulk_update(
+            pending, ["context_idx", "choice_a_idx", "choice_b_idx", "winner_idx"]
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0023_openaibatch_snapshot"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="answer",
+            name="choice_a_idx",
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="answer",
+            name="choice_b_idx",
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="answer",
+            name="context_idx",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="answer",
+            name="winner_idx",
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="answer",
+            index=models.Index(
+                fields=["question", "run_id", "context_idx"],
+                name="main_answer_questio_e2f738_idx",
+            ),
+        ),
+        migrations.RunPython(backfill_codes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0024_answer_codes"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="answer",
+            index=models.Index(
+                fields=["question", "run_id", "id"],
+                name="main_answer_questio_c49ff6_idx",
+            ),
+        ),
+    ]
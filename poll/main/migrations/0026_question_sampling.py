@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:12
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0025_answer_pairs_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="question",
+            name="sample_fraction",
+            field=models.FloatField(
+                blank=True,
+                null=True,
+                validators=[
+                    django.core.validators.MinValueValidator(0),
+                    django.core.validators.MaxValueValidator(1),
+                ],
+            ),
+        ),
+        migrations.AddField(
+            model_name="question",
+            name="sample_size",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
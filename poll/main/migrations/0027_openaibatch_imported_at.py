@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:14
+
+from django.db import migrations, models
+from django.db.models import Exists, F, OuterRef
+
+
+def mark_imported(apps, schema_editor):
+    """Treat completed batches of runs that already have answers as imported."""
+    Answer = apps.get_model("main", "Answer")
+    OpenAIBatch = apps.get_model("main", "OpenAIBatch")
+
+    answered = Answer.objects.filter(
+        question_id=OuterRef("question_id"), run_id=OuterRef("run_id")
+    )
+    OpenAIBatch.objects.filter(Exists(answered), data__status="completed").update(
+        imported_at=F("updated_at")
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0026_question_sampling"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="openaibatch",
+            name="imported_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(mark_imported, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0027_openaibatch_imported_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="openaibatch",
+            name="cached_tokens",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="openaibatch",
+            name="completion_tokens",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="openaibatch",
+            name="prompt_tokens",
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
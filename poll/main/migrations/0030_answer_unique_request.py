@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:30
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def drop_duplicate_answers(apps, schema_editor):
+    """Keep the first answer per request of a run and rebuild its edges.
+
+    Edges of affected runs are deleted; ``0034_graphedge_backfill``
+    aggregates them again from the remaining answers.
+    """
+    Answer = apps.get_model("main", "Answer")
+    GraphEdge = apps.get_model("main", "GraphEdge")
+
+    key = ["question_id", "run_id", "context_idx", "choice_a_idx", "choice_b_idx"]
+    duplicated = (
+        Answer.objects.filter(
+            context_idx__isnull=False,
+            choice_a_idx__isnull=False,
+            choice_b_idx__isnull=False,
+        )
+        .values(*key)
+        .annotate(count=Count("pk"), keep=Min("pk"))
+        .filter(count__gt=1)
+    )
+    runs = set()
+    for row in duplicated.iterator():
+        keep = row.pop("keep")
+        row.pop("count")
+        Answer.objects.filter(**row).exclude(pk=keep).delete()
+        runs.add((row["question_id"], row["run_id"]))
+    for question_id, run_id in runs:
+        GraphEdge.objects.filter(question_id=question_id, run_id=run_id).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0029_job"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="answer",
+            name="main_answer_questio_e2f738_idx",
+        ),
+        migrations.AddField(
+            model_name="openaibatch",
+            name="imported_lines",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(drop_duplicate_answers, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="answer",
+            constraint=models.UniqueConstraint(
+                fields=(
+                    "question",
+                    "run_id",
+                    "context_idx",
+                    "choice_a_idx",
+                    "choice_b_idx",
+                ),
+                name="unique_answer_request",
+            ),
+        ),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations
+
+
+INDEX_NAME = "main_answer_context_gin"
+
+
+def create_gin_index(apps, schema_editor):
+    """Index ``Answer.context`` for containment lookups on PostgreSQL.
+
+    ``jsonb_path_ops`` serves ``context__contains`` (``@>``) queries. Other
+    databases have no GIN indexes and are left alone.
+    """
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    table = schema_editor.quote_name(apps.get_model("main", "Answer")._meta.db_table)
+    schema_editor.execute(
+        f"CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON {table} USING GIN (context jsonb_path_ops)"
+    )
+
+
+def drop_gin_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(f"DROP INDEX IF EXISTS {INDEX_NAME}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0030_answer_unique_request"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_gin_index, drop_gin_index),
+    ]
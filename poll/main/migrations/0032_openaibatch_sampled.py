@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0031_answer_context_gin"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="openaibatch",
+            name="sampled",
+            field=models.BooleanField(default=False),
+        ),
+    ]
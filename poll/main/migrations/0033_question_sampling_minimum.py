@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:50
+
+import django.core.validators
+import poll.main.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0032_openaibatch_sampled"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="question",
+            name="sample_fraction",
+            field=models.FloatField(
+                blank=True,
+                null=True,
+                validators=[poll.main.models.validate_sample_fraction],
+            ),
+        ),
+        migrations.AlterField(
+            model_name="question",
+            name="sample_size",
+            field=models.PositiveIntegerField(
+                blank=True,
+                null=True,
+                validators=[django.core.validators.MinValueValidator(1)],
+            ),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:10
+
+import hashlib
+import json
+
+from django.db import migrations
+
+
+# The aggregation is copied here rather than imported from ``GraphEdge`` so
+# that later changes to the model code do not change this migration.
+
+
+def context_hash(context):
+    encoded = json.dumps(context, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
+
+def build_missing_edges(apps, schema_editor):
+    """Aggregate the edges of runs that have answers but no edges yet.
+
+    Covers runs imported before edges were maintained and runs whose edges
+    ``0030_answer_unique_request`` deleted. Only answers carrying every
+    integer code are counted, as in ``GraphEdge.rebuild``.
+    """
+    Answer = apps.get_model("main", "Answer")
+    GraphEdge = apps.get_model("main", "GraphEdge")
+
+    coded = Answer.objects.filter(
+        context_idx__isnull=False,
+        choice_a_idx__isnull=False,
+        choice_b_idx__isnull=False,
+        winner_idx__isnull=False,
+    )
+    with_edges = set(GraphEdge.objects.values_list("question_id", "run_id").distinct())
+    runs = set(coded.values_list("question_id", "run_id").distinct()) - with_edges
+
+    for question_id, run_id in runs:
+        edges = {}
+        answers = coded.filter(question_id=question_id, run_id=run_id).values_list(
+            "context", "choices", "choice", "confidence"
+        )
+        for context, choices, choice, confidence in answers.iterator(chunk_size=2000):
+            loser_key = {"A": "B", "B": "A"}.get(choice)
+            if loser_key is None:
+                continue
+            winner = (choices or {}).get(choice)
+            loser = (choices or {}).get(loser_key)
+            if not winner or not loser:
+                continue
+            ctx_hash = context_hash(context)
+            edge = edges.get((ctx_hash, winner, loser))
+            if edge is None:
+                edge = edges[(ctx_hash, winner, loser)] = GraphEdge(
+                    question_id=question_id,
+                    run_id=run_id,
+                    context_hash=ctx_hash,
+                    context=context,
+                    winner=winner,
+                    loser=loser,
+                )
+            edge.count += 1
+            edge.confidence_sum += confidence or 0.0
+        GraphEdge.objects.bulk_create(edges.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0033_question_sampling_minimum"),
+    ]
+
+    operations = [
+        migrations.RunPython(build_missing_edges, migrations.RunPython.noop),
+    ]
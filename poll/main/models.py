@@ -1,14 +1,25 @@
+import hashlib
 import json
-from io import BytesIO
+import math
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from itertools import product, combinations
-from typing import List, Dict, Literal
+from typing import IO, Iterator, List, Dict, Literal
 
 import uuid
+
+import numpy as np
 import openai
 from pydantic import BaseModel, confloat
 from openai.lib._pydantic import to_strict_json_schema
-from django.db import models
+from django.db import connection, models, transaction
+from django.utils import timezone
+from django.db.models import Case, ExpressionWrapper, F, IntegerField, Value, When
+from django.db.models.lookups import Exact
+from django.db.models.functions import Mod
 from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import MinValueValidator
 
 
 class ABResponse(BaseModel):
@@ -25,6 +36,570 @@ class ABResponse(BaseModel):
 
 AB_RESPONSE_SCHEMA = to_strict_json_schema(ABResponse)
 
+OPENAI_MODEL = "gpt-4o-mini"
+# Limits of a single OpenAI batch input file.
+OPENAI_BATCH_MAX_LINES = 50_000
+OPENAI_BATCH_MAX_BYTES = 200 * 1024 * 1024
+
+
+def context_combinations(context: dict) -> List[dict]:
+    """Return every combination of the values in a question context."""
+    if not context:
+        return [{}]
+
+    keys = list(context.keys())
+    value_sequences = [
+        v if isinstance(v, (list, tuple)) else [v]
+        for v in (context[k] for k in keys)
+    ]
+
+    return [dict(zip(keys, combo)) for combo in product(*value_sequences)]
+
+
+def unique_choices(choices: list | None) -> List[str]:
+    """Return ``choices`` without duplicates, keeping the first occurrence."""
+    return list(dict.fromkeys(choices or []))
+
+
+def encode_custom_id(question_id: int, context_index: int, a: int, b: int) -> str:
+    """Return the batch ``custom_id`` of one request.
+
+    The id refers to the context combination and the two choices by their
+    indices, e.g. ``q12:3:0:5``.
+    """
+    return f"q{question_id}:{context_index}:{a}:{b}"
+
+
+def decode_custom_id(custom_id: str) -> tuple[int, int, int, int] | None:
+    """Return ``(question_id, context_index, a, b)`` or ``None``."""
+    if not custom_id.startswith("q"):
+        return None
+    try:
+        key = tuple(map(int, custom_id[1:].split(":")))
+    except ValueError:
+        return None
+    if len(key) != 4 or min(key) < 0:
+        return None
+    return key
+
+
+def openai_client(**kwargs) -> openai.OpenAI:
+    """Return an OpenAI client for ``settings.OPENAI_BASE_URL`` if set.
+
+    Pointing the base URL at ``manage.py fake_openai`` runs submission,
+    polling and import against a local simulation.
+    """
+    base_url = getattr(settings, "OPENAI_BASE_URL", None)
+    if base_url:
+        kwargs.setdefault("base_url", base_url)
+    return openai.OpenAI(**kwargs)
+
+
+def token_cost(
+    prompt_tokens: int, cached_tokens: int, completion_tokens: int, model: str = OPENAI_MODEL
+) -> float | None:
+    """Return the USD cost of token usage, or ``None`` if prices are unknown.
+
+    Prices come from ``settings.POLL_OPENAI_PRICES``, which maps model names
+    to ``{"input": ..., "cached_input": ..., "output": ...}`` in USD per
+    million tokens. Cached tokens are part of ``prompt_tokens``.
+    """
+    prices = getattr(settings, "POLL_OPENAI_PRICES", {}).get(model)
+    if not prices:
+        return None
+    cached_price = prices.get("cached_input", prices["input"])
+    cost = (
+        (prompt_tokens - cached_tokens) * prices["input"]
+        + cached_tokens * cached_price
+        + completion_tokens * prices["output"]
+    )
+    return cost / 1_000_000
+
+
+class Codebook:
+    """Integer codes for the context combinations and choices of a run.
+
+    Context combinations are numbered in :func:`context_combinations` order,
+    i.e. as a mixed-radix number whose last context key varies fastest.
+    Choices are numbered by their position in the deduplicated list.
+    """
+
+    # Filters matching more combinations than this use arithmetic on the
+    # stored index instead of an ``IN`` list.
+    MAX_IN_LIST = 1000
+
+    def __init__(self, snapshot: dict):
+        context = snapshot.get("context") or {}
+        self.keys = list(context.keys())
+        self.values = [
+            v if isinstance(v, (list, tuple)) else [v] for v in context.values()
+        ]
+        self.choices = unique_choices(snapshot.get("choices"))
+        self.choice_index = {c: i for i, c in enumerate(self.choices)}
+        self.value_index = [
+            {str(v): i for i, v in reversed(list(enumerate(vals)))} for vals in self.values
+        ]
+        self.strides = []
+        stride = 1
+        for vals in reversed(self.values):
+            self.strides.insert(0, stride)
+            stride *= len(vals)
+        self.size = stride
+
+    def context_index(self, context: dict) -> int | None:
+        """Return the combination index of ``context`` or ``None``."""
+        index = 0
+        for key, lookup, stride in zip(self.keys, self.value_index, self.strides):
+            code = lookup.get(str(context.get(key)))
+            if code is None:
+                return None
+            index += code * stride
+        return index
+
+    def combination(self, index: int) -> dict:
+        """Return the context dictionary with combination number ``index``."""
+        if not 0 <= index < self.size:
+            raise IndexError(index)
+        return {
+            key: vals[(index // stride) % len(vals)]
+            for key, vals, stride in zip(self.keys, self.values, self.strides)
+        }
+
+    def encode(self, answer: "Answer") -> None:
+        """Set the integer code fields of ``answer`` from its JSON fields."""
+        answer.context_idx = self.context_index(answer.context or {})
+        answer.choice_a_idx = self.choice_index.get((answer.choices or {}).get("A"))
+        answer.choice_b_idx = self.choice_index.get((answer.choices or {}).get("B"))
+        answer.winner_idx = {"A": answer.choice_a_idx, "B": answer.choice_b_idx}.get(answer.choice)
+
+    def filter(self, queryset, params: dict, field: str = "context_idx"):
+        """Narrow ``queryset`` to combinations matching every ``key=value``.
+
+        Unknown keys are ignored; unknown values match nothing.
+        """
+        fixed = {}
+        for key, value in params.items():
+            if key not in self.keys:
+                continue
+            pos = self.keys.index(key)
+            code = self.value_index[pos].get(str(value))
+            if code is None:
+                return queryset.none()
+            fixed[pos] = code
+        if not fixed:
+            return queryset
+
+        matching = self.size
+        for pos in fixed:
+            matching //= len(self.values[pos])
+
+        if matching <= self.MAX_IN_LIST:
+            indices = [0]
+            for pos, (vals, stride) in enumerate(zip(self.values, self.strides)):
+                codes = [fixed[pos]] if pos in fixed else range(len(vals))
+                indices = [i + code * stride for i in indices for code in codes]
+            return queryset.filter(**{f"{field}__in": indices})
+
+        for pos, code in fixed.items():
+            digit = Mod(
+                ExpressionWrapper(F(field) / self.strides[pos], output_field=IntegerField()),
+                len(self.values[pos]),
+            )
+            alias = f"_{field}_digit_{pos}"
+            queryset = queryset.alias(**{alias: digit}).filter(**{alias: code})
+        return queryset
+
+    def recode(self, queryset, old: "Codebook") -> int:
+        """Re-encode answers coded with ``old`` to this codebook in one UPDATE.
+
+        Codes of context values or choices missing from this codebook
+        become ``NULL``. Returns the number of answers updated.
+
+        The request key of an answer is unique within its run, and remapping
+        codes could make two answers swap keys. New codes are therefore
+        first written shifted past every old code and shifted back with
+        a second UPDATE, so no intermediate row collides.
+        """
+        updates = {}
+        if (self.keys, self.values) != (old.keys, old.values):
+            index = Value(0)
+            for key, lookup, stride in zip(self.keys, self.value_index, self.strides):
+                if key not in old.keys:
+                    index = Value(None, output_field=IntegerField())
+                    break
+                pos = old.keys.index(key)
+                digit = Mod(
+                    ExpressionWrapper(
+                        F("context_idx") / old.strides[pos], output_field=IntegerField()
+                    ),
+                    len(old.values[pos]),
+                )
+                whens = [
+                    When(Exact(digit, code), then=Value(lookup[str(value)]))
+                    for code, value in enumerate(old.values[pos])
+                    if str(value) in lookup
+                ]
+                code = Case(*whens, default=None, output_field=IntegerField())
+                index = index + code * stride
+            updates["context_idx"] = index
+
+        if self.choices != old.choices:
+            for field in ("choice_a_idx", "choice_b_idx", "winner_idx"):
+                whens = [
+                    When(**{field: code}, then=Value(self.choice_index[choice]))
+                    for code, choice in enumerate(old.choices)
+                    if choice in self.choice_index
+                ]
+                updates[field] = Case(*whens, default=None, output_field=IntegerField())
+
+        if not updates:
+            return 0
+
+        offsets = {}
+        if "context_idx" in updates:
+            offsets["context_idx"] = max(old.size, self.size)
+        if "choice_a_idx" in updates:
+            offsets["choice_a_idx"] = offsets["choice_b_idx"] = max(
+                len(old.choices), len(self.choices)
+            )
+        for field, offset in offsets.items():
+            updates[field] = updates[field] + offset
+        count = queryset.update(**updates)
+        for field, offset in offsets.items():
+            queryset.filter(**{f"{field}__gte": offset}).update(**{field: F(field) - offset})
+        return count
+
+
+def _json_fragment(value: str) -> bytes:
+    """Return ``value`` JSON-escaped without the surrounding quotes."""
+    return json.dumps(value)[1:-1].encode("utf-8")
+
+
+QUESTION_PROMPT = (
+    "You are the average person defined by the demographics given in the user "
+    "message, if any. Choose between the options A and B for this question:"
+)
+
+# Request line pieces shared by every question, in line order: after the
+# custom id up to the developer message, between the developer and user
+# messages, after the user message up to the prompt cache key, and after
+# the cache key.
+REQUEST_ENVELOPE = (
+    b'","method":"POST","url":"/v1/chat/completions","body":{"model":'
+    + json.dumps(OPENAI_MODEL).encode("utf-8")
+    + b',"messages":[{"role":"developer","content":"'
+)
+REQUEST_USER = b'"},{"role":"user","content":"'
+REQUEST_CACHE_KEY = b'"}],"prompt_cache_key":"'
+REQUEST_TAIL = (
+    b'","response_format":'
+    + json.dumps(
+        {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "ab_response_schema",
+                "strict": True,
+                "schema": AB_RESPONSE_SCHEMA,
+            },
+        },
+        separators=(",", ":"),
+    ).encode("utf-8")
+    + b"}}"
+)
+
+
+def question_prompt(text: str) -> str:
+    """Return the developer message, identical for every request of a question."""
+    return f"{QUESTION_PROMPT}\n{text}"
+
+
+def context_prompt(context: dict) -> str:
+    """Return the start of the user message describing a context combination."""
+    if not context:
+        return ""
+    lines = "\n".join(f"{k}: {v}" for k, v in context.items())
+    return f"Demographics:\n{lines}\n\n"
+
+
+def _digit_count(n: int) -> int:
+    """Return the total number of decimal digits of ``0 .. n - 1``."""
+    total = 0
+    digits, low = 1, 0
+    while low < n:
+        high = 10**digits
+        total += digits * (min(n, high) - low)
+        digits, low = digits + 1, high
+    return total
+
+
+class BatchPlan:
+    """Sizes of a question's batch requests, computed without enumerating them.
+
+    Counts, request bytes and token estimates are derived from the number
+    of values per context key and the lengths of the values and choices,
+    so they cost the same for ten requests as for ten million. Context
+    combinations can still be walked lazily with :meth:`iter_combinations`
+    or fetched by index with :meth:`combination_at`.
+
+    Token counts are estimates: there is no tokenizer here, so the prompt
+    is assumed to take one token per ``CHARS_PER_TOKEN`` characters plus
+    a fixed overhead per message.
+    """
+
+    CHARS_PER_TOKEN = 4
+    TOKENS_PER_MESSAGE = 3
+    REPLY_TOKENS = 3
+    # {"answer":"A","confidence":0.85} under the strict JSON schema.
+    COMPLETION_TOKENS = 12
+
+    def __init__(self, question: "Question"):
+        self.question = question
+        self.codebook = Codebook(question.snapshot())
+
+    @property
+    def combinations(self) -> int:
+        return self.codebook.size
+
+    @property
+    def pairs(self) -> int:
+        n = len(self.codebook.choices)
+        return n * (n - 1) // 2
+
+    @property
+    def lines(self) -> int:
+        return self.combinations * self.pairs
+
+    def iter_combinations(self) -> Iterator[dict]:
+        """Lazily yield context combinations in index order."""
+        keys = self.codebook.keys
+        for combo in product(*self.codebook.values):
+            yield dict(zip(keys, combo))
+
+    def combination_at(self, index: int) -> dict:
+        """Return the context combination with number ``index``."""
+        return self.codebook.combination(index)
+
+    def _context_total(self, measure) -> int:
+        """Sum ``measure`` of :func:`context_prompt` over all combinations."""
+        if not self.combinations or not self.codebook.keys:
+            return 0
+        keys = len(self.codebook.keys)
+        total = self.combinations * (
+            measure("Demographics:\n") + (keys - 1) * measure("\n") + measure("\n\n")
+        )
+        for key, vals in zip(self.codebook.keys, self.codebook.values):
+            repeats = self.combinations // len(vals)
+            total += repeats * sum(measure(f"{key}: {v}") for v in vals)
+        return total
+
+    def request_bytes(self) -> int:
+        """Return the exact size of all request lines, newlines included."""
+        choices = self.codebook.choices
+        n = len(choices)
+        prefix = f"q{self.question.pk}:".encode("utf-8")
+        per_line = (
+            len(b'{"custom_id":"')
+            + len(prefix)
+            + len(b"::")
+            + len(REQUEST_ENVELOPE)
+            + len(_json_fragment(question_prompt(self.question.text)))
+            + len(REQUEST_USER)
+            + len(b"A: ")
+            + len(_json_fragment("\nB: "))
+            + len(REQUEST_CACHE_KEY)
+            + len(prefix)
+            + len(REQUEST_TAIL)
+            + len(b"\n")
+        )
+        per_context = 2 * _digit_count(self.combinations) + self._context_total(
+            lambda value: len(_json_fragment(value))
+        )
+        per_pair = (n - 1) * (
+            _digit_count(n) + sum(len(_json_fragment(c)) for c in choices)
+        )
+        return self.lines * per_line + self.pairs * per_context + self.combinations * per_pair
+
+    def prompt_characters(self) -> int:
+        """Return the number of message characters sent over all requests."""
+        choices = self.codebook.choices
+        per_line = len(question_prompt(self.question.text)) + len("A: \nB: ")
+        return (
+            self.lines * per_line
+            + self.pairs * self._context_total(len)
+            + self.combinations * (len(choices) - 1) * sum(map(len, choices))
+        )
+
+    def prompt_tokens(self) -> int:
+        overhead = 2 * self.TOKENS_PER_MESSAGE + self.REPLY_TOKENS
+        return -(-self.prompt_characters() // self.CHARS_PER_TOKEN) + self.lines * overhead
+
+    def completion_tokens(self) -> int:
+        return self.lines * self.COMPLETION_TOKENS
+
+    def batch_files(
+        self,
+        max_lines: int = OPENAI_BATCH_MAX_LINES,
+        max_bytes: int = OPENAI_BATCH_MAX_BYTES,
+    ) -> int:
+        """Return the expected number of batch files.
+
+        Like :meth:`Question.openai_batch_files`, whole contexts are kept
+        in one file when they fit. Line sizes vary a little between
+        contexts, so this is an estimate when ``max_bytes`` is the binding
+        limit.
+        """
+        if not self.lines:
+            return 0
+        group_bytes = self.request_bytes() / self.combinations
+        if self.pairs <= max_lines and group_bytes <= max_bytes:
+            per_file = min(max_lines // self.pairs, int(max_bytes // group_bytes))
+            return -(-self.combinations // per_file)
+        return max(-(-self.lines // max_lines), -(-self.request_bytes() // max_bytes))
+
+    def pair_at(self, index: int) -> tuple[int, int]:
+        """Return the choice indices of pair number ``index``.
+
+        Pairs are numbered in :func:`itertools.combinations` order.
+        """
+        n = len(self.codebook.choices)
+        if not 0 <= index < self.pairs:
+            raise IndexError(index)
+        i = 0
+        while index >= n - 1 - i:
+            index -= n - 1 - i
+            i += 1
+        return i, i + 1 + index
+
+    def pair_weights(self, wins: np.ndarray | None = None) -> np.ndarray:
+        """Return a sampling weight per pair, highest where outcomes are uncertain.
+
+        The weight is the posterior variance of the pair's win rate under
+        a uniform prior, given ``wins[i, j]`` wins of choice ``i`` over
+        ``j`` in earlier runs. Pairs never compared get the largest weight.
+        """
+        i, j = np.triu_indices(len(self.codebook.choices), k=1)
+        if wins is None:
+            return np.ones(len(i))
+        games = wins[i, j] + wins[j, i]
+        p = (wins[i, j] + 1) / (games + 2)
+        return p * (1 - p) / (games + 3)
+
+    def sample(
+        self,
+        budget: int,
+        weights: np.ndarray | None = None,
+        rng: np.random.Generator | None = None,
+    ) -> dict[int, list[int]]:
+        """Choose ``budget`` requests as ``{combination index: [pair index, ...]}``.
+
+        Contexts are stratified: each key's values get an equal share of
+        the budget (within one), shuffled independently per key. Within a
+        context, pairs are drawn without replacement in proportion to
+        ``weights`` (see :meth:`pair_weights`).
+        """
+        rng = rng or np.random.default_rng()
+        budget = min(budget, self.lines)
+        if budget <= 0:
+            return {}
+        pairs = self.pairs
+        weights = np.ones(pairs) if weights is None else np.asarray(weights, dtype=float)
+        cdf = np.cumsum(weights / weights.sum())
+
+        index = np.zeros(budget, dtype=np.int64)
+        for vals, stride in zip(self.codebook.values, self.codebook.strides):
+            codes = np.resize(rng.permutation(len(vals)), budget)
+            rng.shuffle(codes)
+            index += codes * stride
+        contexts, counts = np.unique(index, return_counts=True)
+        wanted = dict(zip(contexts.tolist(), np.minimum(counts, pairs).tolist()))
+
+        # Contexts drawn more often than they have pairs hand the rest on.
+        spare = int(np.maximum(counts - pairs, 0).sum())
+        start = int(rng.integers(self.combinations))
+        ctx = start
+        while spare:
+            room = pairs - wanted.get(ctx, 0)
+            if room:
+                take = min(room, spare)
+                wanted[ctx] = wanted.get(ctx, 0) + take
+                spare -= take
+            ctx = (ctx + 1) % self.combinations
+
+        selection = {}
+        for ctx, count in sorted(wanted.items()):
+            if count * 2 > pairs:
+                chosen = rng.choice(pairs, size=count, replace=False, p=weights / weights.sum())
+            else:
+                chosen = np.empty(0, dtype=np.int64)
+                while len(chosen) < count:
+                    draws = np.searchsorted(cdf, rng.random(count), side="right")
+                    chosen = np.unique(np.concatenate([chosen, np.minimum(draws, pairs - 1)]))
+                chosen = rng.permutation(chosen)[:count]
+            selection[ctx] = sorted(chosen.tolist())
+        return selection
+
+    def diff(self, old: Codebook) -> dict[int, list[int] | None]:
+        """Return the requests not covered by a run coded with ``old``.
+
+        The result maps combination indices to the pair indices to submit,
+        or to ``None`` when every pair is needed. Requests whose context
+        values and both choices were already part of ``old`` are left out.
+        A change to the context keys makes every request new.
+        """
+        if set(old.keys) != set(self.codebook.keys):
+            return {i: None for i in range(self.combinations)}
+
+        known = [
+            {str(v) for v in old.values[old.keys.index(key)]} for key in self.codebook.keys
+        ]
+        is_old = [
+            [str(v) in values for v in vals]
+            for vals, values in zip(self.codebook.values, known)
+        ]
+        added = [c not in old.choice_index for c in self.codebook.choices]
+        new_pairs = [
+            k
+            for k, (i, j) in enumerate(combinations(range(len(added)), 2))
+            if added[i] or added[j]
+        ]
+
+        selection = {}
+        if not self.pairs:
+            return selection
+        for ctx_idx in range(self.combinations):
+            ctx_is_old = all(
+                flags[(ctx_idx // stride) % len(flags)]
+                for flags, stride in zip(is_old, self.codebook.strides)
+            )
+            if not ctx_is_old:
+                selection[ctx_idx] = None
+            elif new_pairs:
+                selection[ctx_idx] = new_pairs
+        return selection
+
+    def as_dict(self) -> dict:
+        return {
+            "combinations": self.combinations,
+            "pairs": self.pairs,
+            "lines": self.lines,
+            "request_bytes": self.request_bytes(),
+            "batch_files": self.batch_files(),
+            "prompt_tokens": self.prompt_tokens(),
+            "completion_tokens": self.completion_tokens(),
+        }
+
+
+def validate_sample_fraction(value: float) -> None:
+    """Accept fractions in (0, 1]; a fraction of 0 would sample nothing."""
+    if not 0 < value <= 1:
+        raise ValidationError("Enter a fraction greater than 0 and at most 1.")
+
+
+def context_hash(context: dict) -> str:
+    """Return a stable digest identifying a context dictionary."""
+    encoded = json.dumps(context, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(encoded.encode("utf-8")).hexdigest()
+
 
 class Question(models.Model):
     uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
@@ -53,21 +628,78 @@ class Question(models.Model):
     ]
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="draft", db_index=True)
 
+    # Sampling mode: submit at most this many requests, or this fraction of
+    # all context × pair requests, per run. Both empty submits everything.
+    sample_size = models.PositiveIntegerField(
+        null=True, blank=True, validators=[MinValueValidator(1)]
+    )
+    sample_fraction = models.FloatField(
+        null=True, blank=True, validators=[validate_sample_fraction]
+    )
+
     def __str__(self) -> str:
         return self.text
 
     def context_combinations(self) -> List[dict]:
-        """Return all possible context dictionaries for this question."""
-        if not self.context:
-            return [{}]
-
-        keys = list(self.context.keys())
-        value_sequences = [
-            v if isinstance(v, (list, tuple)) else [v]
-            for v in (self.context[k] for k in keys)
-        ]
+        """Return all possible context dictionaries for this question.
+
+        This builds every combination at once; use :meth:`plan` to count
+        or walk them lazily.
+        """
+        return context_combinations(self.context)
+
+    def plan(self) -> BatchPlan:
+        """Return the request counts and sizes of this question's batches."""
+        return BatchPlan(self)
+
+    def request_budget(self) -> int | None:
+        """Return the number of requests to sample per run, or ``None`` for all."""
+        lines = self.plan().lines
+        budgets = []
+        if self.sample_size is not None:
+            budgets.append(self.sample_size)
+        if self.sample_fraction is not None:
+            budgets.append(math.ceil(self.sample_fraction * lines))
+        if not budgets or min(budgets) >= lines:
+            return None
+        # Questions saved before the validators existed may hold a 0.
+        return max(min(budgets), 1)
+
+    def pairwise_wins(self) -> np.ndarray:
+        """Return wins between current choices summed over all earlier runs."""
+        choice_index = self.plan().codebook.choice_index
+        wins = np.zeros((len(choice_index), len(choice_index)), dtype=np.int64)
+        totals = (
+            GraphEdge.objects.filter(question=self)
+            .values("winner", "loser")
+            .annotate(total=models.Sum("count"))
+        )
+        for row in totals:
+            i = choice_index.get(row["winner"])
+            j = choice_index.get(row["loser"])
+            if i is not None and j is not None:
+                wins[i, j] += row["total"]
+        return wins
+
+    def sample_requests(self, seed=None) -> dict[int, list[int]] | None:
+        """Return the requests of a sampled run, or ``None`` to submit all.
+
+        Pairs whose outcome is still uncertain after earlier runs are
+        favoured; see :meth:`BatchPlan.sample`.
+        """
+        budget = self.request_budget()
+        if budget is None:
+            return None
+        plan = self.plan()
+        return plan.sample(
+            budget,
+            weights=plan.pair_weights(self.pairwise_wins()),
+            rng=np.random.default_rng(seed),
+        )
 
-        return [dict(zip(keys, combo)) for combo in product(*value_sequences)]
+    def snapshot(self) -> dict:
+        """Return the parts of the question that custom ids refer to."""
+        return {"context": self.context, "choices": unique_choices(self.choices)}
 
     def render_all_questions(self) -> List[tuple[str, dict]]:
         """Return question text with every context combination."""
@@ -90,7 +722,7 @@ class Question(models.Model):
         >>> q.choice_pairs()
         [{"A": "Turkey", "B": "Mexico"}, {"A": "Turkey", "B": "Germany"}, {"A": "Mexico", "B": "Germany"}]
         """
-        items = list(dict.fromkeys(self.choices or []))
+        items = unique_choices(self.choices)
 
         if len(items) < 2:
             return []
@@ -98,10 +730,130 @@ class Question(models.Model):
         pair_iter = combinations(items, 2)
         return [{"A": a, "B": b} for a, b in pair_iter]
 
-    def get_openai_batches(self, max_lines: int = 50_000) -> List[str]:
+    def iter_openai_request_groups(
+        self, selection: Dict[int, List[int]] | None = None
+    ) -> Iterator[tuple[int, Iterator[bytes]]]:
+        """
+        Lazily yield the batch request lines of each context combination.
+
+        Requests are laid out for provider-side prompt caching: the
+        developer message holds the instructions and the question text and
+        is identical for every request of the question, the user message
+        starts with the demographics and ends with the pair. Requests of
+        one context therefore differ only in their last few tokens, and
+        they share a ``prompt_cache_key`` so they are routed to the same
+        cache.
+
+        The parts shared by every line and by every line of a context are
+        encoded once; only the custom id and the pair are encoded per line.
+        Custom ids use the compact index form of :func:`encode_custom_id`.
+
+        Parameters
+        ----------
+        selection : dict[int, list[int]], optional
+            Only yield these pair indices for these combination indices, as
+            returned by :meth:`sample_requests`; ``None`` as a value stands
+            for every pair. All requests by default.
+
+        Yields
+        ------
+        tuple[int, Iterator[bytes]]
+            The number of lines of the context and an iterator over them,
+            each a compact JSON request without the trailing newline.
+        """
+        question = REQUEST_ENVELOPE + _json_fragment(question_prompt(self.text)) + REQUEST_USER
+        sep_b = _json_fragment("\nB: ")
+        choices = [_json_fragment(c) for c in unique_choices(self.choices)]
+        pairs = [
+            (f"{i}:{j}".encode("utf-8"), choices[i], choices[j])
+            for i, j in combinations(range(len(choices)), 2)
+        ]
+
+        plan = self.plan()
+        if selection is None:
+            contexts = enumerate(plan.iter_combinations())
+        else:
+            contexts = ((i, plan.combination_at(i)) for i in sorted(selection))
+
+        for ctx_idx, ctx in contexts:
+            cache_key = f"q{self.pk}:{ctx_idx}".encode("utf-8")
+            head = cache_key + b":"
+            prefix = question + _json_fragment(context_prompt(ctx)) + b"A: "
+            tail = REQUEST_CACHE_KEY + cache_key + REQUEST_TAIL
+
+            wanted = None if selection is None else selection[ctx_idx]
+            ctx_pairs = pairs if wanted is None else [pairs[k] for k in wanted]
+            yield len(ctx_pairs), (
+                b"".join((b'{"custom_id":"', head, pair_id, prefix, enc_a, sep_b, enc_b, tail))
+                for pair_id, enc_a, enc_b in ctx_pairs
+            )
+
+    def iter_openai_requests(
+        self, selection: Dict[int, List[int]] | None = None
+    ) -> Iterator[bytes]:
+        """
+        Lazily yield one encoded OpenAI batch request line per context and pair.
+
+        See :meth:`iter_openai_request_groups` for the layout and
+        ``selection``.
+        """
+        for _, lines in self.iter_openai_request_groups(selection):
+            yield from lines
+
+    def openai_batch_files(
+        self,
+        max_lines: int = OPENAI_BATCH_MAX_LINES,
+        max_bytes: int = OPENAI_BATCH_MAX_BYTES,
+        selection: Dict[int, List[int]] | None = None,
+    ) -> Iterator[IO[bytes]]:
+        """
+        Write the batch requests to temporary .jsonl files, one per batch.
+
+        A new file is started whenever the next line would exceed either
+        ``max_lines`` lines or ``max_bytes`` bytes. A context whose lines
+        would fit in a file of their own but not in the rest of the
+        current one also starts a new file, so requests sharing a prompt
+        prefix are processed together. Each file is yielded rewound to the
+        start; the caller is responsible for closing it. ``selection``
+        limits the requests as in :meth:`iter_openai_requests`.
+        """
+        fh = None
+        lines = size = 0
+
+        for count, group in self.iter_openai_request_groups(selection):
+            if fh is not None and lines:
+                expected = count * size / lines
+                fits_alone = count <= max_lines and expected <= max_bytes
+                fits_here = lines + count <= max_lines and size + expected <= max_bytes
+                if fits_alone and not fits_here:
+                    fh.seek(0)
+                    yield fh
+                    fh = None
+
+            for line in group:
+                line += b"\n"
+                if fh is not None and (lines >= max_lines or size + len(line) > max_bytes):
+                    fh.seek(0)
+                    yield fh
+                    fh = None
+                if fh is None:
+                    fh = tempfile.TemporaryFile()
+                    lines = size = 0
+                fh.write(line)
+                lines += 1
+                size += len(line)
+
+        if fh is not None:
+            fh.seek(0)
+            yield fh
+
+    def get_openai_batches(self, max_lines: int = OPENAI_BATCH_MAX_LINES) -> List[str]:
         """
         Produce newline-delimited-JSON payloads for the OpenAI batch endpoint.
 
+        This holds every payload in memory; prefer :meth:`openai_batch_files`
+        for anything but small questions.
+
         Parameters
         ----------
         max_lines : int, optional
@@ -112,74 +864,99 @@ class Question(models.Model):
         List[str]
             Each item is the raw text of a .jsonl batch containing ≤ ``max_lines`` lines.
         """
-        contexts = self.context_combinations()
-        pairs = self.choice_pairs()
-
-        json_lines: List[str] = []
-
-        for _ctx in contexts:
-            ctx_lines = "\n".join(f"{k}: {v}" for k, v in _ctx.items())
-            dev_msg = "You are the average person defined by these demographics:"
-            if ctx_lines:
-                dev_msg += "\n" + ctx_lines
-            for pair in pairs:
-                user_msg = f"{self.text}\nA: {pair['A']}\nB: {pair['B']}"
-
-                body = {
-                    "model": "gpt-4o-mini",
-                    "messages": [
-                        {"role": "developer", "content": dev_msg},
-                        {"role": "user", "content": user_msg},
-                    ],
-                    "response_format": {
-                        "type": "json_schema",
-                        "json_schema": {
-                            "name": "ab_response_schema",
-                            "strict": True,
-                            "schema": AB_RESPONSE_SCHEMA,
-                        }
-                    },
-                }
-
-                ctx_key_order = sorted(_ctx)
-                ctx_part = "-".join(str(_ctx[k]) for k in ctx_key_order)
-                custom_id = f"q{self.pk}-{ctx_part}-{pair['A']}-{pair['B']}"
-
-                json_lines.append(
-                    json.dumps(
-                        {
-                            "custom_id": custom_id,
-                            "method": "POST",
-                            "url": "/v1/chat/completions",
-                            "body": body,
-                        },
-                        separators=(",", ":")  # compact JSON
-                    )
-                )
+        batches = []
+        for fh in self.openai_batch_files(max_lines=max_lines):
+            with fh:
+                batches.append(fh.read().decode("utf-8").rstrip("\n"))
+        return batches
+
+    def last_completed_run(self):
+        """Return the latest run whose batches all finished, or ``None``.
+
+        At least one batch of the run must have completed and every
+        completed batch must have been imported. ``None`` is also returned
+        when that run cannot be extended: it was sampled, so it does not
+        cover every request, or it was submitted before batches stored
+        their snapshot, so what it covered is unknown.
+        """
+        runs: Dict[uuid.UUID, list] = {}
+        batches = self.openai_batches.order_by("-created_at").values_list(
+            "run_id", "data", "imported_at", "snapshot", "sampled"
+        )
+        for run_id, data, imported_at, snapshot, sampled in batches:
+            runs.setdefault(run_id, []).append(
+                ((data or {}).get("status"), imported_at, bool(snapshot), sampled)
+            )
 
-        # Split into batches of at most `max_lines` JSON objects
-        return [
-            "\n".join(json_lines[i : i + max_lines])
-            for i in range(0, len(json_lines), max_lines)
-        ]
+        for run_id, states in runs.items():
+            statuses = [status for status, _, _, _ in states]
+            finished = all(status in OpenAIBatch.TERMINAL_STATUSES for status in statuses)
+            imported = all(at for status, at, _, _ in states if status == "completed")
+            if finished and imported and "completed" in statuses:
+                complete = all(snapshot and not sampled for _, _, snapshot, sampled in states)
+                return run_id if complete else None
+        return None
 
-    def submit_batches(self):
-        client = openai.OpenAI()
+    def submit_batches(
+        self, client=None, max_workers: int | None = None, incremental: bool = False
+    ):
+        """
+        Upload the batch files and create one OpenAI batch per file.
 
-        run_id = uuid.uuid4()
+        Uploads and batch creations run concurrently on a bounded thread
+        pool sharing one client (and so one HTTP connection pool). Each
+        :class:`OpenAIBatch` is stored as soon as its batch is created.
+        In sampling mode only the requests chosen by
+        :meth:`sample_requests` are submitted.
 
-        for i, payload in enumerate(self.get_openai_batches()):
-            buf = BytesIO()
+        With ``incremental`` the question is compared with the snapshot of
+        :meth:`last_completed_run` and only the requests it did not cover
+        are submitted, under the same run id. The run's existing answers
+        are re-encoded to the new codebook so the run reads as one, and its
+        edges are rebuilt from the answers that still have codes. A change
+        to the context keys starts a new run instead.
 
-            buf.write(payload.encode("utf-8"))
-            buf.write(b"\n")
-            buf.seek(0)
+        Parameters
+        ----------
+        client : openai.OpenAI, optional
+            Client to use; a new one is created when omitted.
+        max_workers : int, optional
+            Number of concurrent uploads. Defaults to
+            ``settings.POLL_OPENAI_CONCURRENCY``.
+        incremental : bool, optional
+            Extend the last completed run instead of starting a new one.
+            Sampling does not apply to incremental runs.
+        """
+        client = client or openai_client()
+        max_workers = max_workers or getattr(settings, "POLL_OPENAI_CONCURRENCY", 8)
 
-            # upload the buffer
-            file_obj = client.files.create(
-                file=(f"batch_{self.pk}_{i:02d}.jsonl", buf),
-                purpose="batch",
-            )
+        run_id = uuid.uuid4()
+        snapshot = self.snapshot()
+        selection = self.sample_requests()
+
+        base_run = self.last_completed_run() if incremental else None
+        if base_run is not None:
+            previous = self.codebook(base_run)
+            if set(previous.keys) != set(Codebook(snapshot).keys):
+                # Every request is new; merging would count the old answers twice.
+                base_run = None
+        sampled = selection is not None and base_run is None
+        if base_run is not None:
+            run_id = base_run
+            selection = self.plan().diff(previous)
+            if not selection:
+                # The last run already covers the question as it stands.
+                self.status = "completed"
+                self.save(update_fields=["status"])
+                return
+
+        def submit(i: int, fh) -> dict:
+            # upload the temporary file
+            with fh:
+                file_obj = client.files.create(
+                    file=(f"batch_{self.pk}_{i:02d}.jsonl", fh),
+                    purpose="batch",
+                )
 
             # create the batch job
             batch = client.batches.create(
@@ -187,18 +964,74 @@ class Question(models.Model):
                 endpoint="/v1/chat/completions",
                 input_file_id=file_obj.id,
             )
+            return batch.model_dump()
+
+        errors = []
+        created = []
 
-            # bookkeeping - store the full response object as JSON
-            OpenAIBatch.objects.create(
-                question=self,
-                run_id=run_id,
-                data=batch.model_dump(),
+        def record(done) -> None:
+            for future in done:
+                if future.exception() is not None:
+                    errors.append(future.exception())
+                    continue
+                # bookkeeping - store the full response object as JSON
+                created.append(future.result())
+                OpenAIBatch.objects.create(
+                    question=self,
+                    run_id=run_id,
+                    data=future.result(),
+                    snapshot=snapshot,
+                    sampled=sampled,
+                )
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            pending = set()
+            for i, fh in enumerate(self.openai_batch_files(selection=selection)):
+                # Store the batches created since the last file right away.
+                done = {future for future in pending if future.done()}
+                pending -= done
+                record(done)
+                # Bound the number of temporary files waiting for upload.
+                if len(pending) >= 2 * max_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    record(done)
+                pending.add(pool.submit(submit, i, fh))
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                record(done)
+
+        if base_run is not None and created:
+            Codebook(snapshot).recode(
+                Answer.objects.filter(question=self, run_id=run_id), previous
             )
+            # Answers of removed context values or choices lost their codes.
+            GraphEdge.rebuild(self, run_id)
+
+        if errors:
+            raise errors[0]
 
         # Record that the question has been queued for processing
         self.status = "queued"
         self.save(update_fields=["status"])
 
+    def codebook(self, run_id=None) -> Codebook:
+        """Return the codebook of a run, or of the current definition.
+
+        Incremental runs hold batches with several snapshots; the latest
+        one covers the whole run and is the one answers are coded with.
+        """
+        snapshot = None
+        if run_id is not None:
+            snapshot = (
+                self.openai_batches.filter(run_id=run_id)
+                .exclude(snapshot={})
+                .order_by("-created_at")
+                .values_list("snapshot", flat=True)
+                .first()
+            )
+        return Codebook(snapshot or self.snapshot())
+
     def latest_answers(self):
         """Return answers from the most recently created batch."""
         last_batch = self.openai_batches.order_by("-created_at").first()
@@ -209,6 +1042,65 @@ class Question(models.Model):
     def latest_batch(self):
         return self.openai_batches.order_by("-created_at").first()
 
+    def usage_by_run(self) -> List[dict]:
+        """Return request counts, token usage and cost per run, newest first."""
+        runs: Dict[uuid.UUID, dict] = {}
+        for batch in self.openai_batches.order_by("-created_at"):
+            run = runs.setdefault(
+                batch.run_id,
+                {
+                    "run_id": str(batch.run_id),
+                    "batches": 0,
+                    "imported_batches": 0,
+                    "requests": 0,
+                    "failed_requests": 0,
+                    "prompt_tokens": 0,
+                    "cached_tokens": 0,
+                    "completion_tokens": 0,
+                    "created_at": batch.created_at,
+                    "seconds": None,
+                },
+            )
+            counts = batch.data.get("request_counts") or {}
+            run["batches"] += 1
+            run["imported_batches"] += batch.imported_at is not None
+            run["requests"] += counts.get("completed") or 0
+            run["failed_requests"] += counts.get("failed") or 0
+            run["prompt_tokens"] += batch.prompt_tokens
+            run["cached_tokens"] += batch.cached_tokens
+            run["completion_tokens"] += batch.completion_tokens
+            run["created_at"] = batch.created_at
+            if batch.duration_seconds is not None:
+                run["seconds"] = max(run["seconds"] or 0, batch.duration_seconds)
+
+        for run in runs.values():
+            prompt = run["prompt_tokens"]
+            run["cache_hit_rate"] = round(run["cached_tokens"] / prompt, 3) if prompt else 0.0
+            run["cost"] = token_cost(
+                prompt, run["cached_tokens"], run["completion_tokens"]
+            )
+            run["requests_per_second"] = (
+                round(run["requests"] / run["seconds"], 2) if run["seconds"] else None
+            )
+        return list(runs.values())
+
+    def latest_run_state(self):
+        """Return ``(run_id, modified)`` of the latest run, or ``None``.
+
+        ``modified`` is the latest ``updated_at`` among the run's batches.
+        """
+        run_id = (
+            self.openai_batches.order_by("-created_at")
+            .values_list("run_id", flat=True)
+            .first()
+        )
+        if run_id is None:
+            return None
+        modified = self.openai_batches.filter(run_id=run_id).aggregate(
+            modified=models.Max("updated_at")
+        )["modified"]
+        return run_id, modified
+
     @property
     def latest_batch_status(self) -> str:
         """Return the stored question status."""
@@ -216,11 +1108,24 @@ class Question(models.Model):
 
 
 class OpenAIBatch(models.Model):
+    TERMINAL_STATUSES = ["completed", "failed", "expired", "cancelled"]
+
     question = models.ForeignKey(
         Question, on_delete=models.CASCADE, related_name="openai_batches"
     )
     run_id = models.UUIDField(default=uuid.uuid4, editable=False, db_index=True)
     data = models.JSONField(default=dict)
+    # Question context and choices at submission time; custom ids index into them.
+    snapshot = models.JSONField(default=dict, blank=True)
+    # Submitted in sampling mode, so the run does not cover every request.
+    sampled = models.BooleanField(default=False)
+    imported_at = models.DateTimeField(null=True, blank=True)
+    # Output file lines imported so far; an interrupted import resumes here.
+    imported_lines = models.PositiveIntegerField(default=0)
+    # Token usage summed over the output file at import time.
+    prompt_tokens = models.PositiveBigIntegerField(default=0)
+    cached_tokens = models.PositiveBigIntegerField(default=0)
+    completion_tokens = models.PositiveBigIntegerField(default=0)
 
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     updated_at = models.DateTimeField(auto_now=True, db_index=True)
@@ -268,108 +1173,101 @@ class OpenAIBatch(models.Model):
     def __str__(self) -> str:
         return self.batch_id or "unknown"
 
-    def update_status(self):
-        client = openai.OpenAI()
+    def update_status(self, client=None, defer_import: bool = False):
+        client = client or openai_client()
 
         batch = client.batches.retrieve(self.batch_id)
         self.data = batch.model_dump()
         self.save()
+        self.apply_status(client=client, defer_import=defer_import)
 
+    def apply_status(self, client=None, defer_import: bool = False):
+        """Mirror the stored batch status on the question.
+
+        Results of a completed batch are imported first unless they already
+        were. With ``defer_import`` the import is queued as a :class:`Job`
+        instead and the question stays ``importing`` until a worker ran it.
+        """
         q = self.question
         if self.status == "completed":
-            if not Answer.objects.filter(run_id=self.run_id, question=q).exists():
+            if self.imported_at is None:
                 q.status = "importing"
                 q.save(update_fields=["status"])
-                self.retrieve_results()
+                if defer_import:
+                    # Any queued import, forced or not, imports the batch.
+                    if not self.jobs.filter(kind="import_batch", status="queued").exists():
+                        Job.enqueue("import_batch", question=q, batch=self)
+                    return
+                self.retrieve_results(client=client)
             q.status = "completed"
         else:
             q.status = self.status or q.status
         q.save(update_fields=["status"])
 
-    def retrieve_results(self) -> List[dict]:
-        """Download and parse the batch output file.
+    def retrieve_results(
+        self,
+        chunk_size: int | None = None,
+        client=None,
+        force: bool = False,
+        bulk: bool | None = None,
+    ):
+        """Stream the batch output file into :class:`Answer` rows.
+
+        An interrupted import resumes after the last committed chunk. A
+        batch that was imported completely is left alone unless ``force``
+        is given, in which case the whole file is read again; answers the
+        run already has are not written twice.
+
+        Parameters
+        ----------
+        chunk_size : int, optional
+            Number of answers written per ``bulk_create`` call. Defaults to
+            ``settings.POLL_IMPORT_CHUNK_SIZE``.
+        client : openai.OpenAI, optional
+            Client to download with; a new one is created when omitted.
+        force : bool, optional
+            Import the whole file again.
+        bulk : bool, optional
+            Commit several chunks per transaction. Defaults to
+            ``settings.POLL_IMPORT_BULK``.
 
         Returns
         -------
-        list[dict]
-            Parsed JSON entries from the output file. An empty list is
-            returned if ``output_file_id`` is not available.
+        ImportStats
+            Line and answer counts, throughput and peak memory of the import.
+            Empty statistics are returned if ``output_file_id`` is not
+            available or the batch was already imported. A completed batch
+            without an output file, whose requests all failed, is marked
+            as imported.
         """
+        from .importer import ImportStats, ResultImporter, iter_output_lines
+
         if not self.output_file_id:
-            return []
+            if self.status == "completed" and self.imported_at is None:
+                self.imported_at = timezone.now()
+                self.save(update_fields=["imported_at", "updated_at"])
+            return ImportStats()
+        if force:
+            self.imported_at = None
+            self.imported_lines = 0
+        elif self.imported_at is not None:
+            return ImportStats()
 
         q = self.question
         q.status = "importing"
         q.save(update_fields=["status"])
 
-        client = openai.OpenAI()
-        file_response = client.files.content(self.output_file_id)
-
-        results = []
-        for line in file_response.text.splitlines():
-            line = line.strip()
-            if line:
-                entry = json.loads(line)
-                results.append(entry)
-
-                custom_id = entry.get("custom_id", "")
-                parts = custom_id.split("-")
-
-                # Expect: q<id>-<ctx values...>-<A>-<B>
-                if not parts or not parts[0].startswith("q"):
-                    continue
-
-                try:
-                    question_id = int(parts[0][1:])
-                except ValueError:
-                    continue
-
-                try:
-                    question = Question.objects.get(pk=question_id)
-                except Question.DoesNotExist:
-                    continue
-
-                ctx_keys = sorted(question.context.keys())
-                ctx_values = parts[1 : 1 + len(ctx_keys)]
-                context = dict(zip(ctx_keys, ctx_values))
-
-                try:
-                    choice_a = parts[1 + len(ctx_keys)]
-                    choice_b = parts[2 + len(ctx_keys)]
-                except IndexError:
-                    continue
+        client = client or openai_client()
+        importer = ResultImporter(self, chunk_size=chunk_size, bulk=bulk)
+        stats = importer.run(iter_output_lines(client, self.output_file_id))
 
-                choices = {"A": choice_a, "B": choice_b}
-
-                # Extract answer and confidence from response body
-                body = (
-                    entry.get("response", {})
-                    .get("body", {})
-                )
-                message = None
-                if body:
-                    choices_resp = body.get("choices", [])
-                    if choices_resp:
-                        message = choices_resp[0].get("message", {})
-
-                try:
-                    content = message.get("content", "") if message else ""
-                    parsed = json.loads(content) if content else {}
-                except json.JSONDecodeError:
-                    parsed = {}
-
-                Answer.objects.create(
-                    question=question,
-                    run_id=self.run_id,
-                    context=context,
-                    choices=choices,
-                    choice=parsed.get("answer"),
-                    confidence=parsed.get("confidence"),
-                )
+        # Also marks the run as changed, which invalidates cached charts.
+        self.imported_at = timezone.now()
+        self.save(update_fields=["imported_at", "updated_at"])
 
         q.status = "completed"
         q.save(update_fields=["status"])
-        return results
+        return stats
 
 
 class Answer(models.Model):
@@ -382,3 +1280,303 @@ class Answer(models.Model):
         choices=[(c, c) for c in ["A", "B"]],
     )
     confidence = models.FloatField(null=True, blank=True)
+
+    # Integer codes of ``context``, ``choices`` and ``choice``, see Codebook.
+    context_idx = models.PositiveIntegerField(null=True, blank=True)
+    choice_a_idx = models.PositiveSmallIntegerField(null=True, blank=True)
+    choice_b_idx = models.PositiveSmallIntegerField(null=True, blank=True)
+    winner_idx = models.PositiveSmallIntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["question", "run_id", "id"]),
+        ]
+        constraints = [
+            # One answer per request of a run; also serves context lookups.
+            models.UniqueConstraint(
+                fields=["question", "run_id", "context_idx", "choice_a_idx", "choice_b_idx"],
+                name="unique_answer_request",
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        """Save the answer and keep its run's :class:`GraphEdge` rows in step.
+
+        New answers are folded into the edge counts; changes to an existing
+        answer rebuild the run's edges. Bulk writes such as the importer's
+        maintain the edges themselves.
+        """
+        if self.context_idx is None and self.question_id:
+            self.question.codebook(self.run_id).encode(self)
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                touch_run(self.question_id, self.run_id)
+                GraphEdge.add_answers([self])
+            else:
+                GraphEdge.rebuild(self.question_id, self.run_id)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            GraphEdge.rebuild(self.question_id, self.run_id)
+        return result
+
+
+def coded_answers(answers):
+    """Return the answers of a queryset that carry every integer code."""
+    return answers.filter(
+        context_idx__isnull=False,
+        choice_a_idx__isnull=False,
+        choice_b_idx__isnull=False,
+        winner_idx__isnull=False,
+    )
+
+
+def touch_run(question: "Question | int", run_id) -> None:
+    """Bump ``updated_at`` of a run's batches before changing its answers.
+
+    The update locks the batches until the end of the transaction, like an
+    import does, and invalidates the cached charts of the run.
+    """
+    OpenAIBatch.objects.filter(question=question, run_id=run_id).update(
+        updated_at=timezone.now()
+    )
+
+
+EDGE_COLUMNS = [
+    "question",
+    "run_id",
+    "context_hash",
+    "context",
+    "winner",
+    "loser",
+    "count",
+    "confidence_sum",
+]
+
+
+class GraphEdge(models.Model):
+    """Pre-aggregated head-to-head wins of one choice over another.
+
+    One row per question, run, context combination and ordered
+    ``(winner, loser)`` pair. Rows are folded in by the result importer so
+    the chart endpoints read O(choices²) rows instead of every answer.
+    Only answers carrying every integer code are counted.
+    """
+
+    question = models.ForeignKey(
+        Question, on_delete=models.CASCADE, related_name="graph_edges"
+    )
+    run_id = models.UUIDField()
+    context_hash = models.CharField(max_length=40)
+    context = models.JSONField(default=dict)
+    winner = models.CharField(max_length=500)
+    loser = models.CharField(max_length=500)
+    count = models.PositiveIntegerField(default=0)
+    confidence_sum = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["question", "run_id", "context_hash", "winner", "loser"],
+                name="unique_graph_edge",
+            )
+        ]
+        indexes = [models.Index(fields=["question", "run_id"])]
+
+    def __str__(self) -> str:
+        return f"{self.winner} > {self.loser} ({self.count})"
+
+    @classmethod
+    def add_answers(cls, answers) -> None:
+        """Fold ``answers`` into the stored edge counts."""
+        deltas: dict[tuple, list] = {}
+        for ans in answers:
+            if None in (ans.context_idx, ans.choice_a_idx, ans.choice_b_idx, ans.winner_idx):
+                continue
+            loser_key = {"A": "B", "B": "A"}.get(ans.choice)
+            if loser_key is None:
+                continue
+            winner = ans.choices.get(ans.choice)
+            loser = ans.choices.get(loser_key)
+            if not winner or not loser:
+                continue
+            key = (ans.question_id, ans.run_id, context_hash(ans.context), winner, loser)
+            delta = deltas.setdefault(key, [ans.context, 0, 0.0])
+            delta[1] += 1
+            delta[2] += ans.confidence or 0.0
+
+        if not deltas:
+            return
+
+        rows = [
+            (qid, run_id, ctx_hash, context, winner, loser, count, confidence_sum)
+            for (qid, run_id, ctx_hash, winner, loser), (context, count, confidence_sum)
+            in deltas.items()
+        ]
+        fields = [cls._meta.get_field(name) for name in EDGE_COLUMNS]
+        size = connection.ops.bulk_batch_size(fields, rows)
+        for start in range(0, len(rows), size):
+            cls.upsert(rows[start : start + size])
+
+    @classmethod
+    def upsert(cls, rows: list[tuple]) -> None:
+        """Insert edge rows, adding counts to the edges that already exist.
+
+        A single ``INSERT ... ON CONFLICT DO UPDATE`` increments the stored
+        values in the database, so concurrent imports of the same run never
+        overwrite each other's counts.
+        """
+        quote = connection.ops.quote_name
+        fields = [cls._meta.get_field(name) for name in EDGE_COLUMNS]
+        table = quote(cls._meta.db_table)
+        columns = ", ".join(quote(field.column) for field in fields)
+        conflict = ", ".join(
+            quote(cls._meta.get_field(name).column)
+            for name in ("question", "run_id", "context_hash", "winner", "loser")
+        )
+        increments = ", ".join(
+            f"{quote(name)} = {table}.{quote(name)} + EXCLUDED.{quote(name)}"
+            for name in ("count", "confidence_sum")
+        )
+        placeholders = ", ".join(["(" + ", ".join(["%s"] * len(fields)) + ")"] * len(rows))
+        params = [
+            field.get_db_prep_save(value, connection)
+            for row in rows
+            for field, value in zip(fields, row)
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} ({columns}) VALUES {placeholders} "
+                f"ON CONFLICT ({conflict}) DO UPDATE SET {increments}",
+                params,
+            )
+
+    @classmethod
+    def rebuild(cls, question: Question | int, run_id) -> None:
+        """Recompute the edges of a run from its stored answers.
+
+        Answers missing a code, such as those of context values or choices
+        removed from an incremental run, are left out. The run's batches
+        are locked for the rebuild, so it waits for imports into the run
+        and concurrent rebuilds cannot add their counts twice, and cached
+        charts of the run are invalidated.
+        """
+        with transaction.atomic():
+            touch_run(question, run_id)
+            cls.objects.filter(question=question, run_id=run_id).delete()
+            answers = coded_answers(Answer.objects.filter(question=question, run_id=run_id))
+            cls.add_answers(answers.iterator(chunk_size=2000))
+
+    @classmethod
+    def for_run(cls, question: Question, run_id):
+        """Return the edges of a run in a stable order."""
+        return cls.objects.filter(question=question, run_id=run_id).order_by("pk")
+
+
+class Job(models.Model):
+    """A unit of background work, run by ``manage.py run_jobs`` workers.
+
+    Workers claim queued jobs with a conditional update, so any number of
+    worker processes can share the table. Failed jobs are retried with
+    exponential backoff until ``max_attempts`` is reached; jobs whose
+    worker disappeared are claimed again after ``POLL_JOB_TIMEOUT``.
+    """
+
+    KIND_CHOICES = [
+        ("submit_batches", "submit batches"),
+        ("update_batch", "update batch"),
+        ("import_batch", "import batch"),
+    ]
+    STATUS_CHOICES = [
+        ("queued", "queued"),
+        ("running", "running"),
+        ("succeeded", "succeeded"),
+        ("failed", "failed"),
+    ]
+
+    kind = models.CharField(max_length=32, choices=KIND_CHOICES)
+    question = models.ForeignKey(
+        Question, on_delete=models.CASCADE, null=True, blank=True, related_name="jobs"
+    )
+    batch = models.ForeignKey(
+        OpenAIBatch, on_delete=models.CASCADE, null=True, blank=True, related_name="jobs"
+    )
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="queued")
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "run_after"])]
+
+    def __str__(self) -> str:
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+    @classmethod
+    def enqueue(
+        cls,
+        kind: str,
+        question: Question | None = None,
+        batch: OpenAIBatch | None = None,
+        max_attempts: int | None = None,
+        **payload,
+    ) -> "Job":
+        """Queue a job, or return the same job if it is already queued.
+
+        Raises ``ValueError`` if a job of the same kind for the same
+        question and batch is queued with a different payload, e.g. a full
+        submission while an incremental one is waiting.
+        """
+        existing = cls.objects.filter(
+            kind=kind, question=question, batch=batch, status="queued"
+        ).first()
+        if existing is not None:
+            if existing.payload != payload:
+                raise ValueError(
+                    f"A {existing.get_kind_display()} job with other options is already queued"
+                )
+            return existing
+        if max_attempts is None:
+            max_attempts = getattr(settings, "POLL_JOB_MAX_ATTEMPTS", 5)
+        return cls.objects.create(
+            kind=kind,
+            question=question,
+            batch=batch,
+            payload=payload,
+            max_attempts=max_attempts,
+        )
+
+    def retry_delay(self) -> float:
+        """Seconds to wait before the next attempt, doubling per attempt."""
+        base = getattr(settings, "POLL_JOB_RETRY_DELAY", 30)
+        limit = getattr(settings, "POLL_JOB_MAX_RETRY_DELAY", 60 * 60)
+        return min(base * 2 ** max(self.attempts - 1, 0), limit)
+
+    def error_message(self) -> str:
+        """Return the exception line of :attr:`last_error` without the traceback."""
+        lines = self.last_error.strip().splitlines()
+        return lines[-1] if lines else ""
+
+    def as_dict(self) -> dict:
+        return {
+            "id": self.pk,
+            "kind": self.kind,
+            "status": self.status,
+            "attempts": self.attempts,
+            "max_attempts": self.max_attempts,
+            "run_after": self.run_after.isoformat(),
+            "last_error": self.error_message(),
+            "created_at": self.created_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
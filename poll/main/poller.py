@@ -0,0 +1,179 @@
+"""Concurrent polling of OpenAI batches that have not finished yet."""
+
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Q
+
+from .models import OpenAIBatch, openai_client
+
+
+class BatchPoller:
+    """Refresh non-terminal batches and queue completed ones for import.
+
+    Statuses are retrieved concurrently on a thread pool sharing one
+    client. Each batch is polled again after an interval that adapts to
+    its age and progress: batches close to done are checked often, batches
+    that have barely started are checked less and less often. Completed
+    batches are put on :attr:`imports` and imported by
+    :meth:`import_pending` or by the importer thread of :meth:`run`; with
+    ``defer_imports`` they are queued as jobs for ``run_jobs`` workers.
+    Completed batches that were never imported, because an import failed
+    or the process stopped with batches still queued, are picked up again
+    and retried every ``max_interval`` seconds.
+    """
+
+    def __init__(
+        self,
+        client=None,
+        max_workers: int | None = None,
+        min_interval: float = 30,
+        max_interval: float = 30 * 60,
+        log: Callable[[str], None] | None = None,
+        defer_imports: bool = False,
+    ):
+        self.client = client or openai_client()
+        self.max_workers = max_workers or getattr(settings, "POLL_OPENAI_CONCURRENCY", 8)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.log = log or (lambda message: None)
+        self.defer_imports = defer_imports
+        self.imports: "queue.Queue[int]" = queue.Queue()
+        self.queued: set[int] = set()
+        self.next_poll: dict[int, float] = {}
+
+    def pending_batches(self):
+        unfinished = Q(data__status__isnull=True) | ~Q(
+            data__status__in=OpenAIBatch.TERMINAL_STATUSES
+        )
+        unimported = Q(data__status="completed", imported_at__isnull=True)
+        return (
+            OpenAIBatch.objects.filter(unfinished | unimported, data__id__isnull=False)
+            .select_related("question")
+        )
+
+    def interval(self, batch: OpenAIBatch, now: float | None = None) -> float:
+        """Return the seconds to wait before polling ``batch`` again."""
+        now = time.time() if now is None else now
+        counts = batch.data.get("request_counts") or {}
+        total = counts.get("total") or 0
+        done = (counts.get("completed") or 0) + (counts.get("failed") or 0)
+
+        if batch.status == "finalizing" or (total and done >= total):
+            return self.min_interval
+
+        started = batch.data.get("in_progress_at") or batch.data.get("created_at")
+        elapsed = max(now - started, 0) if started else 0
+        if total and done:
+            # Half of the remaining time at the observed request rate.
+            wait = elapsed * (total - done) / done / 2
+        else:
+            wait = elapsed / 4
+        return min(max(wait, self.min_interval), self.max_interval)
+
+    def queue_import(self, batch: OpenAIBatch, now: float) -> None:
+        """Queue the import of a completed batch unless it is queued already."""
+        # Looked at again after the longest interval in case the import fails.
+        self.next_poll[batch.pk] = now + self.max_interval
+        if self.defer_imports:
+            running = batch.jobs.filter(kind="import_batch", status__in=["queued", "running"])
+            if not running.exists():
+                batch.apply_status(defer_import=True)
+        elif batch.pk not in self.queued:
+            self.queued.add(batch.pk)
+            self.imports.put(batch.pk)
+
+    def poll_once(self) -> int:
+        """Retrieve every due batch once and return how many were polled."""
+        now = time.monotonic()
+        due = [b for b in self.pending_batches() if self.next_poll.get(b.pk, 0) <= now]
+        if not due:
+            return 0
+
+        unfinished = []
+        for batch in due:
+            if batch.status == "completed":
+                self.queue_import(batch, now)
+            else:
+                unfinished.append(batch)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {
+                pool.submit(self.client.batches.retrieve, batch.batch_id): batch
+                for batch in unfinished
+            }
+            for future in as_completed(futures):
+                batch = futures[future]
+                self.log(f"Updating batch {batch.batch_id}...")
+                try:
+                    batch.data = future.result().model_dump()
+                except Exception as exc:
+                    self.log(f"Could not retrieve batch {batch.batch_id}: {exc}")
+                    self.next_poll[batch.pk] = now + self.min_interval
+                    continue
+
+                batch.save()
+                if batch.status == "completed":
+                    self.queue_import(batch, now)
+                    continue
+
+                batch.apply_status(defer_import=self.defer_imports)
+                if batch.status in OpenAIBatch.TERMINAL_STATUSES:
+                    self.next_poll.pop(batch.pk, None)
+                else:
+                    self.next_poll[batch.pk] = now + self.interval(batch)
+
+        return len(due)
+
+    def import_batch(self, pk: int) -> None:
+        """Import a queued batch, logging instead of raising on failure."""
+        try:
+            batch = OpenAIBatch.objects.select_related("question").get(pk=pk)
+            self.log(f"Importing batch {batch.batch_id}...")
+            batch.apply_status(client=self.client)
+        except Exception as exc:
+            self.log(f"Import of batch {pk} failed: {exc}")
+        finally:
+            self.queued.discard(pk)
+
+    def import_pending(self) -> None:
+        """Import every queued batch in the calling thread."""
+        while True:
+            try:
+                pk = self.imports.get_nowait()
+            except queue.Empty:
+                return
+            self.import_batch(pk)
+
+    def _import_forever(self, stop: threading.Event) -> None:
+        while not stop.is_set():
+            try:
+                pk = self.imports.get(timeout=1)
+            except queue.Empty:
+                continue
+            try:
+                self.import_batch(pk)
+            finally:
+                close_old_connections()
+
+    def run(self, stop: threading.Event | None = None) -> None:
+        """Poll until ``stop`` is set, importing on a background thread."""
+        stop = stop or threading.Event()
+        importer = threading.Thread(
+            target=self._import_forever, args=(stop,), name="batch-importer", daemon=True
+        )
+        importer.start()
+        try:
+            while not stop.is_set():
+                self.poll_once()
+                close_old_connections()
+                upcoming = min(self.next_poll.values(), default=time.monotonic() + self.min_interval)
+                stop.wait(min(max(upcoming - time.monotonic(), 1), self.min_interval))
+        finally:
+            stop.set()
+            importer.join()
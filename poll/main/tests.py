@@ -1,4 +1,5 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.utils import timezone
 from django.contrib.auth.models import User
 import json
 
@@ -8,11 +9,37 @@ from django.urls import reverse
 from django.contrib.admin.sites import AdminSite
 from django.test import RequestFactory
 import csv
+import tempfile
+import threading
+import time
 import uuid
-from django.core.management import call_command
-
-from .models import Question, OpenAIBatch, Answer
+from io import BytesIO, StringIO
+from pathlib import Path
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+import numpy as np
+
+from .models import Question, OpenAIBatch, Answer, GraphEdge, Codebook, Job, openai_client
 from .admin import AnswerAdmin
+from .forms import QuestionForm
+from . import analytics, db, exports, importer, jobs
+from .poller import BatchPoller
+from .jobs import Worker
+from .importer import RunImporter
+from .fakeopenai import FakeOpenAI, base_url, make_server
+from .management.commands.benchmark_pipeline import Command as Benchmark
+
+
+def mock_output_file(client, text):
+    """Make ``client`` stream ``text`` as the content of any output file."""
+    response = Mock()
+    response.iter_lines.return_value = text.splitlines()
+    streamed = client.files.with_streaming_response.content.return_value
+    streamed.__enter__ = Mock(return_value=response)
+    streamed.__exit__ = Mock(return_value=False)
 
 
 class QuestionModelTests(TestCase):
@@ -46,6 +73,56 @@ class QuestionModelTests(TestCase):
         self.assertIn("confidence", schema_props)
         self.assertEqual(schema_props["confidence"]["type"], "number")
 
+    def test_openai_batch_files_split_on_bytes(self):
+        q = Question.objects.create(
+            text="q", context={"gender": ["man", "woman"]}, choices=["A", "B", "C"]
+        )
+        lines = list(q.iter_openai_requests())
+        self.assertEqual(len(lines), 6)
+        self.assertEqual(
+            [json.loads(line)["custom_id"] for line in lines[:4]],
+            [f"q{q.pk}:0:0:1", f"q{q.pk}:0:0:2", f"q{q.pk}:0:1:2", f"q{q.pk}:1:0:1"],
+        )
+
+        max_bytes = 2 * (max(len(line) for line in lines) + 1)
+        files = list(q.openai_batch_files(max_lines=10, max_bytes=max_bytes))
+        contents = [fh.read().splitlines() for fh in files]
+        for fh in files:
+            fh.close()
+
+        self.assertEqual([len(c) for c in contents], [2, 2, 2])
+        self.assertEqual([line for c in contents for line in c], lines)
+
+    def test_requests_share_prompt_prefix(self):
+        q = Question.objects.create(
+            text="Where to?", context={"gender": ["man", "woman"]}, choices=["A", "B", "C"]
+        )
+        lines = [json.loads(line) for line in q.iter_openai_requests()]
+        developer = {line["body"]["messages"][0]["content"] for line in lines}
+        self.assertEqual(len(developer), 1)
+        self.assertTrue(developer.pop().endswith("\nWhere to?"))
+
+        user = [line["body"]["messages"][1]["content"] for line in lines]
+        self.assertEqual(user[0], "Demographics:\ngender: man\n\nA: A\nB: B")
+        self.assertEqual(user[5], "Demographics:\ngender: woman\n\nA: B\nB: C")
+        self.assertEqual(
+            [line["body"]["prompt_cache_key"] for line in lines],
+            [f"q{q.pk}:0"] * 3 + [f"q{q.pk}:1"] * 3,
+        )
+
+    def test_openai_batch_files_keep_contexts_together(self):
+        q = Question.objects.create(
+            text="q", context={"gender": ["man", "woman", "other"]}, choices=["A", "B", "C"]
+        )
+        files = list(q.openai_batch_files(max_lines=5))
+        keys = [
+            {json.loads(line)["body"]["prompt_cache_key"] for line in fh.read().splitlines()}
+            for fh in files
+        ]
+        for fh in files:
+            fh.close()
+        self.assertEqual(keys, [{f"q{q.pk}:0"}, {f"q{q.pk}:1"}, {f"q{q.pk}:2"}])
+
     def test_submit_batches_assigns_single_run_id(self):
         q = Question.objects.create(text="q", choices=["A", "B"])
         mock_client = Mock()
@@ -53,7 +130,8 @@ class QuestionModelTests(TestCase):
         mock_client.batches.create.return_value = Mock(model_dump=Mock(return_value={"id": "batch_1"}))
 
         with patch("poll.main.models.openai.OpenAI", return_value=mock_client):
-            with patch.object(Question, "get_openai_batches", return_value=["d1", "d2"]):
+            files = [BytesIO(b"d1\n"), BytesIO(b"d2\n")]
+            with patch.object(Question, "openai_batch_files", return_value=files):
                 q.submit_batches()
 
         batches = list(OpenAIBatch.objects.filter(question=q))
@@ -61,6 +139,74 @@ class QuestionModelTests(TestCase):
         run_ids = {b.run_id for b in batches}
         self.assertEqual(len(run_ids), 1)
 
+    def test_submit_batches_concurrently_with_one_client(self):
+        q = Question.objects.create(text="q", choices=["A", "B"])
+        mock_client = Mock()
+        mock_client.files.create.side_effect = lambda file, purpose: Mock(id=file[0])
+        mock_client.batches.create.side_effect = lambda input_file_id, **kw: Mock(
+            model_dump=Mock(return_value={"id": f"batch_{input_file_id}"})
+        )
+        files = [BytesIO(f"d{i}\n".encode()) for i in range(5)]
+
+        with patch("poll.main.models.openai.OpenAI") as client_cls:
+            with patch.object(Question, "openai_batch_files", return_value=files):
+                q.submit_batches(client=mock_client, max_workers=2)
+
+        client_cls.assert_not_called()
+        self.assertEqual(mock_client.files.create.call_count, 5)
+        self.assertEqual(OpenAIBatch.objects.filter(question=q).count(), 5)
+        self.assertTrue(all(fh.closed for fh in files))
+        q.refresh_from_db()
+        self.assertEqual(q.status, "queued")
+
+    def test_submit_batches_stores_each_batch_once_created(self):
+        q = Question.objects.create(text="q", choices=["A", "B"])
+        created = threading.Event()
+        mock_client = Mock()
+        mock_client.files.create.side_effect = lambda file, purpose: Mock(id=file[0])
+
+        def create_batch(input_file_id, **kw):
+            created.set()
+            return Mock(model_dump=Mock(return_value={"id": f"batch_{input_file_id}"}))
+
+        mock_client.batches.create.side_effect = create_batch
+        stored = []
+
+        def files(selection=None):
+            yield BytesIO(b"d0\n")
+            created.wait(5)
+            time.sleep(0.05)
+            yield BytesIO(b"d1\n")
+            # The first batch was stored while later files were generated.
+            stored.append(OpenAIBatch.objects.filter(question=q).count())
+
+        with patch.object(Question, "openai_batch_files", side_effect=files):
+            q.submit_batches(client=mock_client, max_workers=4)
+
+        self.assertEqual(stored, [1])
+        self.assertEqual(OpenAIBatch.objects.filter(question=q).count(), 2)
+
+    def test_submit_batches_keeps_created_batches_on_error(self):
+        q = Question.objects.create(text="q", choices=["A", "B"])
+        mock_client = Mock()
+
+        def create_file(file, purpose):
+            if file[0].endswith("_01.jsonl"):
+                raise RuntimeError("upload failed")
+            return Mock(id=file[0])
+
+        mock_client.files.create.side_effect = create_file
+        mock_client.batches.create.return_value = Mock(model_dump=Mock(return_value={"id": "b"}))
+        files = [BytesIO(f"d{i}\n".encode()) for i in range(3)]
+
+        with patch.object(Question, "openai_batch_files", return_value=files):
+            with self.assertRaises(RuntimeError):
+                q.submit_batches(client=mock_client)
+
+        self.assertEqual(OpenAIBatch.objects.filter(question=q).count(), 2)
+        q.refresh_from_db()
+        self.assertEqual(q.status, "draft")
+
     def test_latest_answers_returns_most_recent_batch(self):
         q = Question.objects.create(text="q", choices=["A", "B"])
         older = OpenAIBatch.objects.create(question=q, run_id=uuid.uuid4(), data={"id": "b1"})
@@ -74,6 +220,454 @@ class QuestionModelTests(TestCase):
 
 
 
+class BatchPlanTests(TestCase):
+    def setUp(self):
+        self.question = Question.objects.create(
+            text='Where would a "typical" person move?',
+            context={"gender": ["man", "woman"], "city": ["İzmir", "Köln", "Rome"], "age": 30},
+            choices=[f"choice {i}" for i in range(12)] + ["Zürich"],
+        )
+
+    def test_counts_match_enumeration(self):
+        plan = self.question.plan()
+        lines = list(self.question.iter_openai_requests())
+        self.assertEqual(plan.combinations, len(self.question.context_combinations()))
+        self.assertEqual(plan.pairs, len(self.question.choice_pairs()))
+        self.assertEqual(plan.lines, len(lines))
+        self.assertEqual(plan.request_bytes(), sum(len(line) + 1 for line in lines))
+
+    def test_prompt_characters_match_enumeration(self):
+        total = 0
+        for line in self.question.iter_openai_requests():
+            messages = json.loads(line)["body"]["messages"]
+            total += sum(len(m["content"]) for m in messages)
+        self.assertEqual(self.question.plan().prompt_characters(), total)
+
+    def test_combination_access(self):
+        plan = self.question.plan()
+        combos = self.question.context_combinations()
+        self.assertEqual(list(plan.iter_combinations()), combos)
+        self.assertEqual(plan.combination_at(4), combos[4])
+        with self.assertRaises(IndexError):
+            plan.combination_at(len(combos))
+
+    def test_batch_files(self):
+        plan = self.question.plan()
+        expected = len(list(self.question.openai_batch_files(max_lines=100)))
+        self.assertEqual(plan.batch_files(max_lines=100), expected)
+        self.assertEqual(plan.batch_files(max_bytes=plan.request_bytes() // 2), 2)
+
+    def test_large_question_is_not_enumerated(self):
+        question = Question(
+            text="q",
+            context={f"k{i}": list(range(10)) for i in range(8)},
+            choices=[str(i) for i in range(100)],
+        )
+        plan = question.plan()
+        self.assertEqual(plan.lines, 10**8 * 4950)
+        self.assertGreater(plan.request_bytes(), plan.lines * 500)
+
+
+class IncrementalRunTests(TestCase):
+    def setUp(self):
+        self.question = Question.objects.create(
+            text="q", context={"gender": ["man", "woman"]}, choices=["X", "Y", "Z"]
+        )
+        self.batch = OpenAIBatch.objects.create(
+            question=self.question,
+            data={"id": "b1", "status": "completed"},
+            snapshot=self.question.snapshot(),
+            imported_at=timezone.now(),
+        )
+        for gender in ("man", "woman"):
+            Answer.objects.create(
+                question=self.question,
+                run_id=self.batch.run_id,
+                context={"gender": gender},
+                choices={"A": "Y", "B": "Z"},
+                choice="B",
+            )
+
+    def submit(self):
+        uploaded = []
+
+        def create_file(file, purpose):
+            uploaded.append(file[1].read().decode().splitlines())
+            return Mock(id="file")
+
+        client = Mock()
+        client.files.create.side_effect = create_file
+        client.batches.create.return_value.model_dump.return_value = {"id": "b2"}
+        self.question.submit_batches(client=client, incremental=True)
+        return [json.loads(line) for lines in uploaded for line in lines]
+
+    def test_last_completed_run(self):
+        self.assertEqual(self.question.last_completed_run(), self.batch.run_id)
+        OpenAIBatch.objects.create(question=self.question, data={"id": "b2", "status": "in_progress"})
+        self.assertEqual(self.question.last_completed_run(), self.batch.run_id)
+        self.batch.imported_at = None
+        self.batch.save()
+        self.assertIsNone(self.question.last_completed_run())
+
+    def test_last_completed_run_must_cover_every_request(self):
+        self.batch.sampled = True
+        self.batch.save()
+        self.assertIsNone(self.question.last_completed_run())
+
+        self.batch.sampled = False
+        self.batch.snapshot = {}
+        self.batch.save()
+        self.assertIsNone(self.question.last_completed_run())
+
+    def test_incremental_submit_without_snapshot_submits_everything(self):
+        self.batch.snapshot = {}
+        self.batch.save()
+        self.question.choices = ["X", "Y", "Z", "W"]
+        self.question.save()
+
+        lines = self.submit()
+
+        self.assertEqual(len(lines), 2 * 6)
+        self.assertNotEqual(
+            OpenAIBatch.objects.get(data__id="b2").run_id, self.batch.run_id
+        )
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.status, "queued")
+
+    def test_diff_new_choice(self):
+        self.question.choices = ["X", "Y", "Z", "W"]
+        selection = self.question.plan().diff(self.question.codebook(self.batch.run_id))
+        self.assertEqual(selection, {0: [2, 4, 5], 1: [2, 4, 5]})
+
+    def test_diff_new_context_value(self):
+        self.question.context = {"gender": ["man", "nonbinary", "woman"]}
+        selection = self.question.plan().diff(self.question.codebook(self.batch.run_id))
+        self.assertEqual(selection, {1: None})
+
+    def test_diff_new_context_key(self):
+        self.question.context = {"gender": ["man", "woman"], "age": [30]}
+        selection = self.question.plan().diff(self.question.codebook(self.batch.run_id))
+        self.assertEqual(selection, {0: None, 1: None})
+
+    def test_incremental_submit_extends_run(self):
+        self.question.choices = ["X", "Y", "Z", "W"]
+        self.question.context = {"gender": ["man", "nonbinary", "woman"]}
+        self.question.save()
+
+        lines = self.submit()
+        # 2 old contexts × 3 pairs with W, plus 6 pairs for the new context.
+        self.assertEqual(len(lines), 12)
+        self.assertEqual(
+            OpenAIBatch.objects.filter(run_id=self.batch.run_id).count(), 2
+        )
+
+        codebook = self.question.codebook(self.batch.run_id)
+        self.assertEqual(codebook.choices, ["X", "Y", "Z", "W"])
+        for answer in Answer.objects.filter(run_id=self.batch.run_id):
+            self.assertEqual(codebook.combination(answer.context_idx), answer.context)
+            self.assertEqual(codebook.choices[answer.winner_idx], "Z")
+
+        counts = self.client.get(
+            f"/api/charts/questions/{self.question.uuid}/preference-counts"
+        ).json()["counts"]
+        self.assertEqual(counts, {"Z": 2})
+
+    def test_incremental_submit_with_new_context_key_starts_new_run(self):
+        self.question.context = {"gender": ["man", "woman"], "age": [30]}
+        self.question.save()
+
+        lines = self.submit()
+
+        self.assertEqual(len(lines), 2 * 3)
+        new_run = OpenAIBatch.objects.get(data__id="b2").run_id
+        self.assertNotEqual(new_run, self.batch.run_id)
+        self.assertEqual(Answer.objects.filter(run_id=self.batch.run_id).count(), 2)
+        self.assertFalse(Answer.objects.filter(run_id=new_run).exists())
+
+    def test_incremental_submit_drops_removed_values_from_edges(self):
+        self.question.context = {"gender": ["man"]}
+        self.question.choices = ["X", "Y", "Z", "W"]
+        self.question.save()
+        self.assertEqual(
+            analytics.run_frame(self.question, self.batch.run_id).weight.sum(), 2
+        )
+
+        lines = self.submit()
+
+        self.assertEqual(len(lines), 3)
+        frame = analytics.run_frame(self.question, self.batch.run_id)
+        self.assertEqual(frame.weight.sum(), 1)
+        self.assertEqual(frame.contexts, [{"gender": "man"}])
+
+    def test_recode_drops_removed_values(self):
+        old = self.question.codebook(self.batch.run_id)
+        new = Codebook({"context": {"gender": ["woman"]}, "choices": ["Z", "Y"]})
+        new.recode(Answer.objects.filter(run_id=self.batch.run_id), old)
+        codes = dict(
+            Answer.objects.values_list("context__gender", "context_idx")
+        )
+        self.assertEqual(codes, {"man": None, "woman": 0})
+        self.assertEqual(set(Answer.objects.values_list("winner_idx", flat=True)), {0})
+
+    def test_recode_can_swap_request_keys(self):
+        Answer.objects.create(
+            question=self.question,
+            run_id=self.batch.run_id,
+            context={"gender": "man"},
+            choices={"A": "Z", "B": "Y"},
+            choice="A",
+        )
+        old = self.question.codebook(self.batch.run_id)
+        new = Codebook({"context": {"gender": ["woman", "man"]}, "choices": ["X", "Z", "Y"]})
+        new.recode(Answer.objects.filter(run_id=self.batch.run_id), old)
+
+        for answer in Answer.objects.all():
+            expected = Answer(question=answer.question, **{
+                f: getattr(answer, f) for f in ("context", "choices", "choice")
+            })
+            new.encode(expected)
+            self.assertEqual(
+                (answer.context_idx, answer.choice_a_idx, answer.choice_b_idx),
+                (expected.context_idx, expected.choice_a_idx, expected.choice_b_idx),
+            )
+
+    def test_import_of_old_batch_uses_run_codebook(self):
+        self.question.choices = ["W", "X", "Y", "Z"]
+        self.question.save()
+        self.submit()
+
+        self.batch.data["output_file_id"] = "file_1"
+        self.batch.save()
+        line = json.dumps({
+            "custom_id": f"q{self.question.pk}:1:0:1",
+            "response": {"body": {"choices": [
+                {"message": {"content": "{\"answer\":\"A\",\"confidence\":0.5}"}}
+            ]}},
+        })
+        client = Mock()
+        mock_output_file(client, line)
+        self.batch.retrieve_results(client=client, force=True)
+
+        answer = Answer.objects.latest("pk")
+        self.assertEqual(answer.choices, {"A": "X", "B": "Y"})
+        self.assertEqual((answer.choice_a_idx, answer.choice_b_idx), (1, 2))
+
+    def test_incremental_submit_without_changes(self):
+        self.assertEqual(self.submit(), [])
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.status, "completed")
+
+
+class SamplingTests(TestCase):
+    def setUp(self):
+        self.question = Question.objects.create(
+            text="q",
+            context={"gender": ["man", "woman"], "age": [20, 30, 40, 50]},
+            choices=["A", "B", "C", "D", "E", "F"],
+        )
+
+    def test_request_budget(self):
+        self.assertIsNone(self.question.request_budget())
+        self.question.sample_fraction = 0.25
+        self.assertEqual(self.question.request_budget(), 30)
+        self.question.sample_size = 10
+        self.assertEqual(self.question.request_budget(), 10)
+        self.question.sample_size = 1000
+        self.question.sample_fraction = None
+        self.assertIsNone(self.question.request_budget())
+
+    def test_empty_samples_are_rejected(self):
+        for field, value in (("sample_size", 0), ("sample_fraction", 0)):
+            form = QuestionForm(data={"text": "q", "choices": "A\nB", field: value})
+            self.assertIn(field, form.errors)
+
+        # Stored before validation existed: still submit something.
+        self.question.sample_size = 0
+        self.assertEqual(self.question.request_budget(), 1)
+
+    def test_sample_is_stratified(self):
+        self.question.sample_size = 40
+        selection = self.question.sample_requests(seed=1)
+        plan = self.question.plan()
+
+        self.assertEqual(sum(len(p) for p in selection.values()), 40)
+        gender, age = {}, {}
+        for ctx_idx, pairs in selection.items():
+            self.assertEqual(len(pairs), len(set(pairs)))
+            ctx = plan.combination_at(ctx_idx)
+            gender[ctx["gender"]] = gender.get(ctx["gender"], 0) + len(pairs)
+            age[ctx["age"]] = age.get(ctx["age"], 0) + len(pairs)
+        self.assertEqual(gender, {"man": 20, "woman": 20})
+        self.assertEqual(set(age.values()), {10})
+
+    def test_sample_fills_contexts_when_budget_is_large(self):
+        plan = self.question.plan()
+        selection = plan.sample(plan.lines - 1, rng=np.random.default_rng(0))
+        self.assertEqual(sum(len(p) for p in selection.values()), plan.lines - 1)
+
+    def test_pair_weights_favour_uncertain_pairs(self):
+        plan = self.question.plan()
+        wins = np.zeros((6, 6), dtype=np.int64)
+        wins[0, 1] = 50
+        wins[0, 2], wins[2, 0] = 25, 25
+        weights = plan.pair_weights(wins)
+        self.assertEqual(plan.pair_at(0), (0, 1))
+        self.assertEqual(plan.pair_at(1), (0, 2))
+        self.assertEqual(plan.pair_at(14), (4, 5))
+        self.assertLess(weights[0], weights[1])
+        self.assertLess(weights[1], weights[2])
+
+        selection = plan.sample(24, weights=weights, rng=np.random.default_rng(0))
+        chosen = [k for pairs in selection.values() for k in pairs]
+        self.assertNotIn(0, chosen)
+
+    def test_sampled_requests(self):
+        self.question.sample_size = 7
+        selection = self.question.sample_requests(seed=2)
+        lines = [json.loads(l) for l in self.question.iter_openai_requests(selection)]
+        self.assertEqual(len(lines), 7)
+        plan = self.question.plan()
+        expected = {
+            f"q{self.question.pk}:{ctx}:{i}:{j}"
+            for ctx, pairs in selection.items()
+            for i, j in map(plan.pair_at, pairs)
+        }
+        self.assertEqual({line["custom_id"] for line in lines}, expected)
+
+    @patch("poll.main.models.openai.OpenAI")
+    def test_submit_batches_in_sampling_mode(self, mock_openai):
+        client = mock_openai.return_value
+        uploaded = []
+
+        def create_file(file, purpose):
+            uploaded.append(file[1].read())
+            return Mock(id="file")
+
+        client.files.create.side_effect = create_file
+        client.batches.create.return_value.model_dump.return_value = {"id": "b1"}
+        self.question.sample_fraction = 0.1
+        self.question.submit_batches()
+
+        self.assertEqual(len(uploaded[0].splitlines()), 12)
+        self.assertTrue(OpenAIBatch.objects.get(question=self.question).sampled)
+
+
+class RunImporterTests(TestCase):
+    def test_batches_without_output_file_are_marked_imported(self):
+        q = Question.objects.create(text="q", choices=["A", "B"])
+        run_id = uuid.uuid4()
+        failed = OpenAIBatch.objects.create(
+            question=q,
+            run_id=run_id,
+            snapshot=q.snapshot(),
+            data={"id": "batch_0", "status": "completed", "output_file_id": None},
+        )
+        client = Mock()
+
+        stats = RunImporter(q, run_id, client=client).run()
+
+        self.assertEqual(stats.lines, 0)
+        client.files.with_streaming_response.content.assert_not_called()
+        failed.refresh_from_db()
+        self.assertIsNotNone(failed.imported_at)
+
+    def test_import_is_idempotent(self):
+        q = Question.objects.create(text="q", choices=["A", "B", "C"])
+        run_id = uuid.uuid4()
+        batches = [
+            OpenAIBatch.objects.create(
+                question=q,
+                run_id=run_id,
+                snapshot=q.snapshot(),
+                data={"id": f"batch_{i}", "status": "completed", "output_file_id": f"file_{i}"},
+            )
+            for i in range(2)
+        ]
+        lines = [
+            json.dumps({
+                "custom_id": f"q{q.pk}:0:{a}:{b}",
+                "response": {"body": {"choices": [
+                    {"message": {"content": "{\"answer\":\"B\",\"confidence\":0.5}"}}
+                ]}},
+            })
+            for a, b in [(0, 1), (0, 2), (1, 2)]
+        ]
+        mock_client = Mock()
+        # Both batches return the same answers.
+        mock_output_file(mock_client, "\n".join(lines))
+
+        stats = RunImporter(q, run_id, client=mock_client).run()
+
+        self.assertEqual(stats.answers, 3)
+        self.assertEqual(stats.duplicates, 3)
+        answers = Answer.objects.filter(question=q, run_id=run_id)
+        self.assertEqual(answers.count(), 3)
+        self.assertEqual(set(answers.values_list("winner_idx", flat=True)), {1, 2})
+        for batch in batches:
+            batch.refresh_from_db()
+            self.assertIsNotNone(batch.imported_at)
+
+        # Nothing is left to import, and reopening a batch adds nothing new.
+        self.assertEqual(RunImporter(q, run_id, client=mock_client).run().answers, 0)
+        OpenAIBatch.objects.filter(pk=batches[0].pk).update(imported_at=None, imported_lines=0)
+        stats = RunImporter(q, run_id, client=mock_client).run()
+        self.assertEqual((stats.answers, stats.duplicates), (0, 3))
+        self.assertEqual(answers.count(), 3)
+        q.refresh_from_db()
+        self.assertEqual(q.status, "completed")
+
+
+class CodebookTests(TestCase):
+    def setUp(self):
+        self.question = Question.objects.create(
+            text="q",
+            context={"gender": ["man", "woman"], "age": [30, 40, 50]},
+            choices=["X", "Y", "Z"],
+        )
+        self.codebook = self.question.codebook()
+
+    def test_combination_round_trip(self):
+        combinations = self.question.context_combinations()
+        self.assertEqual(self.codebook.size, len(combinations))
+        for index, context in enumerate(combinations):
+            self.assertEqual(self.codebook.combination(index), context)
+            self.assertEqual(self.codebook.context_index(context), index)
+        self.assertEqual(self.codebook.context_index({"gender": "man", "age": "40"}), 1)
+
+    def test_answer_save_fills_codes(self):
+        answer = Answer.objects.create(
+            question=self.question,
+            context={"gender": "woman", "age": 30},
+            choices={"A": "Y", "B": "Z"},
+            choice="B",
+        )
+        self.assertEqual(
+            (answer.context_idx, answer.choice_a_idx, answer.choice_b_idx, answer.winner_idx),
+            (3, 1, 2, 2),
+        )
+
+    def test_filter_by_context_codes(self):
+        for context in self.question.context_combinations():
+            Answer.objects.create(
+                question=self.question,
+                context=context,
+                choices={"A": "X", "B": "Y"},
+                choice="A",
+            )
+        answers = Answer.objects.filter(question=self.question)
+
+        for limit in (Codebook.MAX_IN_LIST, 0):
+            with patch.object(Codebook, "MAX_IN_LIST", limit):
+                women = self.codebook.filter(answers, {"gender": "woman"})
+                self.assertEqual(
+                    sorted(a.context["age"] for a in women), [30, 40, 50]
+                )
+                one = self.codebook.filter(answers, {"gender": "man", "age": "50"})
+                self.assertEqual([a.context for a in one], [{"gender": "man", "age": 50}])
+
+        self.assertFalse(self.codebook.filter(answers, {"gender": "other"}).exists())
+
+
 class OpenAIBatchModelTests(TestCase):
     def test_retrieve_results_creates_answers(self):
         q = Question.objects.create(
@@ -101,12 +695,12 @@ class OpenAIBatchModelTests(TestCase):
         })
 
         mock_client = Mock()
-        mock_client.files.content.return_value = Mock(text=result_line + "\n")
+        mock_output_file(mock_client, result_line + "\n")
 
         with patch("poll.main.models.openai.OpenAI", return_value=mock_client):
-            results = batch.retrieve_results()
+            stats = batch.retrieve_results()
 
-        self.assertEqual(len(results), 1)
+        self.assertEqual(stats.answers, 1)
         self.assertEqual(Answer.objects.count(), 1)
         answer = Answer.objects.first()
         self.assertEqual(answer.question, q)
@@ -116,6 +710,269 @@ class OpenAIBatchModelTests(TestCase):
         self.assertEqual(answer.choice, "A")
         self.assertAlmostEqual(answer.confidence, 0.75)
 
+    def test_retrieve_results_marks_batch_without_output_imported(self):
+        q = Question.objects.create(text="q", choices=["A", "B"])
+        batch = OpenAIBatch.objects.create(
+            question=q,
+            data={"id": "batch_1", "status": "completed", "output_file_id": None,
+                  "error_file_id": "file_err"},
+            snapshot=q.snapshot(),
+        )
+        stats = batch.retrieve_results(client=Mock())
+
+        self.assertEqual(stats.lines, 0)
+        batch.refresh_from_db()
+        self.assertIsNotNone(batch.imported_at)
+        self.assertEqual(q.last_completed_run(), batch.run_id)
+
+    def test_retrieve_results_decodes_compact_ids_from_snapshot(self):
+        q = Question.objects.create(
+            text="q",
+            context={"gender": ["man", "woman"]},
+            choices=["Turkey", "Mexico", "Chile-Peru"],
+        )
+        batch = OpenAIBatch.objects.create(
+            question=q,
+            data={"id": "batch_1", "status": "completed", "output_file_id": "file_1"},
+            snapshot=q.snapshot(),
+        )
+        # Edits after submission must not change how ids are decoded.
+        q.choices = ["Japan", "Turkey"]
+        q.context = {}
+        q.save()
+
+        result_line = json.dumps({
+            "custom_id": f"q{q.pk}:1:0:2",
+            "response": {"body": {"choices": [
+                {"message": {"content": "{\"answer\":\"B\",\"confidence\":0.6}"}}
+            ]}},
+        })
+        mock_client = Mock()
+        mock_output_file(mock_client, result_line)
+
+        with patch("poll.main.models.openai.OpenAI", return_value=mock_client):
+            with CaptureQueriesContext(connection) as queries:
+                batch.retrieve_results()
+
+        # Decoding needs no question lookups.
+        self.assertFalse(
+            [q for q in queries.captured_queries if 'FROM "main_question"' in q["sql"]]
+        )
+        answer = Answer.objects.get()
+        self.assertEqual(answer.context, {"gender": "woman"})
+        self.assertEqual(answer.choices, {"A": "Turkey", "B": "Chile-Peru"})
+        self.assertEqual(answer.choice, "B")
+
+    def test_retrieve_results_reports_cached_tokens(self):
+        q = Question.objects.create(text="q", choices=["A", "B", "C"])
+        batch = OpenAIBatch.objects.create(
+            question=q,
+            data={"id": "batch_1", "status": "completed", "output_file_id": "file_1"},
+            snapshot=q.snapshot(),
+        )
+        lines = [
+            json.dumps({
+                "custom_id": f"q{q.pk}:0:{a}:{b}",
+                "response": {"body": {
+                    "choices": [{"message": {"content": "{\"answer\":\"A\",\"confidence\":0.5}"}}],
+                    "usage": {
+                        "prompt_tokens": 1200,
+                        "completion_tokens": 10,
+                        "prompt_tokens_details": {"cached_tokens": cached},
+                    },
+                }},
+            })
+            for a, b, cached in [(0, 1, 0), (0, 2, 1024), (1, 2, 1024)]
+        ]
+        mock_client = Mock()
+        mock_output_file(mock_client, "\n".join(lines))
+
+        stats = batch.retrieve_results(client=mock_client)
+
+        self.assertEqual(stats.prompt_tokens, 3600)
+        self.assertEqual(stats.cached_tokens, 2048)
+        self.assertEqual(stats.completion_tokens, 30)
+        self.assertAlmostEqual(stats.cache_hit_rate, 2048 / 3600)
+        self.assertIn("2048 of 3600 prompt tokens cached", str(stats))
+        batch.refresh_from_db()
+        self.assertEqual(
+            (batch.prompt_tokens, batch.cached_tokens, batch.completion_tokens),
+            (3600, 2048, 30),
+        )
+
+    def test_retrieve_results_resumes_after_last_committed_chunk(self):
+        q = Question.objects.create(text="q", choices=["A", "B", "C"], context={"n": [1, 2]})
+        batch = OpenAIBatch.objects.create(
+            question=q,
+            data={"id": "batch_1", "status": "completed", "output_file_id": "file_1"},
+            snapshot=q.snapshot(),
+        )
+        lines = [
+            json.dumps({
+                "custom_id": f"q{q.pk}:{ctx}:{a}:{b}",
+                "response": {"body": {
+                    "choices": [{"message": {"content": "{\"answer\":\"A\",\"confidence\":0.5}"}}],
+                    "usage": {"prompt_tokens": 10, "completion_tokens": 1},
+                }},
+            })
+            for ctx in (0, 1)
+            for a, b in [(0, 1), (0, 2), (1, 2)]
+        ]
+        client = Mock()
+        mock_output_file(client, "\n".join(lines))
+
+        add_answers = GraphEdge.add_answers
+        calls = []
+
+        def crash_on_second_chunk(answers):
+            calls.append(len(answers))
+            if len(calls) == 2:
+                raise RuntimeError("worker killed")
+            add_answers(answers)
+
+        with patch.object(GraphEdge, "add_answers", side_effect=crash_on_second_chunk):
+            with self.assertRaises(RuntimeError):
+                batch.retrieve_results(chunk_size=2, client=client)
+
+        batch.refresh_from_db()
+        self.assertEqual(batch.imported_lines, 2)
+        self.assertIsNone(batch.imported_at)
+        self.assertEqual(Answer.objects.count(), 2)
+
+        stats = batch.retrieve_results(chunk_size=2, client=client)
+
+        self.assertEqual((stats.lines, stats.answers), (4, 4))
+        batch.refresh_from_db()
+        self.assertEqual((batch.imported_lines, batch.prompt_tokens), (6, 60))
+        self.assertEqual(Answer.objects.count(), 6)
+        self.assertEqual(sum(e.count for e in GraphEdge.objects.all()), 6)
+
+        # Completed imports are skipped; forced ones write nothing twice.
+        self.assertEqual(batch.retrieve_results(client=client).lines, 0)
+        stats = batch.retrieve_results(client=client, force=True)
+        self.assertEqual((stats.answers, stats.duplicates), (0, 6))
+        self.assertEqual(Answer.objects.count(), 6)
+
+    def test_retrieve_results_bulk_inserts_in_chunks(self):
+        q = Question.objects.create(text="q", choices=["A", "B", "C"])
+        batch = OpenAIBatch.objects.create(
+            question=q,
+            data={"id": "batch_1", "status": "completed", "output_file_id": "file_1"},
+        )
+        lines = [
+            json.dumps({
+                "custom_id": f"q{q.pk}-{a}-{b}",
+                "response": {"body": {"choices": [
+                    {"message": {"content": "{\"answer\":\"B\",\"confidence\":0.5}"}}
+                ]}},
+            })
+            for a, b in [("A", "B"), ("A", "C"), ("B", "C")]
+        ]
+        lines.append("not json")
+
+        mock_client = Mock()
+        mock_output_file(mock_client, "\n".join(lines))
+
+        with patch("poll.main.models.openai.OpenAI", return_value=mock_client):
+            with patch.object(Answer.objects, "bulk_create", wraps=Answer.objects.bulk_create) as bulk:
+                stats = batch.retrieve_results(chunk_size=2)
+
+        self.assertEqual(bulk.call_count, 2)
+        self.assertEqual(Answer.objects.filter(run_id=batch.run_id).count(), 3)
+        self.assertEqual(stats.lines, 4)
+        self.assertEqual(stats.answers, 3)
+        self.assertEqual(stats.skipped, 1)
+        self.assertGreater(stats.rows_per_second, 0)
+
+        edges = GraphEdge.objects.filter(question=q, run_id=batch.run_id)
+        self.assertEqual(
+            {(e.winner, e.loser, e.count) for e in edges},
+            {("B", "A", 1), ("C", "A", 1), ("C", "B", 1)},
+        )
+
+    @override_settings(POLL_IMPORT_BULK_CHUNKS=2)
+    def test_retrieve_results_bulk_mode_commits_several_chunks_at_once(self):
+        q = Question.objects.create(text="q", choices=["A", "B", "C"], context={"n": [1, 2]})
+        batch = OpenAIBatch.objects.create(
+            question=q,
+            data={"id": "batch_1", "status": "completed", "output_file_id": "file_1"},
+            snapshot=q.snapshot(),
+        )
+        lines = [
+            json.dumps({
+                "custom_id": f"q{q.pk}:{ctx}:{a}:{b}",
+                "response": {"body": {"choices": [
+                    {"message": {"content": "{\"answer\":\"B\",\"confidence\":0.5}"}}
+                ]}},
+            })
+            for ctx in (0, 1)
+            for a, b in [(0, 1), (0, 2), (1, 2)]
+        ]
+        client = Mock()
+        mock_output_file(client, "\n".join(lines))
+
+        with patch.object(
+            importer.ResultImporter, "checkpoint", autospec=True,
+            side_effect=importer.ResultImporter.checkpoint,
+        ) as checkpoint:
+            stats = batch.retrieve_results(chunk_size=2, client=client, bulk=True)
+
+        self.assertEqual(checkpoint.call_count, 2)
+        self.assertEqual(stats.answers, 6)
+        batch.refresh_from_db()
+        self.assertEqual(batch.imported_lines, 6)
+        self.assertEqual(Answer.objects.filter(run_id=batch.run_id).count(), 6)
+
+    def test_copy_answers_streams_rows_to_copy(self):
+        q = Question.objects.create(text="q", choices=["A", "B"])
+        run_id = uuid.uuid4()
+        answer = Answer(
+            question=q,
+            run_id=run_id,
+            context={"gender": "woman"},
+            choices={"A": "A", "B": "B"},
+            choice="B",
+            confidence=0.75,
+            context_idx=1,
+            choice_a_idx=0,
+            choice_b_idx=1,
+            winner_idx=1,
+        )
+        with patch("poll.main.importer.connection") as conn:
+            conn.vendor = "sqlite"
+            self.assertFalse(importer.use_copy())
+            conn.ops.quote_name = lambda name: f'"{name}"'
+            importer.copy_answers([answer])
+
+        cursor = conn.cursor.return_value.__enter__.return_value
+        sql = cursor.copy.call_args.args[0]
+        self.assertTrue(sql.startswith('COPY "main_answer" ("question_id", "run_id"'))
+        self.assertTrue(sql.endswith("FROM STDIN"))
+        copy = cursor.copy.return_value.__enter__.return_value
+        copy.write_row.assert_called_once_with((
+            q.pk, run_id, '{"gender": "woman"}', '{"A": "A", "B": "B"}', "B", 0.75, 1, 0, 1, 1,
+        ))
+
+
+class DatabaseSetupTests(TestCase):
+    def test_apply_pragmas_sets_connection_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA cache_size")
+            previous = cursor.fetchone()[0]
+            db.apply_pragmas(connection, {"cache_size": -4096})
+            cursor.execute("PRAGMA cache_size")
+            self.assertEqual(cursor.fetchone()[0], -4096)
+            db.apply_pragmas(connection, {"cache_size": previous})
+
+    def test_apply_pragmas_rejects_invalid_values(self):
+        with self.assertRaises(ImproperlyConfigured):
+            db.apply_pragmas(connection, {"cache_size": "1; DROP TABLE main_answer"})
+
+    def test_configure_sqlite_ignores_other_databases(self):
+        other = Mock(vendor="postgresql")
+        db.configure_sqlite(sender=None, connection=other)
+        other.cursor.assert_not_called()
+
 
 class QuestionResultsViewTests(TestCase):
     def setUp(self):
@@ -165,11 +1022,69 @@ class QuestionResultsViewTests(TestCase):
         response = self.client.get(url)
 
         self.assertEqual(response.status_code, 200)
-        content = response.content.decode()
+        content = b"".join(response.streaming_content).decode()
         rows = list(csv.reader(content.splitlines()))
         self.assertEqual(rows[0], ["question", "context", "choices", "choice", "confidence", "run_id"])
         self.assertEqual(rows[1][0], q.text)
 
+    def make_export_answers(self, count):
+        q = Question.objects.create(text="q", choices=["A", "B"], created_by=self.user)
+        batch = OpenAIBatch.objects.create(question=q, data={"id": "b1"})
+        Answer.objects.bulk_create(
+            Answer(
+                question=q,
+                run_id=batch.run_id,
+                context={"city": "İzmir"},
+                choices={"A": "A", "B": "B"},
+                choice="AB"[i % 2],
+                confidence=i / count,
+            )
+            for i in range(count)
+        )
+        return q
+
+    def test_question_answers_ndjson_export_streams_in_chunks(self):
+        q = self.make_export_answers(5)
+        url = reverse("polls:question_answers_export", args=[q.uuid, "ndjson"])
+        with self.settings(POLL_EXPORT_CHUNK_SIZE=2):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+                parts = list(response.streaming_content)
+
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual(len(parts), 3)
+        rows = [json.loads(line) for line in b"".join(parts).decode().splitlines()]
+        self.assertEqual([r["choice"] for r in rows], ["A", "B", "A", "B", "A"])
+        self.assertEqual(rows[0]["context"], {"city": "İzmir"})
+        self.assertEqual(rows[0]["question"], "q")
+        text_lookups = [
+            query for query in queries.captured_queries
+            if 'SELECT "main_question"."text"' in query["sql"]
+        ]
+        self.assertEqual(len(text_lookups), 1)
+
+    def test_question_answers_parquet_export(self):
+        if not exports.pyarrow:
+            self.skipTest("pyarrow is not installed")
+        import pyarrow.parquet
+
+        q = self.make_export_answers(5)
+        url = reverse("polls:question_answers_export", args=[q.uuid, "parquet"])
+        with self.settings(POLL_EXPORT_CHUNK_SIZE=2):
+            response = self.client.get(url)
+            data = b"".join(response.streaming_content)
+
+        table = pyarrow.parquet.read_table(BytesIO(data))
+        self.assertEqual(table.column_names, exports.COLUMNS)
+        self.assertEqual(table.num_rows, 5)
+        self.assertEqual(pyarrow.parquet.ParquetFile(BytesIO(data)).num_row_groups, 3)
+        self.assertEqual(json.loads(table.column("context")[0].as_py()), {"city": "İzmir"})
+
+    def test_question_answers_unknown_export_format(self):
+        q = self.make_export_answers(1)
+        url = reverse("polls:question_answers_export", args=[q.uuid, "xlsx"])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
 
 class QuestionListViewTests(TestCase):
     def setUp(self):
@@ -240,18 +1155,34 @@ class QuestionCreateViewTests(TestCase):
         self.assertEqual(q.text, "Where to go?")
         self.assertEqual(q.status, "draft")
 
-    def test_post_review_submits_batches(self):
+    def test_post_review_queues_submission(self):
         q = Question.objects.create(text="T?", choices=["A", "B"], created_by=self.user)
         url = reverse("polls:question_review", args=[q.uuid])
         with patch.object(Question, "submit_batches") as sb:
-            response = self.client.post(url)
+            response = self.client.post(url, {"incremental": "1"})
+            sb.assert_not_called()
+            Worker().run(burst=True)
         self.assertEqual(response.status_code, 302)
         self.assertEqual(response["Location"], reverse("polls:question_list"))
-        sb.assert_called_once()
+        sb.assert_called_once_with(incremental=True)
         q.refresh_from_db()
         self.assertEqual(q.status, "queued")
+        self.assertEqual(q.jobs.get().status, "succeeded")
 
 
+    def test_post_review_rejects_conflicting_submission(self):
+        q = Question.objects.create(text="T?", choices=["A", "B"], created_by=self.user)
+        Job.enqueue("submit_batches", question=q, incremental=True)
+        url = reverse("polls:question_review", args=[q.uuid])
+
+        response = self.client.post(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "already queued")
+        q.refresh_from_db()
+        self.assertEqual(q.status, "draft")
+        self.assertEqual(q.jobs.count(), 1)
+
 class QuestionCloneViewTests(TestCase):
     def setUp(self):
         self.user1 = User.objects.create_user("u1", password="pass")
@@ -300,7 +1231,7 @@ class AnswerAdminTests(TestCase):
 
         ma = AnswerAdmin(Answer, self.admin_site)
         response = ma.download_csv(None, Answer.objects.filter(pk=a.pk))
-        content = response.content.decode()
+        content = b"".join(response.streaming_content).decode()
         rows = list(csv.reader(content.splitlines()))
         self.assertEqual(rows[0], ["question", "context", "choices", "choice", "confidence", "run_id"])
         self.assertEqual(rows[1][0], q.text)
@@ -318,6 +1249,20 @@ class AnswerAdminTests(TestCase):
         self.assertIn(high, list(qs))
         self.assertNotIn(low, list(qs))
 
+    def test_delete_selected_updates_edges(self):
+        q = Question.objects.create(text="q", choices=["X", "Y", "Z"])
+        batch = OpenAIBatch.objects.create(question=q, data={"id": "b1"})
+        for a, b, choice in [("X", "Y", "A"), ("X", "Z", "A"), ("Y", "Z", "B")]:
+            Answer.objects.create(
+                question=q, run_id=batch.run_id, choices={"A": a, "B": b}, choice=choice
+            )
+
+        ma = AnswerAdmin(Answer, self.admin_site)
+        ma.delete_queryset(None, Answer.objects.filter(choice="A"))
+
+        edges = GraphEdge.for_run(q, batch.run_id)
+        self.assertEqual([(e.winner, e.loser, e.count) for e in edges], [("Z", "Y", 1)])
+
 class ChartAPITests(TestCase):
     def setUp(self):
         self.question = Question.objects.create(
@@ -382,6 +1327,15 @@ class ChartAPITests(TestCase):
         # Winner order may depend on algorithm; just check keys
         self.assertEqual({r["choice"] for r in rankings}, {"X", "Y"})
 
+    def test_elo_ratings_endpoint_confidence_intervals(self):
+        url = f"/api/charts/questions/{self.question.uuid}/elo-ratings?gender=man&ci=true"
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        rankings = response.json()["rankings"]
+        self.assertEqual(rankings[0]["choice"], "X")
+        self.assertIn("ci_low", rankings[0])
+        self.assertIn("ci_high", rankings[0])
+
     def test_confidence_distribution_endpoint(self):
         url = f"/api/charts/questions/{self.question.uuid}/confidence-distribution"
         response = self.client.get(url)
@@ -390,6 +1344,67 @@ class ChartAPITests(TestCase):
         self.assertEqual(data["counts"][8], 1)
         self.assertEqual(data["counts"][6], 1)
 
+    def test_graph_edges_follow_answer_changes(self):
+        answer = Answer.objects.get(context__gender="man")
+        answer.choice = "B"
+        answer.save()
+        edges = GraphEdge.for_run(self.question, self.batch.run_id)
+        self.assertEqual(
+            {(e.context["gender"], e.winner) for e in edges}, {("man", "Y"), ("woman", "Y")}
+        )
+
+        answer.delete()
+        self.assertEqual(
+            analytics.run_frame(self.question, self.batch.run_id).weight.sum(), 1
+        )
+
+    def test_graph_edge_rebuild_replaces_counts(self):
+        GraphEdge.rebuild(self.question, self.batch.run_id)
+        GraphEdge.rebuild(self.question, self.batch.run_id)
+        edges = GraphEdge.for_run(self.question, self.batch.run_id)
+        self.assertEqual(sum(e.count for e in edges), 2)
+
+    def test_graph_edges_follow_saved_answers(self):
+        edges = GraphEdge.for_run(self.question, self.batch.run_id)
+        self.assertEqual(
+            {(e.context["gender"], e.winner, e.loser, e.count) for e in edges},
+            {("man", "X", "Y", 1), ("woman", "Y", "X", 1)},
+        )
+        self.assertAlmostEqual(sum(e.confidence_sum for e in edges), 1.4)
+
+    def test_graph_edges_are_incremented_in_the_database(self):
+        edges = GraphEdge.for_run(self.question, self.batch.run_id)
+        man = edges.get(context__gender="man")
+        answers = [
+            Answer(
+                question=self.question,
+                run_id=self.batch.run_id,
+                context={"gender": gender},
+                choices={"A": "X", "B": "Y"},
+                choice="A",
+                confidence=0.5,
+            )
+            for gender in ("man", "man", "woman", "other")
+        ]
+        for answer in answers:
+            self.question.codebook().encode(answer)
+        # Another import adds to the same edge after this one read it.
+        GraphEdge.objects.filter(pk=man.pk).update(count=10)
+
+        with self.assertNumQueries(1):
+            GraphEdge.add_answers(answers)
+
+        self.assertEqual(edges.get(pk=man.pk).count, 12)
+        self.assertEqual(edges.get(context__gender="woman", winner="X").count, 1)
+        # The unknown context value has no code and is not counted.
+        self.assertFalse(edges.filter(context__gender="other").exists())
+
+    def test_confidence_distribution_endpoint_filter(self):
+        url = f"/api/charts/questions/{self.question.uuid}/confidence-distribution?gender=woman"
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["counts"], [0, 0, 0, 0, 0, 0, 1, 0, 0, 0])
+
     def test_preference_flows_endpoint(self):
         url = f"/api/charts/questions/{self.question.uuid}/preference-flows"
         response = self.client.get(url)
@@ -401,6 +1416,276 @@ class ChartAPITests(TestCase):
         self.assertIn("Y", labels)
         self.assertEqual(len(links), 2)
 
+    def test_dashboard_endpoint_matches_individual_charts(self):
+        base = f"/api/charts/questions/{self.question.uuid}"
+        for query in ("", "?gender=woman"):
+            data = self.client.get(f"{base}/dashboard{query}").json()
+            for name in (
+                "preference-counts",
+                "preference-heatmap",
+                "preference-flows",
+                "elo-ratings",
+                "confidence-distribution",
+            ):
+                expected = self.client.get(f"{base}/{name}{query}").json()
+                self.assertEqual(data[name.replace("-", "_")], expected)
+
+    def test_dashboard_endpoint_skips_answers_without_codes(self):
+        Answer.objects.create(
+            question=self.question,
+            run_id=self.batch.run_id,
+            context={"gender": "unknown"},
+            choices={"A": "X", "B": "Y"},
+            choice="A",
+            confidence=0.5,
+        )
+        url = f"/api/charts/questions/{self.question.uuid}/dashboard"
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+        # Once the run's edges exist, only the confidences are read from answers.
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        answer_queries = [q for q in queries.captured_queries if "main_answer" in q["sql"]]
+        self.assertEqual(len(answer_queries), 1)
+        self.assertIn("confidence", answer_queries[0]["sql"])
+        self.assertEqual(sum(response.json()["confidence_distribution"]["counts"]), 2)
+
+    def test_dashboard_endpoint_without_batches(self):
+        question = Question.objects.create(text="q", choices=["X", "Y"], context={})
+        response = self.client.get(f"/api/charts/questions/{question.uuid}/dashboard")
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["preference_counts"], {"counts": {}})
+        self.assertEqual(data["confidence_distribution"]["counts"], [0] * 10)
+
+    def test_chart_revalidation_returns_not_modified(self):
+        url = f"/api/charts/questions/{self.question.uuid}/preference-counts"
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        self.assertIn("no-cache", response["Cache-Control"])
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        other = self.client.get(url + "?gender=man")
+        self.assertNotEqual(other["ETag"], etag)
+
+    def test_chart_cache_invalidated_when_run_changes(self):
+        url = f"/api/charts/questions/{self.question.uuid}/preference-counts"
+        response = self.client.get(url)
+        etag = response["ETag"]
+        self.assertEqual(response.json()["counts"], {"X": 1, "Y": 1})
+
+        answer = Answer(
+            question=self.question,
+            run_id=self.batch.run_id,
+            context={"gender": "man"},
+            choices={"A": "Y", "B": "X"},
+            choice="B",
+        )
+        self.question.codebook().encode(answer)
+        GraphEdge.add_answers([answer])
+        # Cached until the run's batches are touched, as an import does.
+        self.assertEqual(self.client.get(url).json()["counts"], {"X": 1, "Y": 1})
+
+        self.batch.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.json()["counts"], {"X": 2, "Y": 1})
+
+    def test_chart_cache_invalidated_when_answers_change(self):
+        url = f"/api/charts/questions/{self.question.uuid}/preference-counts"
+        self.assertEqual(self.client.get(url).json()["counts"], {"X": 1, "Y": 1})
+        Answer.objects.get(context__gender="woman").delete()
+        self.assertEqual(self.client.get(url).json()["counts"], {"X": 1})
+
+    def test_chart_cache_invalidated_when_question_changes(self):
+        url = f"/api/charts/questions/{self.question.uuid}/preference-heatmap"
+        response = self.client.get(url)
+        etag = response["ETag"]
+        self.assertEqual(response.json()["choices"], ["X", "Y"])
+
+        self.question.choices = ["X", "Y", "Z"]
+        self.question.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["choices"], ["X", "Y", "Z"])
+
+
+class PairsAPITests(TestCase):
+    def setUp(self):
+        self.question = Question.objects.create(
+            text="q", choices=["X", "Y", "Z"], context={"gender": ["man", "woman"]}
+        )
+        self.old = OpenAIBatch.objects.create(question=self.question, data={"id": "b0"})
+        self.batch = OpenAIBatch.objects.create(question=self.question, data={"id": "b1"})
+        for gender, a, b, choice in [
+            ("man", "X", "Z", "A"),
+            ("woman", "X", "Z", "B"),
+            ("man", "X", "Y", "A"),
+            ("woman", "Y", "Z", "B"),
+            ("man", "Z", "X", "B"),
+        ]:
+            Answer.objects.create(
+                question=self.question,
+                run_id=self.batch.run_id,
+                context={"gender": gender},
+                choices={"A": a, "B": b},
+                choice=choice,
+                confidence=0.5,
+            )
+        Answer.objects.create(
+            question=self.question,
+            run_id=self.old.run_id,
+            context={"gender": "man"},
+            choices={"A": "X", "B": "Y"},
+            choice="A",
+        )
+        self.url = f"/api/polls/{self.question.uuid}/pairs"
+        self.user = User.objects.create_user("user", password="pass")
+        self.client.force_login(self.user)
+
+    def test_pairs_require_login(self):
+        self.client.logout()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 401)
+
+    def test_pairs_keyset_pagination(self):
+        seen = []
+        cursor = None
+        while True:
+            query = "?limit=2" + (f"&cursor={cursor}" if cursor else "")
+            data = self.client.get(self.url + query).json()
+            self.assertEqual(data["run_id"], str(self.batch.run_id))
+            seen.extend(row["id"] for row in data["results"])
+            cursor = data["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(seen, sorted(seen))
+        self.assertEqual(len(seen), 5)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url + f"?limit=2&cursor={seen[2]}")
+        sql = queries.captured_queries[-1]["sql"]
+        self.assertNotIn("OFFSET", sql)
+
+    def test_pairs_filters_context_and_run(self):
+        data = self.client.get(self.url + "?gender=woman").json()
+        self.assertEqual(len(data["results"]), 2)
+        self.assertEqual(data["results"][0]["winner"], "Z")
+        self.assertEqual(data["results"][0]["context"], {"gender": "woman"})
+
+        data = self.client.get(self.url + f"?run_id={self.old.run_id}").json()
+        self.assertEqual([r["choice_b"] for r in data["results"]], ["Y"])
+
+    def test_pairs_columnar(self):
+        data = self.client.get(self.url + "?columnar=true&gender=man").json()
+        columns = data["columns"]
+        self.assertEqual(len(columns["id"]), 3)
+        self.assertEqual({data["choices"][w] for w in columns["winner"]}, {"X"})
+        self.assertEqual(
+            [data["contexts"][str(c)] for c in columns["context"]], [{"gender": "man"}] * 3
+        )
+
+
+class AnalyticsTests(TestCase):
+    def setUp(self):
+        self.question = Question.objects.create(
+            text="q", choices=["X", "Y", "Z"], context={"gender": ["man", "woman"]}
+        )
+        rows = [
+            ({"gender": "man"}, {"A": "X", "B": "Y"}, "A", 0.95),
+            ({"gender": "man"}, {"A": "X", "B": "Z"}, "B", 0.5),
+            ({"gender": "woman"}, {"A": "X", "B": "Y"}, "A", None),
+            ({"gender": "woman"}, {"A": "Y", "B": "Z"}, "B", 0.0),
+        ]
+        run_id = uuid.uuid4()
+        for context, choices, choice, confidence in rows:
+            Answer.objects.create(
+                question=self.question,
+                run_id=run_id,
+                context=context,
+                choices=choices,
+                choice=choice,
+                confidence=confidence,
+            )
+        self.frame = analytics.run_frame(self.question, run_id)
+
+    def test_counts_and_heatmap(self):
+        self.assertEqual(analytics.win_counts(self.frame), {"X": 2, "Z": 2})
+        self.assertEqual(
+            analytics.heatmap(self.frame),
+            [[None, 2, 0], [0, None, 0], [1, 1, None]],
+        )
+
+    def test_filter_by_context(self):
+        frame = self.frame.filter({"gender": "woman"})
+        self.assertEqual(analytics.win_counts(frame), {"X": 1, "Z": 1})
+        labels, links = analytics.flows(frame)
+        self.assertEqual(labels, ["X", "Y", "Z"])
+        self.assertEqual(
+            links,
+            [{"from": "X", "to": "Y", "flow": 1}, {"from": "Z", "to": "Y", "flow": 1}],
+        )
+
+    def test_sparse_coverage(self):
+        frame = analytics.PairFrame.from_rows(
+            ["X", "Y", "Z"],
+            [("X", "Y", 3, {}), ("Y", "Z", 3, {})],
+        )
+        matrix = analytics.heatmap(frame)
+        self.assertIsNone(matrix[0][2])
+        self.assertIsNone(matrix[2][0])
+        self.assertEqual(matrix[1][0], 0)
+
+        rankings = analytics.ratings(frame, with_ci=True)
+        self.assertEqual([r["choice"] for r in rankings], ["X", "Y", "Z"])
+        self.assertEqual({r["choice"]: r["games"] for r in rankings}, {"X": 3, "Y": 6, "Z": 3})
+        self.assertTrue(all(np.isfinite(r["ci_high"]) for r in rankings))
+
+    def test_bradley_terry_is_order_independent(self):
+        matrix = np.array([[0, 3, 4], [1, 0, 2], [0, 2, 0]])
+        theta = analytics.bradley_terry(matrix)
+        self.assertEqual(list(np.argsort(-theta)), [0, 1, 2])
+        self.assertAlmostEqual(theta.sum(), 0)
+
+        order = [2, 0, 1]
+        shuffled = analytics.bradley_terry(matrix[np.ix_(order, order)])
+        np.testing.assert_allclose(shuffled, theta[order], atol=1e-6)
+
+    def test_bradley_terry_matches_mm_updates(self):
+        rng = np.random.default_rng(0)
+        matrix = rng.integers(0, 5, size=(12, 12)) * (rng.random((12, 12)) < 0.3)
+        np.fill_diagonal(matrix, 0)
+        matrix[0, 1:] += 20  # one dominant choice
+
+        prior = analytics.BT_PRIOR
+        wins = matrix.sum(axis=1) + prior
+        games = (matrix + matrix.T).astype(float)
+        strength = np.ones(len(matrix))
+        for _ in range(20_000):
+            pair_sums = strength[:, None] + strength[None, :]
+            strength = wins / ((games / pair_sums).sum(axis=1) + 2 * prior / (strength + 1))
+        expected = np.log(strength) - np.log(strength).mean()
+
+        np.testing.assert_allclose(analytics.bradley_terry(matrix), expected, atol=1e-8)
+
+    def test_ratings_with_confidence_intervals(self):
+        rankings = analytics.ratings(self.frame, with_ci=True)
+        self.assertEqual([r["choice"] for r in rankings][0], "Z")
+        for row in rankings:
+            self.assertLess(row["ci_low"], row["rating"])
+            self.assertGreater(row["ci_high"], row["rating"])
+
+    def test_confidence_histogram(self):
+        confidence = analytics.answer_confidences(Answer.objects.all())
+        bins = analytics.confidence_histogram(confidence)
+        self.assertEqual(bins, [1, 0, 0, 0, 0, 1, 0, 0, 0, 1])
+
 
 class QuestionAPITests(TestCase):
     def test_create_question(self):
@@ -425,6 +1710,49 @@ class QuestionAPITests(TestCase):
         self.assertEqual(q.choices, payload["choices"])
 
 
+    @override_settings(
+        POLL_OPENAI_PRICES={"gpt-4o-mini": {"input": 1.0, "cached_input": 0.5, "output": 4.0}}
+    )
+    def test_usage_endpoint_sums_tokens_per_run(self):
+        q = Question.objects.create(text="q", choices=["A", "B"])
+        old_run, new_run = uuid.uuid4(), uuid.uuid4()
+        counts = {"total": 2, "completed": 2, "failed": 0}
+        for run_id, tokens in [(old_run, 100), (new_run, 1_000_000), (new_run, 1_000_000)]:
+            OpenAIBatch.objects.create(
+                question=q,
+                run_id=run_id,
+                data={"status": "completed", "request_counts": counts,
+                      "created_at": 0, "completed_at": 10},
+                prompt_tokens=tokens,
+                cached_tokens=tokens // 2,
+                completion_tokens=tokens // 10,
+            )
+
+        response = self.client.get(f"/api/questions/{q.uuid}/usage")
+
+        self.assertEqual(response.status_code, 200)
+        runs = response.json()["runs"]
+        self.assertEqual([r["run_id"] for r in runs], [str(new_run), str(old_run)])
+        latest = runs[0]
+        self.assertEqual(latest["batches"], 2)
+        self.assertEqual(latest["requests"], 4)
+        self.assertEqual(latest["prompt_tokens"], 2_000_000)
+        self.assertEqual(latest["cache_hit_rate"], 0.5)
+        self.assertEqual(latest["requests_per_second"], 0.4)
+        # 1M uncached at $1 + 1M cached at $0.50 + 200k output at $4.
+        self.assertAlmostEqual(latest["cost"], 2.3)
+
+    def test_usage_cost_is_null_without_prices(self):
+        q = Question.objects.create(text="q", choices=["A", "B"])
+        OpenAIBatch.objects.create(question=q, data={"status": "completed"}, prompt_tokens=10)
+
+        with self.settings(POLL_OPENAI_PRICES={}):
+            runs = self.client.get(f"/api/questions/{q.uuid}/usage").json()["runs"]
+
+        self.assertIsNone(runs[0]["cost"])
+        self.assertEqual(runs[0]["prompt_tokens"], 10)
+
+
 class BatchAPITests(TestCase):
     def test_update_status_endpoint(self):
         q = Question.objects.create(text="q", choices=["A", "B"])
@@ -446,6 +1774,263 @@ class BatchAPITests(TestCase):
         batch.refresh_from_db()
         self.assertEqual(batch.status, "completed")
 
+    def test_update_status_endpoint_defers_import(self):
+        q = Question.objects.create(text="q", choices=["A", "B"])
+        batch = OpenAIBatch.objects.create(question=q, data={"id": "b1", "status": "running"})
+        mock_client = Mock()
+        mock_client.batches.retrieve.return_value = Mock(
+            model_dump=Mock(
+                return_value={"id": "b1", "status": "completed", "output_file_id": "file_1"}
+            )
+        )
+        mock_output_file(
+            mock_client,
+            json.dumps({
+                "custom_id": f"q{q.pk}:0:0:1",
+                "response": {"body": {"choices": [
+                    {"message": {"content": "{\"answer\":\"A\",\"confidence\":0.9}"}}
+                ]}},
+            }),
+        )
+
+        with patch("poll.main.models.openai.OpenAI", return_value=mock_client):
+            response = self.client.post(f"/api/batches/{batch.batch_id}/update-status")
+            self.assertFalse(response.json()["imported"])
+            self.assertEqual(Answer.objects.count(), 0)
+            q.refresh_from_db()
+            self.assertEqual(q.status, "importing")
+
+            job = Job.objects.get(kind="import_batch", batch=batch)
+            self.assertEqual(self.client.get(f"/api/jobs/{job.pk}").json()["status"], "queued")
+            Worker().run(burst=True)
+
+        self.assertEqual(Answer.objects.count(), 1)
+        q.refresh_from_db()
+        self.assertEqual(q.status, "completed")
+
+
+class JobTests(TestCase):
+    def setUp(self):
+        self.question = Question.objects.create(text="q", choices=["A", "B"])
+
+    def test_enqueue_returns_the_queued_job(self):
+        first = Job.enqueue("submit_batches", question=self.question)
+        second = Job.enqueue("submit_batches", question=self.question)
+        self.assertEqual(first, second)
+
+    def test_enqueue_rejects_other_options(self):
+        Job.enqueue("submit_batches", question=self.question, incremental=True)
+        with self.assertRaises(ValueError):
+            Job.enqueue("submit_batches", question=self.question)
+        self.assertEqual(Job.objects.count(), 1)
+
+    def test_job_is_claimed_by_one_worker(self):
+        Job.enqueue("submit_batches", question=self.question)
+        self.assertIsNotNone(jobs.claim("worker-1"))
+        self.assertIsNone(jobs.claim("worker-2"))
+
+    @override_settings(POLL_JOB_RETRY_DELAY=10)
+    def test_failed_job_is_retried_with_backoff_then_fails(self):
+        job = Job.enqueue("submit_batches", question=self.question, max_attempts=2)
+        with patch.object(Question, "submit_batches", side_effect=RuntimeError("boom")):
+            jobs.run_job(jobs.claim("worker"))
+            job.refresh_from_db()
+            self.assertEqual(job.status, "queued")
+            self.assertIn("boom", job.last_error)
+            self.assertEqual(job.as_dict()["last_error"], "RuntimeError: boom")
+            response = self.client.get(f"/api/jobs/{job.pk}")
+            self.assertNotIn("Traceback", response.json()["last_error"])
+            self.assertGreater(job.run_after, timezone.now() + timezone.timedelta(seconds=5))
+            self.assertIsNone(jobs.claim("worker"))
+
+            Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+            jobs.run_job(jobs.claim("worker"))
+
+        job.refresh_from_db()
+        self.question.refresh_from_db()
+        self.assertEqual(job.status, "failed")
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(self.question.status, "failed")
+
+    @override_settings(POLL_JOB_TIMEOUT=60)
+    def test_abandoned_job_is_claimed_again(self):
+        job = Job.enqueue("submit_batches", question=self.question)
+        jobs.claim("crashed")
+        self.assertIsNone(jobs.claim("worker"))
+
+        Job.objects.filter(pk=job.pk).update(
+            locked_at=timezone.now() - timezone.timedelta(minutes=5)
+        )
+        claimed = jobs.claim("worker")
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertEqual(claimed.locked_by, "worker")
+        self.assertEqual(claimed.attempts, 2)
+
+
+class BatchPollerTests(TestCase):
+    def test_polls_only_unfinished_batches(self):
+        q = Question.objects.create(text="q", choices=["A", "B"])
+        for data in [
+            {"id": "running", "status": "in_progress"},
+            {"id": "new"},
+            {"id": "done", "status": "completed"},
+            {"id": "failed", "status": "failed"},
+            {},
+        ]:
+            OpenAIBatch.objects.create(question=q, data=data, imported_at=timezone.now())
+
+        mock_client = Mock()
+        mock_client.batches.retrieve.side_effect = lambda batch_id: Mock(
+            model_dump=Mock(return_value={"id": batch_id, "status": "in_progress"})
+        )
+        poller = BatchPoller(client=mock_client)
+
+        self.assertEqual(poller.poll_once(), 2)
+        polled = {c.args[0] for c in mock_client.batches.retrieve.call_args_list}
+        self.assertEqual(polled, {"running", "new"})
+        # Nothing is due again until the backoff interval has passed.
+        self.assertEqual(poller.poll_once(), 0)
+
+    def test_retries_imports_that_failed(self):
+        q = Question.objects.create(text="q", choices=["A", "B"], status="importing")
+        batch = OpenAIBatch.objects.create(
+            question=q,
+            data={"id": "batch_1", "status": "completed", "output_file_id": "file_1"},
+        )
+        other = OpenAIBatch.objects.create(
+            question=q,
+            data={"id": "batch_2", "status": "completed", "output_file_id": "file_2"},
+        )
+        client = Mock()
+        client.files.with_streaming_response.content.side_effect = RuntimeError("download failed")
+
+        poller = BatchPoller(client=client)
+        poller.poll_once()
+        poller.import_pending()
+
+        # Both imports were attempted, and no status was retrieved again.
+        self.assertEqual(client.files.with_streaming_response.content.call_count, 2)
+        client.batches.retrieve.assert_not_called()
+
+        mock_output_file(client, json.dumps({
+            "custom_id": f"q{q.pk}-A-B",
+            "response": {"body": {"choices": [
+                {"message": {"content": "{\"answer\":\"A\",\"confidence\":0.9}"}}
+            ]}},
+        }))
+        client.files.with_streaming_response.content.side_effect = None
+        restarted = BatchPoller(client=client)
+        self.assertEqual(restarted.pending_batches().count(), 2)
+        restarted.poll_once()
+        restarted.import_pending()
+
+        batch.refresh_from_db()
+        other.refresh_from_db()
+        q.refresh_from_db()
+        self.assertIsNotNone(batch.imported_at)
+        self.assertIsNotNone(other.imported_at)
+        self.assertEqual(q.status, "completed")
+        self.assertFalse(restarted.pending_batches().exists())
+
+    def test_deferred_retry_does_not_queue_a_second_import_job(self):
+        q = Question.objects.create(text="q", choices=["A", "B"])
+        batch = OpenAIBatch.objects.create(
+            question=q,
+            data={"id": "batch_1", "status": "completed", "output_file_id": "file_1"},
+        )
+        job = Job.enqueue("import_batch", question=q, batch=batch)
+        Job.objects.filter(pk=job.pk).update(status="running")
+
+        BatchPoller(client=Mock(), defer_imports=True).poll_once()
+        self.assertEqual(Job.objects.count(), 1)
+
+        Job.objects.filter(pk=job.pk).update(status="failed")
+        BatchPoller(client=Mock(), defer_imports=True).poll_once()
+        self.assertEqual(Job.objects.filter(status="queued").count(), 1)
+
+    def test_interval_adapts_to_progress(self):
+        poller = BatchPoller(client=Mock(), min_interval=10, max_interval=1000)
+        now = 10_000
+        fresh = OpenAIBatch(data={"status": "validating", "created_at": now - 60})
+        old = OpenAIBatch(data={"status": "in_progress", "created_at": now - 3600})
+        nearly_done = OpenAIBatch(data={
+            "status": "in_progress",
+            "in_progress_at": now - 900,
+            "request_counts": {"total": 100, "completed": 90, "failed": 0},
+        })
+
+        self.assertEqual(poller.interval(fresh, now), 15)
+        self.assertEqual(poller.interval(old, now), 900)
+        self.assertEqual(poller.interval(nearly_done, now), 50)
+
+
+class FakeOpenAITests(TestCase):
+    def setUp(self):
+        self.server = make_server(FakeOpenAI(latency=0, rate=1e9, seed=0))
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def test_submit_poll_and_import_end_to_end(self):
+        q = Question.objects.create(
+            text="Where to travel?",
+            context={"gender": ["man", "woman"]},
+            choices=["Turkey", "Mexico", "Chile"],
+        )
+        with self.settings(OPENAI_BASE_URL=base_url(self.server)):
+            client = openai_client(api_key="test", max_retries=0)
+        q.submit_batches(client=client)
+
+        batch = q.openai_batches.get()
+        self.assertEqual(batch.data["request_counts"]["total"], 6)
+
+        poller = BatchPoller(client=client)
+        poller.poll_once()
+        poller.import_pending()
+
+        batch.refresh_from_db()
+        q.refresh_from_db()
+        self.assertEqual(batch.status, "completed")
+        self.assertEqual(q.status, "completed")
+        self.assertEqual(Answer.objects.filter(question=q, run_id=batch.run_id).count(), 6)
+        self.assertGreater(batch.prompt_tokens, 0)
+
+    def test_run_importer_parses_files_in_worker_processes(self):
+        q = Question.objects.create(
+            text="q", context={"gender": ["man", "woman"]}, choices=["A", "B", "C"]
+        )
+        fake = self.server.fake
+        run_id = uuid.uuid4()
+        for i, fh in enumerate(q.openai_batch_files(max_lines=2)):
+            with fh:
+                file = fake.create_file(f"{i}.jsonl", "batch", fh.read())
+            created = fake.create_batch(file["id"], "/v1/chat/completions", "24h")
+            OpenAIBatch.objects.create(
+                question=q, run_id=run_id, snapshot=q.snapshot(), data=fake.batch(created["id"])
+            )
+
+        with self.settings(OPENAI_BASE_URL=base_url(self.server)), patch.dict(
+            "os.environ", {"OPENAI_API_KEY": "test"}
+        ):
+            stats = RunImporter(q, run_id, processes=2).run()
+
+        self.assertEqual(stats.answers, 6)
+        self.assertEqual(Answer.objects.filter(question=q, run_id=run_id).count(), 6)
+        self.assertFalse(q.openai_batches.filter(imported_at__isnull=True).exists())
+
+    def test_failed_requests_go_to_the_error_file(self):
+        fake = FakeOpenAI(latency=0, rate=1e9, failure_rate=1.0)
+        file = fake.create_file("in.jsonl", "batch", b'{"custom_id": "x", "body": {}}\n')
+        batch = fake.create_batch(file["id"], "/v1/chat/completions", "24h")
+
+        batch = fake.batch(batch["id"])
+
+        self.assertEqual(batch["status"], "completed")
+        self.assertEqual(batch["request_counts"], {"total": 1, "completed": 0, "failed": 1})
+        self.assertEqual(fake.file_content(batch["output_file_id"]), b"")
+        self.assertIn(b"Simulated failure", fake.file_content(batch["error_file_id"]))
+
 
 class ManagementCommandTests(TestCase):
     def test_update_openai_batches_command(self):
@@ -472,7 +2057,7 @@ class ManagementCommandTests(TestCase):
         mock_client.batches.retrieve.return_value = Mock(
             model_dump=Mock(return_value={"id": batch.batch_id, "status": "completed", "output_file_id": "file_1"})
         )
-        mock_client.files.content.return_value = Mock(text=result_line + "\n")
+        mock_output_file(mock_client, result_line + "\n")
 
         with patch("poll.main.models.openai.OpenAI", return_value=mock_client):
             call_command("update_openai_batches")
@@ -480,3 +2065,51 @@ class ManagementCommandTests(TestCase):
         batch.refresh_from_db()
         self.assertEqual(batch.status, "completed")
         self.assertEqual(Answer.objects.count(), 1)
+
+    def test_benchmark_pipeline_command_writes_results(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = Path(tmp) / "results.json"
+            call_command(
+                "benchmark_pipeline",
+                sizes="20",
+                choices=3,
+                dimensions=1,
+                output=str(output),
+                stdout=StringIO(),
+            )
+            report = json.loads(output.read_text())
+
+        stages = {r["stage"]: r for r in report["results"]}
+        self.assertEqual(stages["import"]["answers"], 21)
+        self.assertIn("chart:dashboard", stages)
+        self.assertIn("chart:dashboard:cached", stages)
+        self.assertEqual(stages["import"]["memory_source"], "tracemalloc")
+        self.assertGreater(stages["import"]["memory_kb"], 0)
+        self.assertFalse(Question.objects.exists())
+
+    def test_benchmark_pipeline_compares_memory(self):
+        stdout = StringIO()
+        command = Benchmark(stdout=stdout)
+        command.results = [
+            {"size": 10, "stage": "import", "seconds": 1.0,
+             "memory_kb": 4096, "memory_source": "tracemalloc"},
+            {"size": 10, "stage": "chart:dashboard", "seconds": 1.0,
+             "memory_kb": 4096, "memory_source": "rss"},
+        ]
+        baseline = [
+            {"size": 10, "stage": "import", "seconds": 1.0,
+             "memory_kb": 2048, "memory_source": "tracemalloc"},
+            {"size": 10, "stage": "chart:dashboard", "seconds": 1.0,
+             "memory_kb": 2048, "memory_source": "tracemalloc"},
+        ]
+
+        self.assertEqual(command.compare(baseline, 0.2), 1)
+        lines = stdout.getvalue().splitlines()
+        self.assertIn("memory   2.00x  REGRESSION (memory)", lines[0])
+        # Figures measured differently are not compared.
+        self.assertNotIn("memory", lines[1])
+
+    def test_benchmark_sqlite_command_needs_a_database_file(self):
+        # The test database lives in memory, which WAL does not apply to.
+        with self.assertRaisesMessage(CommandError, "file based SQLite"):
+            call_command("benchmark_sqlite", answers=10, stdout=StringIO())
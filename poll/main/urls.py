@@ -5,7 +5,8 @@ from . import views
 app_name = 'polls'
 
 urlpatterns = [
-    path('<uuid:uuid>/answers.csv', views.question_answers_csv, name='question_answers_csv'),
+    path('<uuid:uuid>/answers.csv', views.question_answers_export, {'fmt': 'csv'}, name='question_answers_csv'),
+    path('<uuid:uuid>/answers.<str:fmt>', views.question_answers_export, name='question_answers_export'),
     path('create/', views.question_create, name='question_create'),
     path('<uuid:uuid>/review/', views.question_review, name='question_review'),
     path('<uuid:uuid>/toggle-archive/', views.question_toggle_archive, name='question_toggle_archive'),
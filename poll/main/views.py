@@ -1,11 +1,10 @@
 from django.shortcuts import get_object_or_404, render, redirect
-from django.http import HttpResponse
+from django.http import Http404
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
 from django.urls import reverse
-import csv
-import json
-
-from .models import Question
+from . import exports
+from .models import Job, Question
 from .forms import QuestionForm
 
 
@@ -51,14 +50,14 @@ def question_list(request):
 @login_required
 def question_results(request, uuid):
     question = get_object_or_404(Question, uuid=uuid)
-    rendered_questions = question.render_all_questions()
-    num_variations = len(rendered_questions)
-    choice_pairs = question.choice_pairs()
-    total_queries = len(rendered_questions) * len(choice_pairs)
+    plan = question.plan()
+    num_variations = plan.combinations
+    total_queries = plan.lines
     batches = question.openai_batches.all().order_by("-created_at")
     latest_batch = batches.first()
     batch_total_queries = latest_batch.request_count_total if latest_batch else None
     batch_duration = latest_batch.duration_seconds if latest_batch else None
+    usage = question.usage_by_run()
 
     answers = question.latest_answers()
     has_answers = answers.exists()
@@ -70,32 +69,22 @@ def question_results(request, uuid):
         "batches": batches,
         "batch_total_queries": batch_total_queries,
         "batch_duration": batch_duration,
+        "usage": usage,
         "has_answers": has_answers,
+        "export_formats": exports.available_formats(),
     }
     return render(request, "main/question_results.html", context)
 
 
 @login_required
-def question_answers_csv(request, uuid):
+def question_answers_export(request, uuid, fmt="csv"):
+    """Stream the latest run's answers as CSV, NDJSON, Parquet or Arrow."""
     question = get_object_or_404(Question, uuid=uuid)
-
-    answers = question.latest_answers()
-
-    response = HttpResponse(content_type="text/csv")
-    response["Content-Disposition"] = "attachment; filename=answers.csv"
-    writer = csv.writer(response)
-    writer.writerow(["question", "context", "choices", "choice", "confidence", "run_id"])
-    for ans in answers:
-        writer.writerow([
-            ans.question.text,
-            json.dumps(ans.context, ensure_ascii=False),
-            json.dumps(ans.choices, ensure_ascii=False),
-            ans.choice,
-            ans.confidence,
-            ans.run_id,
-        ])
-
-    return response
+    answers = question.latest_answers().order_by("pk")
+    try:
+        return exports.export_response(answers, fmt)
+    except ValueError as exc:
+        raise Http404(str(exc))
 
 
 @login_required
@@ -125,25 +114,39 @@ def question_review(request, uuid):
     """Display a read-only summary of the question and submit batches."""
     question = get_object_or_404(Question, uuid=uuid)
 
-    rendered = question.render_all_questions()
-    num_variations = len(rendered)
-    choice_pairs = question.choice_pairs()
-    total_queries = num_variations * len(choice_pairs)
+    plan = question.plan()
+    error = None
 
     if request.method == "POST":
-        question.status = "queued"
-        question.save(update_fields=["status"])
-        question.submit_batches()
-        return redirect("polls:question_list")
+        try:
+            with transaction.atomic():
+                question.status = "queued"
+                question.save(update_fields=["status"])
+                # Submitting is not idempotent, so a failed submission is not retried.
+                Job.enqueue(
+                    "submit_batches",
+                    question=question,
+                    max_attempts=1,
+                    incremental=bool(request.POST.get("incremental")),
+                )
+        except ValueError as exc:
+            question.refresh_from_db(fields=["status"])
+            error = str(exc)
+        else:
+            return redirect("polls:question_list")
 
     return render(
         request,
         "main/question_review.html",
         {
             "question": question,
-            "num_variations": num_variations,
-            "num_choice_pairs": len(choice_pairs),
-            "total_queries": total_queries,
+            "num_variations": plan.combinations,
+            "num_choice_pairs": plan.pairs,
+            "total_queries": plan.lines,
+            "sampled_queries": question.request_budget(),
+            "can_extend": question.last_completed_run() is not None,
+            "plan": plan.as_dict(),
+            "error": error,
         },
     )
 
@@ -65,10 +65,52 @@ WSGI_APPLICATION = 'poll.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
+# SQLite for development and small deployments, tuned per connection with
+# POLL_SQLITE_PRAGMAS below. Set POLL_DATABASE=postgres and the libpq
+# variables PGDATABASE, PGUSER, PGPASSWORD, PGHOST and PGPORT for
+# production; see docs/postgres.md. Connections persist for
+# POSTGRES_CONN_MAX_AGE seconds, or come from psycopg's pool of up to
+# POSTGRES_POOL_SIZE connections when POSTGRES_POOL=1.
+
+if os.environ.get('POLL_DATABASE') == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('PGDATABASE', 'poll'),
+            'USER': os.environ.get('PGUSER', ''),
+            'PASSWORD': os.environ.get('PGPASSWORD', ''),
+            'HOST': os.environ.get('PGHOST', ''),
+            'PORT': os.environ.get('PGPORT', ''),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+    }
+    if os.environ.get('POSTGRES_POOL'):
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': 2,
+            'max_size': int(os.environ.get('POSTGRES_POOL_SIZE', 10)),
+        }
+    else:
+        DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('POSTGRES_CONN_MAX_AGE', 60))
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            # Take the write lock when a transaction starts, so concurrent
+            # importers wait for each other instead of failing with
+            # "database is locked" when they start writing.
+            'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
+        }
+    }
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
@@ -113,3 +155,58 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Poll
+
+# Number of answers written per bulk insert when importing batch results.
+POLL_IMPORT_CHUNK_SIZE = 2000
+
+# Bulk-load mode: commit the answers and checkpoint of this many chunks in
+# one transaction instead of one per chunk. Faster, but an interrupted
+# import repeats more work and readers see the answers in larger steps.
+POLL_IMPORT_BULK = False
+POLL_IMPORT_BULK_CHUNKS = 10
+
+# Write imported answers with COPY FROM STDIN instead of INSERT when the
+# database is PostgreSQL (psycopg 3).
+POLL_IMPORT_COPY = True
+
+# Base URL of the OpenAI API, e.g. http://127.0.0.1:8765/v1 for the local
+# simulation served by `manage.py fake_openai`. Unset uses the default.
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL") or None
+
+# Concurrent OpenAI requests used when submitting batches.
+POLL_OPENAI_CONCURRENCY = 8
+
+# Seconds a computed chart response stays in the cache.
+POLL_CHART_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Answers read and encoded per chunk when streaming exports.
+POLL_EXPORT_CHUNK_SIZE = 5000
+
+# Background jobs: attempts before a job fails, the first retry delay in
+# seconds (doubled per attempt, up to the maximum), and the seconds after
+# which a running job is considered abandoned and run again.
+POLL_JOB_MAX_ATTEMPTS = 5
+POLL_JOB_RETRY_DELAY = 30
+POLL_JOB_MAX_RETRY_DELAY = 60 * 60
+POLL_JOB_TIMEOUT = 6 * 60 * 60
+
+# Token prices used to cost runs, in USD per million tokens, e.g.
+# {"gpt-4o-mini": {"input": ..., "cached_input": ..., "output": ...}}.
+# Use the batch rates of the models you submit to; runs are not costed
+# for models missing here.
+POLL_OPENAI_PRICES = {}
+
+# Pragmas run on every new SQLite connection. WAL lets chart reads proceed
+# while an import writes; synchronous=normal is durable in WAL mode except
+# for the last commits before a power loss. cache_size is in KiB when
+# negative. Set to {} to keep SQLite's defaults.
+POLL_SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'busy_timeout': 5000,
+}